@@ -1,11 +1,22 @@
 import socket
 import json
+import struct
+
+import numpy as np
 
 from rlgym_sim.utils.gamestates import GameState
 
 UDP_IP = "127.0.0.1"
 UDP_PORT = 9273 # Default RocketSimVis port
 
+# Send the compact binary format instead of JSON (see networking-format-binary.md)
+# Much cheaper to encode and for the visualizer to decode, but doesn't carry rewards or custom info
+USE_BINARY_FORMAT = False
+
+# Id of this env, when several envs send to one visualizer (switch between them with E in the visualizer)
+# Set it per env process, e.g. from the env's seed or index, or pass env_id to send_state_to_rocketsimvis()
+ENV_ID = None
+
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # UDP
 
 def write_physobj(physobj):
@@ -32,9 +43,13 @@ def write_car(player):
 
 	return j
 
-def send_state_to_rocketsimvis(gs: GameState):
+def encode_state_json(gs: GameState, env_id = None) -> bytes:
 	j = {}
 	
+	# Sent first, so the visualizer can find it without parsing the whole state
+	if not (env_id is None):
+		j['env_id'] = int(env_id)
+	
 	# Send ball
 	j['ball_phys'] = write_physobj(gs.ball)
 	
@@ -46,4 +61,205 @@ def send_state_to_rocketsimvis(gs: GameState):
 	# Send boost pad states
 	j['boost_pad_states'] = gs.boost_pads.tolist()
 
-	sock.sendto(json.dumps(j).encode('utf-8'), (UDP_IP, UDP_PORT))
\ No newline at end of file
+	return json.dumps(j).encode('utf-8')
+
+########################################################################
+# Binary format (must match src/binary_format.py in RocketSimVis)
+
+BINARY_MAGIC = b"RSVB"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sBBBBHHI")
+BINARY_FLAG_HAS_PAD_STATES = 1 << 0
+BINARY_FLAG_HAS_ENV_ID = 1 << 1
+BINARY_ENV_ID = struct.Struct("<I")
+BINARY_PHYS_FLAG_HAS_ROT = 1 << 0
+BINARY_CAR_FLAG_ON_GROUND = 1 << 1
+BINARY_CAR_FLAG_IS_DEMOED = 1 << 2
+
+BINARY_PHYS_DTYPE = np.dtype([
+	("pos", "<f4", (3,)),
+	("forward", "<f4", (3,)),
+	("up", "<f4", (3,)),
+	("vel", "<f4", (3,)),
+	("ang_vel", "<f4", (3,)),
+])
+BINARY_BALL_DTYPE = np.dtype([
+	("flags", "<u1"),
+	("reserved", "<u1", (3,)),
+	("phys", BINARY_PHYS_DTYPE),
+])
+BINARY_CAR_DTYPE = np.dtype([
+	("car_id", "<i4"),
+	("team_num", "<u1"),
+	("flags", "<u1"),
+	("reserved", "<u2"),
+	("boost_amount", "<f4"),
+	("phys", BINARY_PHYS_DTYPE),
+])
+
+def write_physobj_binary(rec, physobj):
+	rec['pos'] = physobj.position
+	rec['forward'] = physobj.forward()
+	rec['up'] = physobj.up()
+	rec['vel'] = physobj.linear_velocity
+	rec['ang_vel'] = physobj.angular_velocity
+
+def encode_state_binary(gs: GameState, env_id = None) -> bytes:
+	ball = np.zeros(1, dtype=BINARY_BALL_DTYPE)
+	ball['flags'] = BINARY_PHYS_FLAG_HAS_ROT
+	write_physobj_binary(ball['phys'][0], gs.ball)
+
+	cars = np.zeros(len(gs.players), dtype=BINARY_CAR_DTYPE)
+	for i, player in enumerate(gs.players):
+		rec = cars[i]
+		rec['car_id'] = player.car_id
+		rec['team_num'] = player.team_num
+		rec['flags'] = (
+			BINARY_PHYS_FLAG_HAS_ROT
+			| (BINARY_CAR_FLAG_ON_GROUND if player.on_ground else 0)
+			| (BINARY_CAR_FLAG_IS_DEMOED if player.is_demoed else 0)
+		)
+		rec['boost_amount'] = player.boost_amount * 100
+		write_physobj_binary(rec['phys'], player.car_data)
+
+	pad_states = np.asarray(gs.boost_pads) > 0
+	pad_mask = np.packbits(pad_states, bitorder="little")
+
+	flags = BINARY_FLAG_HAS_PAD_STATES
+	env_bytes = b""
+	if not (env_id is None):
+		flags |= BINARY_FLAG_HAS_ENV_ID
+		env_bytes = BINARY_ENV_ID.pack(int(env_id))
+
+	header = BINARY_HEADER.pack(
+		BINARY_MAGIC, BINARY_VERSION, flags,
+		0, # Gamemode (soccar)
+		0, len(cars), len(pad_states), 0
+	)
+	return header + env_bytes + ball.tobytes() + cars.tobytes() + pad_mask.tobytes()
+
+def send_state_to_rocketsimvis(gs: GameState, env_id = None):
+	if env_id is None:
+		env_id = ENV_ID
+
+	if USE_BINARY_FORMAT:
+		data = encode_state_binary(gs, env_id)
+	else:
+		data = encode_state_json(gs, env_id)
+
+	send_packet_to_rocketsimvis(data)
+
+########################################################################
+# Batch format, the states of many envs in one datagram (see "Batch packets" in networking-format-binary.md)
+# For vectorized envs, where sending a packet per env per step would be thousands of sends a second
+
+BINARY_BATCH_MAGIC = b"RSVM"
+BINARY_BATCH_VERSION = 1
+BINARY_BATCH_HEADER = struct.Struct("<4sBBHI")
+
+# Largest UDP payload, bigger batches are sent as several datagrams
+MAX_DATAGRAM_SIZE = 65507
+
+def binary_packet_dtype(num_cars: int, num_pads: int) -> np.dtype:
+	"""Layout of a binary packet with an env id and pad states, the envs of a batch are an array of these"""
+	return np.dtype([
+		("header", "V%d" % BINARY_HEADER.size),
+		("env_id", "<u4"),
+		("ball", BINARY_BALL_DTYPE),
+		("cars", BINARY_CAR_DTYPE, (num_cars,)),
+		("pad_mask", "<u1", ((num_pads + 7) // 8,)),
+	])
+
+def write_phys_arrays_binary(rec, phys: np.ndarray):
+	rec['pos'] = phys[..., 0:3]
+	rec['forward'] = phys[..., 3:6]
+	rec['up'] = phys[..., 6:9]
+	rec['vel'] = phys[..., 9:12]
+	rec['ang_vel'] = phys[..., 12:15]
+
+def encode_states_batch(ball_phys: np.ndarray, car_phys: np.ndarray, car_teams: np.ndarray,
+		car_boost: np.ndarray = None, car_on_ground: np.ndarray = None, car_is_demoed: np.ndarray = None,
+		pad_states: np.ndarray = None, env_ids: np.ndarray = None) -> list:
+	"""
+	Encode the states of M envs with C cars and P boost pads each, straight from stacked arrays:
+		ball_phys: [M, 15] floats of pos, forward, up, vel and ang_vel
+		car_phys: [M, C, 15] floats, the same as ball_phys
+		car_teams: [M, C] team numbers
+		car_boost: [M, C] boost amounts from 0 to 100
+		car_on_ground, car_is_demoed: [M, C] bools
+		pad_states: [M, P] bools, True if the pad is active
+		env_ids: [M] env ids, 0 to M-1 if not given
+	Returns the batch packets to send, more than one if they don't fit in a single datagram.
+	"""
+	ball_phys = np.asarray(ball_phys, dtype=np.float32)
+	car_phys = np.asarray(car_phys, dtype=np.float32)
+	num_envs, num_cars = car_phys.shape[:2]
+	num_pads = 0 if pad_states is None else np.shape(pad_states)[1]
+
+	packets = np.zeros(num_envs, dtype=binary_packet_dtype(num_cars, num_pads))
+
+	flags = BINARY_FLAG_HAS_ENV_ID | (BINARY_FLAG_HAS_PAD_STATES if num_pads > 0 else 0)
+	packets['header'] = np.void(BINARY_HEADER.pack(
+		BINARY_MAGIC, BINARY_VERSION, flags,
+		0, # Gamemode (soccar)
+		0, num_cars, num_pads, 0
+	))
+	packets['env_id'] = np.arange(num_envs) if env_ids is None else env_ids
+
+	packets['ball']['flags'] = BINARY_PHYS_FLAG_HAS_ROT
+	write_phys_arrays_binary(packets['ball']['phys'], ball_phys)
+
+	cars = packets['cars']
+	cars['car_id'] = np.arange(1, num_cars + 1)
+	cars['team_num'] = car_teams
+	car_flags = np.full((num_envs, num_cars), BINARY_PHYS_FLAG_HAS_ROT, dtype=np.uint8)
+	if not (car_on_ground is None):
+		car_flags |= np.where(car_on_ground, BINARY_CAR_FLAG_ON_GROUND, 0).astype(np.uint8)
+	if not (car_is_demoed is None):
+		car_flags |= np.where(car_is_demoed, BINARY_CAR_FLAG_IS_DEMOED, 0).astype(np.uint8)
+	cars['flags'] = car_flags
+	if not (car_boost is None):
+		cars['boost_amount'] = car_boost
+	write_phys_arrays_binary(cars['phys'], car_phys)
+
+	if num_pads > 0:
+		packets['pad_mask'] = np.packbits(np.asarray(pad_states) > 0, axis=1, bitorder="little")
+
+	envs_per_batch = max((MAX_DATAGRAM_SIZE - BINARY_BATCH_HEADER.size) // packets.dtype.itemsize, 1)
+	batches = []
+	for start in range(0, num_envs, envs_per_batch):
+		batch_packets = packets[start:start + envs_per_batch]
+		header = BINARY_BATCH_HEADER.pack(BINARY_BATCH_MAGIC, BINARY_BATCH_VERSION, 0, 0, len(batch_packets))
+		batches.append(header + batch_packets.tobytes())
+	return batches
+
+def send_states_batch_to_rocketsimvis(*args, **kwargs):
+	"""Send the states of many envs at once, takes the same arguments as encode_states_batch()"""
+	for data in encode_states_batch(*args, **kwargs):
+		send_packet_to_rocketsimvis(data)
+
+########################################################################
+# Fragments, for packets too big for one datagram (see "Large packets" in networking-format.md)
+# Must match src/packet_fragments.py in RocketSimVis
+
+FRAGMENT_MAGIC = b"RSVF"
+FRAGMENT_VERSION = 1
+FRAGMENT_HEADER = struct.Struct("<4sBBHHI")
+
+fragment_seq = 0
+
+def send_packet_to_rocketsimvis(data: bytes):
+	"""Send an encoded packet, as several fragments if it doesn't fit in one datagram"""
+	global fragment_seq
+
+	if len(data) <= MAX_DATAGRAM_SIZE:
+		sock.sendto(data, (UDP_IP, UDP_PORT))
+		return
+
+	fragment_size = MAX_DATAGRAM_SIZE - FRAGMENT_HEADER.size
+	count = (len(data) + fragment_size - 1) // fragment_size
+	view = memoryview(data)
+	for i in range(count):
+		header = FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, FRAGMENT_VERSION, 0, i, count, fragment_seq)
+		sock.sendto(header + view[i * fragment_size:(i + 1) * fragment_size], (UDP_IP, UDP_PORT))
+	fragment_seq = (fragment_seq + 1) & 0xFFFFFFFF
@@ -0,0 +1,96 @@
+import os
+import queue
+import threading
+
+import binary_format
+from collision_mesh_loader import load_indexed_collision_meshes_for_mode, make_edge_mesh, resolve_mesh_gamemode
+
+class ArenaMeshPreloader:
+    """
+    Decodes and packs the collision meshes of gamemodes on a worker thread,
+    so that only the VBO upload is left for the GL thread.
+    Gamemodes are resolved to the mesh folder they use first (see resolve()), so a shared arena is only loaded once.
+    """
+    def __init__(self, collision_mesh_root: str, make_edge_meshes: bool = False):
+        self.collision_mesh_root = collision_mesh_root
+        self.make_edge_meshes = make_edge_meshes
+
+        # Gamemode -> mesh gamemode, see resolve()
+        self.resolved = {}
+
+        # Mesh gamemode -> mesh or None if it failed, with the error
+        self.results = {}
+        self.results_lock = threading.Lock()
+        self.results_changed = threading.Condition(self.results_lock)
+
+        self.requested = set()
+        self.request_queue = queue.Queue()
+
+        # Known gamemodes, soccar first as it's the most common, then any other folders in the root
+        gamemodes = list(binary_format.GAMEMODES)
+        for name in sorted(os.listdir(collision_mesh_root)):
+            if os.path.isdir(os.path.join(collision_mesh_root, name)):
+                gamemodes.append(name.lower())
+        for gamemode in gamemodes:
+            self.request(gamemode)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def resolve(self, gamemode: str) -> str:
+        """The gamemode whose collision mesh a gamemode uses, see resolve_mesh_gamemode()"""
+        mesh_gamemode = self.resolved.get(gamemode)
+        if mesh_gamemode is None:
+            mesh_gamemode = self.resolved[gamemode] = resolve_mesh_gamemode(self.collision_mesh_root, gamemode)
+        return mesh_gamemode
+
+    def request(self, gamemode: str):
+        gamemode = self.resolve(gamemode)
+        if gamemode in self.requested:
+            return
+        self.requested.add(gamemode)
+        self.request_queue.put(gamemode)
+
+    def run(self):
+        while True:
+            gamemode = self.request_queue.get()
+            try:
+                positions, indices = load_indexed_collision_meshes_for_mode(self.collision_mesh_root, gamemode)
+                if self.make_edge_meshes:
+                    mesh = make_edge_mesh(positions[indices].reshape(-1, 3, 3))
+                else:
+                    mesh = (positions, indices)
+                result = (mesh, None)
+            except Exception as exc:
+                result = (None, exc)
+
+            with self.results_lock:
+                self.results[gamemode] = result
+                self.results_changed.notify_all()
+
+    def get(self, gamemode: str):
+        """
+        Get (is_done, mesh, error) for a gamemode, requesting it if it hasn't been yet.
+        The mesh is (positions, indices), or the make_edge_mesh() vertices if making edge meshes.
+        It is None if loading failed.
+        """
+        gamemode = self.resolve(gamemode)
+        with self.results_lock:
+            result = self.results.get(gamemode)
+            if result is None:
+                self.request(gamemode)
+                return False, None, None
+
+        mesh, error = result
+        return True, mesh, error
+
+    def wait(self, gamemode: str, timeout: float = None):
+        """Like get(), but blocks until the gamemode is done loading or the timeout passes"""
+        gamemode = self.resolve(gamemode)
+        with self.results_lock:
+            self.request(gamemode)
+            self.results_changed.wait_for(lambda: gamemode in self.results, timeout)
+
+        return self.get(gamemode)
@@ -12,9 +12,20 @@ in FD {
 	float edgeFrac;
 } inData;
 
+#ifdef EDGE_COORDS
+// Barycentric coordinates relative to the triangle's inner (non-edge) triangle
+in vec3 edgeCoords;
+#endif
+
 out vec4 f_color;
 
 void main() { 
+#ifdef EDGE_COORDS
+    float edgeFrac = (min(edgeCoords.x, min(edgeCoords.y, edgeCoords.z)) < 0) ? 1 : 0;
+#else
+    float edgeFrac = inData.edgeFrac;
+#endif
+
     bool isFloor = inData.norm.z > 0.95;
     bool isCeil = inData.norm.z < -0.95;
 
@@ -45,7 +56,7 @@ void main() {
 
     f_color = vec4(arenaCol.x, arenaCol.y, arenaCol.z, 1);
 
-    float edge_ratio = float(inData.edgeFrac);
+    float edge_ratio = edgeFrac;
     if (isFloor || isCeil)
         edge_ratio *= 0.7;
 
@@ -117,6 +128,14 @@ void main() {
     vec3 p[3];
     for (int i = 0; i < 3; i++)
         p[i] = inData[i].vert;
+
+#ifdef FACE_NORMALS
+    // Vertices are shared between faces, so use the face's own normal
+    vec3 faceNorm = normalize(cross(p[1] - p[0], p[2] - p[0]));
+    #define VERT_NORM(i) faceNorm
+#else
+    #define VERT_NORM(i) inData[i].norm
+#endif
     
     float wireframeWidth = 15; 
     bool doWireframe = true;
@@ -148,7 +167,7 @@ void main() {
     }
     
     if (doWireframe) {
-        vec3 norm = (inData[0].norm + inData[1].norm + inData[2].norm) / 3;
+        vec3 norm = (VERT_NORM(0) + VERT_NORM(1) + VERT_NORM(2)) / 3;
         if (abs(norm.x) > 0.95 || abs(norm.y) > 0.95 || abs(norm.z) > 0.95) {
             doWireframe = false;
         }
@@ -193,7 +212,7 @@ void main() {
             for (int i = 0; i < 3; i++) {
                 
                 outData.vert = inData[i].vert;
-                outData.norm = inData[i].norm;
+                outData.norm = VERT_NORM(i);
                 outData.edgeFrac = 0;
                 
                 gl_Position = m_vp * m_model * vec4(p[i], 1);
@@ -206,7 +225,7 @@ void main() {
         for (int i = 0; i < 3; i++) {
             
             outData.vert = inData[i].vert;
-            outData.norm = inData[i].norm;
+            outData.norm = VERT_NORM(i);
             outData.edgeFrac = 0;
             
             gl_Position = m_vp * m_model * vec4(p[i], 1);
@@ -288,4 +307,37 @@ void main() {
     gl_Position = m_vp * m_model * vec4(in_position, 1.0);
     windowPosition = in_position.xy;
 }
-'''
\ No newline at end of file
+'''
+# For indexed meshes, which don't have per-face normals
+ARENA_INDEXED_GEOM_SHADER = ARENA_GEOM_SHADER.replace("#version 330\n", "#version 330\n#define FACE_NORMALS\n", 1)
+
+# Wireframe without a geometry shader, from edge coordinates precomputed at load time
+# See collision_mesh_loader.make_edge_mesh()
+ARENA_EDGE_VERT_SHADER = '''
+#version 330
+
+uniform mat4 m_vp;
+uniform mat4 m_model;
+
+in vec3 in_position;
+in vec3 in_normal;
+in vec3 in_edge_coords;
+
+out FD {
+	vec3 vert;
+	vec3 norm;
+	float edgeFrac;
+} outData;
+
+out vec3 edgeCoords;
+
+void main() {
+    outData.vert = in_position;
+    outData.norm = mat3(m_model) * in_normal;
+    outData.edgeFrac = 0;
+    edgeCoords = in_edge_coords;
+    gl_Position = m_vp * m_model * vec4(in_position, 1.0);
+}
+'''
+
+ARENA_EDGE_FRAG_SHADER = ARENA_FRAG_SHADER.replace("#version 330\n", "#version 330\n#define EDGE_COORDS\n", 1)
@@ -0,0 +1,177 @@
+import struct
+from functools import lru_cache
+
+import numpy as np
+
+# Compact binary gamestate format, see networking-format-binary.md
+# Every packet starts with MAGIC so the listener can tell it apart from JSON text (which starts with '{')
+
+MAGIC = b"RSVB"
+VERSION = 1
+
+# magic, version, flags, gamemode, reserved, num_cars, num_pads, num_lines
+HEADER_STRUCT = struct.Struct("<4sBBBBHHI")
+
+HEADER_FLAG_HAS_PAD_STATES = 1 << 0
+HEADER_FLAG_HAS_ENV_ID = 1 << 1 # A u32 env id follows the header
+
+ENV_ID_STRUCT = struct.Struct("<I")
+
+# Batch packets carry the states of many envs in one datagram
+# They are a batch header, then num_envs binary packets back to back that all have the same layout (one packet_dtype())
+# So the whole batch is one structured array, with ball [M], cars [M, num_cars] and pad_mask [M] fields
+BATCH_MAGIC = b"RSVM"
+BATCH_VERSION = 1
+
+# magic, version, reserved, reserved, num_envs
+BATCH_HEADER_STRUCT = struct.Struct("<4sBBHI")
+
+PHYS_FLAG_HAS_ROT = 1 << 0
+
+CAR_FLAG_HAS_ROT = PHYS_FLAG_HAS_ROT
+CAR_FLAG_ON_GROUND = 1 << 1
+CAR_FLAG_IS_DEMOED = 1 << 2
+CAR_FLAG_HAS_FLIPPED_OR_DOUBLE_JUMPED = 1 << 3
+CAR_FLAG_BOOSTING = 1 << 4
+
+# Index in this tuple is the gamemode code sent in the header
+GAMEMODES = ("soccar", "hoops", "heatseeker", "snowday", "dropshot")
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u1"),
+    ("flags", "<u1"),
+    ("gamemode", "<u1"),
+    ("reserved", "<u1"),
+    ("num_cars", "<u2"),
+    ("num_pads", "<u2"),
+    ("num_lines", "<u4"),
+])
+
+PHYS_DTYPE = np.dtype([
+    ("pos", "<f4", (3,)),
+    ("forward", "<f4", (3,)),
+    ("up", "<f4", (3,)),
+    ("vel", "<f4", (3,)),
+    ("ang_vel", "<f4", (3,)),
+])
+
+BALL_DTYPE = np.dtype([
+    ("flags", "<u1"),
+    ("reserved", "<u1", (3,)),
+    ("phys", PHYS_DTYPE),
+])
+
+CAR_DTYPE = np.dtype([
+    ("car_id", "<i4"),
+    ("team_num", "<u1"),
+    ("flags", "<u1"),
+    ("reserved", "<u2"),
+    ("boost_amount", "<f4"),
+    ("phys", PHYS_DTYPE),
+])
+
+LINE_FLOATS = 6 # start xyz, end xyz
+
+assert HEADER_DTYPE.itemsize == HEADER_STRUCT.size
+
+def pad_mask_size(num_pads: int) -> int:
+    return (num_pads + 7) // 8
+
+@lru_cache(maxsize=64)
+def packet_dtype(num_cars: int, num_pads: int, num_lines: int, has_env_id: bool = False) -> np.dtype:
+    env_fields = [("env_id", "<u4")] if has_env_id else []
+    return np.dtype([
+        ("header", HEADER_DTYPE),
+        *env_fields,
+        ("ball", BALL_DTYPE),
+        ("cars", CAR_DTYPE, (num_cars,)),
+        ("pad_mask", "<u1", (pad_mask_size(num_pads),)),
+        ("lines", "<f4", (num_lines, LINE_FLOATS)),
+    ])
+
+def is_binary_packet(data) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+def is_batch_packet(data) -> bool:
+    return data[:len(BATCH_MAGIC)] == BATCH_MAGIC
+
+def get_packet_size(header) -> int:
+    """Total size of a binary packet, from at least its header bytes"""
+    _, _, flags, _, _, num_cars, num_pads, num_lines = HEADER_STRUCT.unpack_from(header, 0)
+    return packet_dtype(num_cars, num_pads, num_lines, bool(flags & HEADER_FLAG_HAS_ENV_ID)).itemsize
+
+def get_batch_size(header) -> int:
+    """Total size of a batch packet, from at least its batch header and the header of its first packet"""
+    _, _, _, _, num_envs = BATCH_HEADER_STRUCT.unpack_from(header, 0)
+    if num_envs == 0:
+        return BATCH_HEADER_STRUCT.size
+    return BATCH_HEADER_STRUCT.size + num_envs * get_packet_size(header[BATCH_HEADER_STRUCT.size:])
+
+def decode_batch(data) -> np.ndarray:
+    """Decode a batch packet into a structured array of its env packets, that views the received bytes"""
+    if len(data) < BATCH_HEADER_STRUCT.size:
+        raise ValueError(f"Batch packet too small for header ({len(data)} bytes)")
+
+    magic, version, _, _, num_envs = BATCH_HEADER_STRUCT.unpack_from(data, 0)
+    if magic != BATCH_MAGIC:
+        raise ValueError(f"Bad batch packet magic: {magic}")
+    if version != BATCH_VERSION:
+        raise ValueError(f"Unsupported batch packet version {version}, expected {BATCH_VERSION}")
+    if num_envs == 0:
+        return np.zeros(0, dtype=packet_dtype(0, 0, 0))
+
+    first = memoryview(data)[BATCH_HEADER_STRUCT.size:]
+    if len(first) < HEADER_STRUCT.size or not is_binary_packet(first):
+        raise ValueError("Batch packet doesn't start with a binary packet")
+    _, _, flags, _, _, num_cars, num_pads, num_lines = HEADER_STRUCT.unpack_from(first, 0)
+    dtype = packet_dtype(num_cars, num_pads, num_lines, bool(flags & HEADER_FLAG_HAS_ENV_ID))
+    if len(first) != num_envs * dtype.itemsize:
+        raise ValueError(f"Batch packet size mismatch: got {len(data)} bytes, header describes {BATCH_HEADER_STRUCT.size + num_envs * dtype.itemsize}")
+
+    return np.frombuffer(data, dtype=dtype, count=num_envs, offset=BATCH_HEADER_STRUCT.size)
+
+def split_batch(data) -> list:
+    """The env packets of a batch packet, as views of its bytes"""
+    packets = decode_batch(data)
+    view = memoryview(data)
+    size = packets.dtype.itemsize
+    start = BATCH_HEADER_STRUCT.size
+    return [view[start + i * size:start + (i + 1) * size] for i in range(len(packets))]
+
+def peek_env_id(data) -> int:
+    """Env id of a binary packet without decoding it, 0 if it has none"""
+    if len(data) < HEADER_STRUCT.size + ENV_ID_STRUCT.size or not (data[5] & HEADER_FLAG_HAS_ENV_ID):
+        return 0
+    return ENV_ID_STRUCT.unpack_from(data, HEADER_STRUCT.size)[0]
+
+def decode_packet(data) -> np.void:
+    """Decode a binary packet into a single structured record that views the received bytes"""
+    if len(data) < HEADER_STRUCT.size:
+        raise ValueError(f"Binary packet too small for header ({len(data)} bytes)")
+
+    magic, version, flags, gamemode, _, num_cars, num_pads, num_lines = HEADER_STRUCT.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Bad binary packet magic: {magic}")
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary packet version {version}, expected {VERSION}")
+
+    dtype = packet_dtype(num_cars, num_pads, num_lines, bool(flags & HEADER_FLAG_HAS_ENV_ID))
+    if len(data) != dtype.itemsize:
+        raise ValueError(f"Binary packet size mismatch: got {len(data)} bytes, header describes {dtype.itemsize}")
+
+    return np.frombuffer(data, dtype=dtype, count=1)[0]
+
+def get_gamemode(packet: np.void) -> str:
+    code = int(packet["header"]["gamemode"])
+    if code >= len(GAMEMODES):
+        return GAMEMODES[0]
+    return GAMEMODES[code]
+
+def get_pad_states(packet: np.void):
+    header = packet["header"]
+    if not (header["flags"] & HEADER_FLAG_HAS_PAD_STATES):
+        return None
+
+    num_pads = int(header["num_pads"])
+    return np.unpackbits(packet["pad_mask"], count=num_pads, bitorder="little").astype(bool)
@@ -0,0 +1,91 @@
+import moderngl
+from moderngl_window.opengl.vao import VAO
+
+from shaders import CAR_VERT_SHADER, CAR_FRAG_SHADER
+
+import numpy as np
+
+# Per-instance data of a car
+CAR_INSTANCE_DTYPE = np.dtype([
+    ("model", "<f4", (4, 4)), # Column-major model matrix
+    ("team", "<f4"),
+    ("tile", "<f4"), # Viewport tile, see TILE_VERT_FUNCS
+    ("tint", "<f4", 4), # RGBA, only used if alpha is above 0, see CAR_FRAG_SHADER
+])
+
+class CarRenderer:
+    """
+    Draws every car in a single instanced draw, from one instance buffer upload per frame.
+    Works with any mesh, the ghost balls are drawn with one too.
+    """
+    def __init__(self, ctx: moderngl.Context, mesh: VAO, team_textures: list, initial_capacity: int = 8):
+        self.ctx = ctx
+
+        self.prog = ctx.program(
+            vertex_shader=CAR_VERT_SHADER,
+            fragment_shader=CAR_FRAG_SHADER
+        )
+
+        self.pr_m_vps = self.prog['m_vps']
+        self.pr_tile_rects = self.prog['tileRects']
+        self.pr_camera_pos = self.prog['cameraPos']
+        self.prog['globalColor'].value = (0, 0, 0, 0)
+
+        self.instance_vbo = ctx.buffer(reserve=initial_capacity * CAR_INSTANCE_DTYPE.itemsize)
+        self.instance_count = 0
+
+        mesh_buffer = mesh.get_buffer_by_name("in_position")
+        self.vao = ctx.vertex_array(
+            self.prog,
+            [
+                mesh_buffer.content(["in_position", "in_normal", "in_texcoord_0"]),
+                (self.instance_vbo, "16f 1f 1f 4f/i", "in_model", "in_team", "in_tile", "in_tint")
+            ]
+        )
+
+        # All team textures in one array, indexed by team number
+        first_texture = team_textures[0]
+        self.texture = ctx.texture_array(
+            (first_texture.size[0], first_texture.size[1], len(team_textures)),
+            first_texture.components,
+            b"".join(texture.read() for texture in team_textures)
+        )
+        self.texture.filter = first_texture.filter
+        self.texture.repeat_x = first_texture.repeat_x
+        self.texture.repeat_y = first_texture.repeat_y
+
+    def write_camera(self, tile_m_vps: np.ndarray, tile_rects: np.ndarray, camera_pos):
+        """Write the (MAX_GRID_TILES, 4, 4) view-projection matrices and (MAX_GRID_TILES, 4) rects of the tiles"""
+        self.pr_m_vps.write(tile_m_vps)
+        self.pr_tile_rects.write(tile_rects)
+        self.pr_camera_pos.write(camera_pos.astype('f4'))
+
+    def update(self, pos: np.ndarray, forward: np.ndarray, up: np.ndarray, team_nums: np.ndarray,
+               tiles: np.ndarray = 0, tints: np.ndarray = 0):
+        """Upload all cars to draw, as (N, 3) positions and directions, (N,) team numbers and tile indices and (N, 4) tints"""
+        count = len(pos)
+        instances = np.empty(count, dtype=CAR_INSTANCE_DTYPE)
+
+        # Columns are forward, left and up, the same as render_model()
+        model = instances["model"]
+        model[:, 0, :3] = forward
+        model[:, 1, :3] = np.cross(up, forward)
+        model[:, 2, :3] = up
+        model[:, 3, :3] = pos
+        model[:, :, 3] = (0, 0, 0, 1)
+        instances["team"] = team_nums
+        instances["tile"] = tiles
+        instances["tint"] = tints
+
+        if instances.nbytes > self.instance_vbo.size:
+            self.instance_vbo.orphan(instances.nbytes * 2)
+        if count > 0:
+            self.instance_vbo.write(instances.tobytes())
+        self.instance_count = count
+
+    def render(self):
+        if self.instance_count == 0:
+            return
+
+        self.texture.use()
+        self.vao.render(instances=self.instance_count)
@@ -1,10 +1,10 @@
 import os
-import struct
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 
 from const import ROOT_PATH
+import mesh_cache
 
 
 def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
@@ -13,14 +13,6 @@ def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
     return vectors / norms
 
 
-def _append_plane(positions_list, normals_list, corners: np.ndarray, normal: np.ndarray) -> None:
-    tri_indices = np.array([[0, 1, 2], [0, 2, 3]], dtype=np.int32)
-    positions = corners[tri_indices.reshape(-1)]
-    normals = np.repeat(normal.reshape(1, 3), positions.shape[0], axis=0)
-    positions_list.append(positions.astype("f4"))
-    normals_list.append(normals.astype("f4"))
-
-
 def find_collision_mesh_root() -> Optional[str]:
     env_paths = [
         os.environ.get("ROCKETSIM_COLLISION_MESHES"),
@@ -40,13 +32,11 @@ def find_collision_mesh_root() -> Optional[str]:
 
 
 def _read_cmf(path: str) -> Tuple[np.ndarray, np.ndarray]:
-    with open(path, "rb") as handle:
-        data = handle.read()
-
-    if len(data) < 8:
+    file_size = os.path.getsize(path)
+    if file_size < 8:
         raise ValueError(f"Collision mesh file too small: {path}")
 
-    num_tris, num_vertices = struct.unpack_from("<ii", data, 0)
+    num_tris, num_vertices = (int(v) for v in np.memmap(path, dtype="<i4", mode="r", shape=(2,)))
 
     if num_tris <= 0 or num_vertices <= 0:
         raise ValueError(f"Invalid collision mesh counts in {path}: {num_tris}, {num_vertices}")
@@ -58,33 +48,41 @@ def _read_cmf(path: str) -> Tuple[np.ndarray, np.ndarray]:
     vert_bytes = vert_count * 4
 
     expected = 8 + tri_bytes + vert_bytes
-    if len(data) < expected:
+    if file_size < expected:
         raise ValueError(f"Collision mesh file truncated: {path}")
 
     offset = 8
-    tris = np.frombuffer(data, dtype="<i4", count=tri_count, offset=offset).reshape((-1, 3))
+    tris = np.memmap(path, dtype="<i4", mode="r", offset=offset, shape=(num_tris, 3))
     offset += tri_bytes
-    vertices = np.frombuffer(data, dtype="<f4", count=vert_count, offset=offset).reshape((-1, 3))
+    vertices = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(num_vertices, 3))
 
     vertices = vertices * 50.0
 
     if np.any(tris < 0) or np.any(tris >= num_vertices):
         raise ValueError(f"Collision mesh has out-of-range vertex index: {path}")
 
-    return vertices, tris
+    return vertices, np.asarray(tris)
 
 
-def load_collision_meshes_for_mode(base_dir: str, gamemode: str) -> Tuple[np.ndarray, int]:
+def resolve_mesh_gamemode(base_dir: str, gamemode: str) -> str:
+    """
+    The gamemode whose collision mesh folder a gamemode uses, gamemodes that share an arena share a folder.
+    Gamemodes loading the same folder get the same mesh, so it can be used to key loaded meshes.
+    """
     fallback_map = {
         "heatseeker": "soccar",
     }
-    mode_dir = os.path.join(base_dir, gamemode)
-    if not os.path.isdir(mode_dir):
+    if not os.path.isdir(os.path.join(base_dir, gamemode)):
         fallback = fallback_map.get(gamemode)
         if fallback:
-            mode_dir = os.path.join(base_dir, fallback)
-        if not os.path.isdir(mode_dir):
-            raise FileNotFoundError(f"Missing collision mesh dir: {mode_dir}")
+            return fallback
+    return gamemode
+
+
+def _find_mesh_files(base_dir: str, gamemode: str) -> List[str]:
+    mode_dir = os.path.join(base_dir, resolve_mesh_gamemode(base_dir, gamemode))
+    if not os.path.isdir(mode_dir):
+        raise FileNotFoundError(f"Missing collision mesh dir: {mode_dir}")
 
     mesh_files = [
         os.path.join(mode_dir, name)
@@ -95,27 +93,19 @@ def load_collision_meshes_for_mode(base_dir: str, gamemode: str) -> Tuple[np.nda
     if not mesh_files:
         raise FileNotFoundError(f"No collision meshes found in: {mode_dir}")
 
-    all_positions = []
-    all_normals = []
-
-    for mesh_path in mesh_files:
-        vertices, tris = _read_cmf(mesh_path)
-
-        v0 = vertices[tris[:, 0]]
-        v1 = vertices[tris[:, 1]]
-        v2 = vertices[tris[:, 2]]
-
-        normals = _normalize_rows(np.cross(v1 - v0, v2 - v0))
-
-        positions = vertices[tris.reshape(-1)]
-        normals_expanded = np.repeat(normals, 3, axis=0)
+    return mesh_files
 
-        all_positions.append(positions)
-        all_normals.append(normals_expanded)
 
+def _get_gamemode_key(gamemode: str) -> str:
     gamemode_key = gamemode.lower()
     if gamemode_key == "heatseeker":
         gamemode_key = "soccar"
+    return gamemode_key
+
+
+def _get_arena_planes(gamemode_key: str) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Corners and normals of the flat arena surfaces (floor, ceiling and walls) that aren't in the collision meshes"""
+    planes = []
 
     if gamemode_key == "hoops":
         extent_x = 8900.0 / 3.0
@@ -143,8 +133,8 @@ def load_collision_meshes_for_mode(base_dir: str, gamemode: str) -> Tuple[np.nda
         [extent_x, -extent_y, height],
     ], dtype="f4")
 
-    _append_plane(all_positions, all_normals, floor, np.array([0.0, 0.0, 1.0], dtype="f4"))
-    _append_plane(all_positions, all_normals, ceiling, np.array([0.0, 0.0, -1.0], dtype="f4"))
+    planes.append((floor, np.array([0.0, 0.0, 1.0], dtype="f4")))
+    planes.append((ceiling, np.array([0.0, 0.0, -1.0], dtype="f4")))
 
     left_wall = np.array([
         [-extent_x, -extent_y, 0.0],
@@ -158,8 +148,8 @@ def load_collision_meshes_for_mode(base_dir: str, gamemode: str) -> Tuple[np.nda
         [extent_x, extent_y, height],
         [extent_x, extent_y, 0.0],
     ], dtype="f4")
-    _append_plane(all_positions, all_normals, left_wall, np.array([1.0, 0.0, 0.0], dtype="f4"))
-    _append_plane(all_positions, all_normals, right_wall, np.array([-1.0, 0.0, 0.0], dtype="f4"))
+    planes.append((left_wall, np.array([1.0, 0.0, 0.0], dtype="f4")))
+    planes.append((right_wall, np.array([-1.0, 0.0, 0.0], dtype="f4")))
 
     if add_y_walls:
         back_wall = np.array([
@@ -174,12 +164,106 @@ def load_collision_meshes_for_mode(base_dir: str, gamemode: str) -> Tuple[np.nda
             [extent_x, extent_y, height],
             [-extent_x, extent_y, height],
         ], dtype="f4")
-        _append_plane(all_positions, all_normals, back_wall, np.array([0.0, 1.0, 0.0], dtype="f4"))
-        _append_plane(all_positions, all_normals, front_wall, np.array([0.0, -1.0, 0.0], dtype="f4"))
+        planes.append((back_wall, np.array([0.0, 1.0, 0.0], dtype="f4")))
+        planes.append((front_wall, np.array([0.0, -1.0, 0.0], dtype="f4")))
+
+    return planes
 
-    positions = np.vstack(all_positions).astype("f4")
-    normals = np.vstack(all_normals).astype("f4")
 
-    normals4 = np.concatenate([normals, np.zeros((normals.shape[0], 1), dtype="f4")], axis=1)
-    packed = np.hstack([positions, normals4]).astype("f4")
-    return packed, positions.shape[0]
+def load_indexed_collision_meshes_for_mode(base_dir: str, gamemode: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the (N, 3) vertex positions and flat triangle indices of a gamemode's arena.
+    Normals aren't stored, as vertices are shared between faces, they are computed per-face when rendering instead.
+    The result is cached on disk, keyed by the gamemode's collision mesh files.
+    """
+    mesh_files = _find_mesh_files(base_dir, gamemode)
+    gamemode_key = _get_gamemode_key(gamemode)
+
+    cache_name = f"collision_{gamemode_key}"
+    cache_key = mesh_cache.get_source_key(mesh_files)
+    cached = mesh_cache.load(cache_name, cache_key)
+    if cached is not None:
+        arrays, _ = cached
+        return arrays["positions"], arrays["indices"]
+
+    all_positions = []
+    all_indices = []
+    vert_offset = 0
+
+    for mesh_path in mesh_files:
+        vertices, tris = _read_cmf(mesh_path)
+        all_positions.append(vertices)
+        all_indices.append(tris.reshape(-1) + vert_offset)
+        vert_offset += vertices.shape[0]
+
+    plane_tri_indices = np.array([0, 1, 2, 0, 2, 3], dtype=np.int64)
+    for corners, _ in _get_arena_planes(gamemode_key):
+        all_positions.append(corners)
+        all_indices.append(plane_tri_indices + vert_offset)
+        vert_offset += corners.shape[0]
+
+    positions = np.vstack(all_positions).astype("f4")
+    indices = np.concatenate(all_indices).astype("u4")
+
+    mesh_cache.save(cache_name, cache_key, { "positions": positions, "indices": indices }, {})
+    return positions, indices
+
+
+def make_edge_mesh(tri_positions: np.ndarray, tri_normals: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Expand (T, 3, 3) triangle corners into non-indexed vertices of (position, normal, edge coordinates),
+    for drawing the arena wireframe without a geometry shader.
+
+    Matches ARENA_GEOM_SHADER: each corner is moved towards the triangle's center by the wireframe width
+    to make an inner triangle, and the edge coordinates of a corner are its barycentric coordinates
+    relative to that inner triangle. Interpolated, they are all positive only inside the inner triangle.
+    If not given, normals are the face normals.
+    """
+    tri_positions = np.asarray(tri_positions, dtype=np.float64)
+    p0, p1, p2 = tri_positions[:, 0], tri_positions[:, 1], tri_positions[:, 2]
+
+    if tri_normals is None:
+        face_normals = _normalize_rows(np.cross(p1 - p0, p2 - p0))
+        tri_normals = np.repeat(face_normals[:, None], 3, axis=1)
+    tri_normals = np.asarray(tri_normals, dtype=np.float64)
+
+    edge_size = np.minimum(
+        np.linalg.norm(p0 - p1, axis=1),
+        np.minimum(np.linalg.norm(p1 - p2, axis=1), np.linalg.norm(p2 - p0, axis=1))
+    )
+    wireframe_width = np.minimum(15.0, edge_size * 2)
+
+    center = tri_positions.mean(axis=1, keepdims=True)
+    delta_to_center = center - tri_positions
+    dist_to_center = np.linalg.norm(delta_to_center, axis=2, keepdims=True)
+    dir_to_center = np.where(dist_to_center < 1e-5, 0.0, delta_to_center / np.maximum(dist_to_center, 1e-5))
+    inner = tri_positions + dir_to_center * wireframe_width[:, None, None]
+
+    # Triangles that are too small or axis-aligned have no wireframe, and use the normal of each corner
+    avg_normal = tri_normals.mean(axis=1)
+    do_wireframe = (edge_size >= 10) & ~np.any(np.abs(avg_normal) > 0.95, axis=1)
+
+    # Barycentric coordinates of the outer corners relative to the inner triangle
+    e1 = inner[:, 1] - inner[:, 0]
+    e2 = inner[:, 2] - inner[:, 0]
+    v = tri_positions - inner[:, None, 0]
+    d00 = np.einsum("ij,ij->i", e1, e1)[:, None]
+    d01 = np.einsum("ij,ij->i", e1, e2)[:, None]
+    d11 = np.einsum("ij,ij->i", e2, e2)[:, None]
+    d20 = np.einsum("ikj,ij->ik", v, e1)
+    d21 = np.einsum("ikj,ij->ik", v, e2)
+    denom = d00 * d11 - d01 * d01
+
+    # Degenerate inner triangles can't be drawn as a wireframe either
+    do_wireframe &= np.abs(denom[:, 0]) > 1e-6
+    denom = np.where(np.abs(denom) > 1e-6, denom, 1.0)
+
+    b1 = (d11 * d20 - d01 * d21) / denom
+    b2 = (d00 * d21 - d01 * d20) / denom
+    edge_coords = np.stack((1 - b1 - b2, b1, b2), axis=2)
+    edge_coords[~do_wireframe] = 1
+
+    normals = np.where(do_wireframe[:, None, None], avg_normal[:, None], tri_normals)
+
+    packed = np.concatenate((tri_positions, normals, edge_coords), axis=2)
+    return packed.reshape(-1, 9).astype("f4")
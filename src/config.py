@@ -16,4 +16,11 @@ class Config:
 
         self.camera_lean_height_scale = ConfigVal(1.0, 0, 1)
         self.camera_lean_dist_scale = ConfigVal(0.1, 0, 1)
-        self.camera_lean_min_height_clamp = ConfigVal(300, 0, 500)
\ No newline at end of file
+        self.camera_lean_min_height_clamp = ConfigVal(300, 0, 500)
+
+        # Live states kept for pausing and rewinding, see RewindBuffer
+        self.rewind_seconds = ConfigVal(30, 0, 300)
+        self.rewind_memory_mb = ConfigVal(64, 8, 1024)
+
+        # Opacity of the other envs' cars and balls in ghost mode
+        self.ghost_alpha = ConfigVal(0.3, 0.05, 1)
\ No newline at end of file
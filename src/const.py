@@ -2,6 +2,7 @@ import os
 
 ROOT_PATH = os.path.normpath(os.path.join(__file__, '../../')) + "/"
 DATA_DIR_PATH = ROOT_PATH + "data/"
+CACHE_DIR_PATH = ROOT_PATH + "cache/"
 
 WINDOW_SIZE_X = 1440
-WINDOW_SIZE_Y = 960
\ No newline at end of file
+WINDOW_SIZE_Y = 960
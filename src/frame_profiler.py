@@ -0,0 +1,197 @@
+import collections
+import json
+import os
+import time
+
+import numpy as np
+
+import moderngl
+
+class FrameProfiler:
+    """
+    Measures the CPU and GPU time of each phase of a frame.
+
+    Phases run one after another, calling phase() ends the previous one and starts the next.
+    GPU times come from GL timer queries, which are read back a few frames later so the CPU never waits on the GPU.
+    Timer queries can't overlap, which is why phases don't nest.
+    """
+
+    # Frames of timer queries in flight, results are read once a query set comes around again
+    QUERY_LATENCY = 3
+
+    def __init__(self, ctx: moderngl.Context, history: int = 240, trace_frames: int = 2000):
+        self.ctx = ctx
+        self.enabled = False
+        self.pending_enabled = False # Applied at the next begin_frame(), see set_enabled()
+
+        # Phase name -> deque of the last `history` times in seconds
+        self.history = history
+        self.cpu_times = {}
+        self.gpu_times = {}
+
+        # Complete frames kept for dump_trace(), as (cpu_start, [(name, cpu_start, cpu_duration)], [(name, gpu_duration)])
+        self.trace = collections.deque(maxlen=trace_frames)
+
+        # Ring of frames waiting on their GPU results, each (trace_frame, {name: query})
+        self.query_ring = [None] * self.QUERY_LATENCY
+        self.query_pool = []
+        self.ring_idx = 0
+
+        self.frame = None
+        self.frame_queries = None
+        self.cur_phase = None
+        self.cur_query = None
+        self.cur_phase_start = 0
+
+    def set_enabled(self, enabled: bool):
+        """
+        Enable or disable profiling from the next frame on.
+        This can be called from anywhere, the queries are only touched in begin_frame() where the GL context is current.
+        """
+        self.pending_enabled = enabled
+
+    def toggle(self):
+        self.set_enabled(not self.pending_enabled)
+
+    def finish(self):
+        """Read the results of every frame still in flight, the GL context must be current"""
+        self.end_frame()
+        for i in range(len(self.query_ring)):
+            self.read_queries(i)
+
+    def begin_frame(self):
+        if self.enabled and not self.pending_enabled:
+            self.finish()
+        self.enabled = self.pending_enabled
+
+        if not self.enabled:
+            return
+
+        # Collect the GPU results of the frame that last used this ring slot
+        self.read_queries(self.ring_idx)
+
+        self.frame = (time.perf_counter(), [], [])
+        self.frame_queries = {}
+
+    def phase(self, name: str):
+        """Start timing a phase, ending the current one"""
+        if self.frame is None:
+            return
+
+        self.end_phase()
+
+        if self.query_pool:
+            query = self.query_pool.pop()
+        else:
+            query = self.ctx.query(time=True)
+        query.mglo.begin()
+
+        self.cur_phase = name
+        self.cur_query = query
+        self.frame_queries[name] = query
+        self.cur_phase_start = time.perf_counter()
+
+    def end_phase(self):
+        if self.cur_phase is None:
+            return
+
+        duration = time.perf_counter() - self.cur_phase_start
+        self.cur_query.mglo.end()
+        self.frame[1].append((self.cur_phase, self.cur_phase_start, duration))
+        self.add_time(self.cpu_times, self.cur_phase, duration)
+
+        self.cur_phase = None
+        self.cur_query = None
+
+    def end_frame(self):
+        if self.frame is None:
+            return
+
+        self.end_phase()
+        self.trace.append(self.frame)
+        self.query_ring[self.ring_idx] = (self.frame, self.frame_queries)
+        self.ring_idx = (self.ring_idx + 1) % len(self.query_ring)
+
+        self.frame = None
+        self.frame_queries = None
+
+    def read_queries(self, ring_idx: int):
+        pending = self.query_ring[ring_idx]
+        if pending is None:
+            return
+        self.query_ring[ring_idx] = None
+
+        frame, queries = pending
+        for name, query in queries.items():
+            duration = query.elapsed / 1e9
+            frame[2].append((name, duration))
+            self.add_time(self.gpu_times, name, duration)
+            self.query_pool.append(query)
+
+    def add_time(self, times: dict, name: str, duration: float):
+        phase_times = times.get(name)
+        if phase_times is None:
+            phase_times = times[name] = collections.deque(maxlen=self.history)
+        phase_times.append(duration)
+
+    def get_summary_text(self) -> str:
+        """Rolling min/avg/p99 of each phase in milliseconds, one line per phase"""
+        if not self.cpu_times:
+            return "Profiler: waiting for frames\n"
+
+        text = "Profiler (ms, min/avg/p99):\n"
+        for name, cpu_times in self.cpu_times.items():
+            text += "  {}: CPU {}".format(name, self.format_stats(cpu_times))
+            gpu_times = self.gpu_times.get(name)
+            if gpu_times:
+                text += ", GPU {}".format(self.format_stats(gpu_times))
+            text += "\n"
+        return text
+
+    @staticmethod
+    def format_stats(times) -> str:
+        times_ms = np.fromiter(times, dtype=np.float64, count=len(times)) * 1000
+        return "{:.2f}/{:.2f}/{:.2f}".format(times_ms.min(), times_ms.mean(), np.percentile(times_ms, 99))
+
+    def dump_trace(self, path: str):
+        """
+        Write the kept frames as a Chrome trace (open in chrome://tracing or Perfetto).
+        GPU phases are laid out back to back from the start of their frame,
+        as timer queries only give durations.
+        """
+        events = [
+            { "name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": { "name": "CPU" } },
+            { "name": "thread_name", "ph": "M", "pid": 1, "tid": 2, "args": { "name": "GPU" } },
+        ]
+
+        for frame_start, cpu_phases, gpu_phases in self.trace:
+            frame_end = frame_start
+            for name, start, duration in cpu_phases:
+                events.append({
+                    "name": name, "cat": "cpu", "ph": "X", "pid": 1, "tid": 1,
+                    "ts": start * 1e6, "dur": duration * 1e6
+                })
+                frame_end = max(frame_end, start + duration)
+
+            events.append({
+                "name": "frame", "cat": "cpu", "ph": "X", "pid": 1, "tid": 1,
+                "ts": frame_start * 1e6, "dur": (frame_end - frame_start) * 1e6
+            })
+
+            gpu_start = frame_start
+            for name, duration in gpu_phases:
+                events.append({
+                    "name": name, "cat": "gpu", "ph": "X", "pid": 1, "tid": 2,
+                    "ts": gpu_start * 1e6, "dur": duration * 1e6
+                })
+                gpu_start += duration
+
+        try:
+            dir_path = os.path.dirname(path)
+            if dir_path:
+                os.makedirs(dir_path, exist_ok=True)
+            with open(path, "w") as trace_file:
+                json.dump({ "traceEvents": events, "displayTimeUnit": "ms" }, trace_file)
+            print("Wrote profiler trace of {} frames to \"{}\"".format(len(self.trace), path))
+        except OSError as err:
+            print("Failed to write profiler trace to \"{}\": {}".format(path, err))
@@ -0,0 +1,202 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+import moderngl
+
+class FrameRecorder:
+    """
+    Records rendered frames to a video without stalling the render thread.
+
+    Frames are read back into a ring of pixel buffer objects, so the GPU->CPU copy of a frame
+    is only waited on once the ring comes back around to it, a few frames later.
+    The pixels are then handed to a writer thread, which pipes them into ffmpeg if it's installed,
+    or writes them as raw RGB24 otherwise.
+    If the writer falls behind, frames are dropped instead of slowing down rendering.
+
+    The video is always self.fps frames per second of real time: if we render slower than that,
+    a frame is written again for each capture interval it stayed on screen, and a dropped frame is made up for by the next one.
+    """
+
+    PBO_COUNT = 3
+    MAX_QUEUED_FRAMES = 8
+
+    def __init__(self, ctx: moderngl.Context, output_dir: str, fps: float = 60):
+        self.ctx = ctx
+        self.output_dir = output_dir
+        self.fps = fps
+
+        self.is_recording = False
+        self.size = None
+        self.output_path = None
+
+        self.pbos = []
+        self.pbo_pending = []
+        self.pbo_repeats = [] # How many frames each readback will be written as
+        self.pbo_idx = 0
+        self.missed_repeats = 0 # Frames dropped from the queue, made up for by the next frame queued
+
+        self.next_capture_time = 0
+        self.frames_captured = 0
+        self.frames_dropped = 0
+
+        self.write_queue = None
+        self.writer_thread = None
+
+    def start(self, size):
+        if self.is_recording:
+            return
+
+        self.size = (int(size[0]), int(size[1]))
+        frame_bytes = self.size[0] * self.size[1] * 3
+        self.pbos = [self.ctx.buffer(reserve=frame_bytes, dynamic=True) for _ in range(self.PBO_COUNT)]
+        self.pbo_pending = [False] * self.PBO_COUNT
+        self.pbo_repeats = [1] * self.PBO_COUNT
+        self.pbo_idx = 0
+        self.missed_repeats = 0
+
+        self.next_capture_time = 0
+        self.frames_captured = 0
+        self.frames_dropped = 0
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_path = os.path.join(self.output_dir, "recording_{}".format(time.strftime("%Y%m%d_%H%M%S")))
+
+        ffmpeg_path = shutil.which("ffmpeg")
+        if ffmpeg_path is None:
+            self.output_path = base_path + "_{}x{}_{}fps.rgb".format(self.size[0], self.size[1], round(self.fps))
+            output = open(self.output_path, "wb")
+        else:
+            self.output_path = base_path + ".mp4"
+            output = subprocess.Popen(
+                [
+                    ffmpeg_path, "-y", "-loglevel", "error",
+                    "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{}x{}".format(*self.size), "-r", str(self.fps), "-i", "-",
+                    "-vf", "vflip", "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                    self.output_path
+                ],
+                stdin=subprocess.PIPE
+            )
+
+        self.write_queue = queue.Queue(maxsize=self.MAX_QUEUED_FRAMES)
+        self.writer_thread = threading.Thread(target=self.run_writer, args=(output, self.write_queue), daemon=True)
+        self.writer_thread.start()
+
+        self.is_recording = True
+        print("Recording {}x{} at {}fps to \"{}\"".format(self.size[0], self.size[1], self.fps, self.output_path))
+
+    def stop(self):
+        if not self.is_recording:
+            return
+        self.is_recording = False
+
+        # The last frame stays on screen until now
+        self.repeat_last_frame(time.perf_counter())
+
+        # Flush the frames still in flight, oldest first
+        for i in range(self.PBO_COUNT):
+            self.collect_pbo((self.pbo_idx + i) % self.PBO_COUNT)
+
+        self.write_queue.put(None)
+        self.writer_thread.join()
+        self.writer_thread = None
+        self.write_queue = None
+
+        for pbo in self.pbos:
+            pbo.release()
+        self.pbos = []
+
+        print("Stopped recording, {} frames captured, {} dropped, saved to \"{}\"".format(
+            self.frames_captured, self.frames_dropped, self.output_path
+        ))
+
+    def toggle(self, size):
+        if self.is_recording:
+            self.stop()
+        else:
+            self.start(size)
+
+    def capture(self, framebuffer: moderngl.Framebuffer):
+        """Queue a readback of the framebuffer's current frame, at most self.fps times a second"""
+        if not self.is_recording:
+            return
+
+        if framebuffer.viewport[2:] != self.size:
+            print("Window size changed, stopping recording")
+            self.stop()
+            return
+
+        cur_time = time.perf_counter()
+        if cur_time < self.next_capture_time:
+            return
+
+        if self.next_capture_time == 0: # First frame
+            self.next_capture_time = cur_time + 1 / self.fps
+        else:
+            self.next_capture_time += (self.repeat_last_frame(cur_time) + 1) / self.fps
+
+        # The ring has come back around, so this slot's readback was started PBO_COUNT frames ago
+        self.collect_pbo(self.pbo_idx)
+
+        framebuffer.read_into(self.pbos[self.pbo_idx], viewport=(0, 0, self.size[0], self.size[1]), components=3, alignment=1)
+        self.pbo_pending[self.pbo_idx] = True
+        self.pbo_repeats[self.pbo_idx] = 1
+        self.pbo_idx = (self.pbo_idx + 1) % self.PBO_COUNT
+
+    def repeat_last_frame(self, cur_time: float) -> int:
+        """If we render slower than self.fps, the last frame stayed on screen for the capture times we missed, returns how many"""
+        missed = max(int((cur_time - self.next_capture_time) * self.fps), 0)
+        prev_idx = (self.pbo_idx - 1) % self.PBO_COUNT
+        if self.pbo_pending[prev_idx]:
+            self.pbo_repeats[prev_idx] += missed
+        else:
+            self.missed_repeats += missed
+        return missed
+
+    def collect_pbo(self, idx: int):
+        if not self.pbo_pending[idx]:
+            return
+        self.pbo_pending[idx] = False
+
+        data = self.pbos[idx].read()
+        repeats = self.pbo_repeats[idx] + self.missed_repeats
+        try:
+            self.write_queue.put_nowait((data, repeats))
+            self.frames_captured += repeats
+            self.missed_repeats = 0
+        except queue.Full:
+            self.frames_dropped += 1
+            self.missed_repeats = repeats
+
+    def run_writer(self, output, write_queue: queue.Queue):
+        is_ffmpeg = isinstance(output, subprocess.Popen)
+        out_file = output.stdin if is_ffmpeg else output
+        try:
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    break
+                data, repeats = item
+
+                if not is_ffmpeg:
+                    # Raw frames are stored top row first, GL reads bottom row first
+                    data = np.frombuffer(data, dtype=np.uint8).reshape(self.size[1], self.size[0], 3)[::-1].tobytes()
+                for _ in range(repeats):
+                    out_file.write(data)
+        except OSError as err:
+            print("Failed to write recorded frames:", err)
+            # Keep taking frames so the render thread never blocks on us
+            while not (write_queue.get() is None):
+                pass
+        finally:
+            try:
+                out_file.close()
+            except OSError:
+                pass
+            if is_ffmpeg:
+                output.wait()
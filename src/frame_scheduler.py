@@ -0,0 +1,70 @@
+import time
+
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import QTimer
+
+class FrameScheduler:
+    """
+    Decides when a widget draws its next frame, instead of redrawing flat out.
+
+    - max_fps caps the frame rate (0 for no cap)
+    - In on-demand mode, frames are only drawn while something is animating, or once new data arrives
+
+    Qt doesn't paint hidden or minimized widgets, so no frames are scheduled while the window is,
+    and drawing starts again with the paint Qt does once it's shown.
+    NOTE: A window covered by other windows still counts as shown, and keeps drawing.
+    """
+
+    # How often new data is checked for while idle in on-demand mode
+    IDLE_POLL_INTERVAL = 1 / 100
+
+    def __init__(self, widget: QtWidgets.QWidget, has_new_data,
+                 max_fps: float = 0, on_demand: bool = False):
+        self.widget = widget
+        self.has_new_data = has_new_data # Callable returning True if there is new data to draw
+        self.max_fps = max_fps
+        self.on_demand = on_demand
+
+        self.frame_start_time = time.perf_counter()
+        self.is_idle = False
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.on_timer)
+
+    def is_hidden(self) -> bool:
+        return self.widget.window().isMinimized() or not self.widget.isVisible()
+
+    def frame_started(self):
+        self.frame_start_time = time.perf_counter()
+
+    def frame_finished(self, is_animating: bool):
+        """Schedule the next frame, is_animating is if the last frame will look different when drawn again"""
+        if self.is_hidden():
+            self.is_idle = False
+            self.timer.stop()
+            return
+
+        if self.on_demand and not is_animating and not self.has_new_data():
+            self.is_idle = True
+            interval = self.IDLE_POLL_INTERVAL
+        else:
+            self.is_idle = False
+            interval = (1 / self.max_fps) if self.max_fps > 0 else 0
+
+        frame_time = time.perf_counter() - self.frame_start_time
+        self.timer.start(int(max(interval - frame_time, 0) * 1000))
+
+    def request_frame(self):
+        """Draw a frame as soon as possible, for things like user input"""
+        self.is_idle = False
+        self.timer.start(0)
+
+    def on_timer(self):
+        if self.is_idle:
+            if not self.has_new_data():
+                self.timer.start(int(self.IDLE_POLL_INTERVAL * 1000))
+                return
+            self.is_idle = False
+
+        self.widget.update()
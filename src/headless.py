@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+import moderngl
+from PIL import Image
+
+from states import GameState
+from renderer import Renderer
+from config import Config
+import packet_reader
+import state_recording
+
+# Renders a stream of states to image files without a window, on a standalone GL context
+# Each state is drawn over frames_per_state frames, interpolating from the previous state to it
+
+def read_input_packets(input_path: str):
+    """Packets of a packet stream file (or stdin for "-"), or of a state recording"""
+    if input_path == "-":
+        yield from packet_reader.read_packet_stream(sys.stdin.buffer)
+        return
+
+    with open(input_path, "rb") as input_file:
+        is_recording = input_file.read(len(state_recording.FILE_MAGIC)) == state_recording.FILE_MAGIC
+
+    if is_recording:
+        reader = state_recording.RecordingReader(input_path)
+        try:
+            for _, packet in reader.iter_packets():
+                yield packet
+        finally:
+            reader.close()
+    else:
+        with open(input_path, "rb") as input_file:
+            yield from packet_reader.read_packet_stream(input_file)
+
+class FrameTarget:
+    """Offscreen framebuffer to draw into, resolved to a plain framebuffer for reading when multisampled"""
+    def __init__(self, ctx: moderngl.Context, size, samples: int = 4):
+        self.ctx = ctx
+        self.size = size
+        self.samples = samples
+
+        self.resolved = ctx.framebuffer(
+            color_attachments=[ctx.renderbuffer(size, 3)],
+            depth_attachment=ctx.depth_renderbuffer(size)
+        )
+        if samples > 1:
+            self.framebuffer = ctx.framebuffer(
+                color_attachments=[ctx.renderbuffer(size, 3, samples=samples)],
+                depth_attachment=ctx.depth_renderbuffer(size, samples=samples)
+            )
+        else:
+            self.framebuffer = self.resolved
+
+    def read(self) -> np.ndarray:
+        """Get the last frame as a (height, width, 3) RGB array, top row first"""
+        if not (self.framebuffer is self.resolved):
+            self.ctx.copy_framebuffer(self.resolved, self.framebuffer)
+
+        data = self.resolved.read(components=3, alignment=1)
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.size[1], self.size[0], 3)[::-1]
+
+class FrameWriter:
+    """Writes frames as numbered PNGs into a directory, or as raw RGB24 into a file or stdout ("-")"""
+    def __init__(self, output_path: str, image_format: str):
+        self.output_path = output_path
+        self.image_format = image_format
+        self.frame_count = 0
+
+        if image_format == "png":
+            os.makedirs(output_path, exist_ok=True)
+            self.raw_file = None
+        elif output_path == "-":
+            self.raw_file = sys.__stdout__.buffer # sys.stdout is redirected to stderr for our prints
+        else:
+            dir_path = os.path.dirname(output_path)
+            if dir_path:
+                os.makedirs(dir_path, exist_ok=True)
+            self.raw_file = open(output_path, "wb")
+
+    def write(self, frame: np.ndarray):
+        if self.raw_file is None:
+            path = os.path.join(self.output_path, "frame_{:06d}.png".format(self.frame_count))
+            Image.fromarray(frame, "RGB").save(path)
+        else:
+            self.raw_file.write(frame.tobytes())
+        self.frame_count += 1
+
+    def close(self):
+        if not (self.raw_file is None):
+            self.raw_file.flush()
+            if not (self.raw_file is sys.__stdout__.buffer):
+                self.raw_file.close()
+
+def create_headless_context(backend: str = None) -> moderngl.Context:
+    if backend is None and sys.platform.startswith("linux"):
+        backend = "egl" # No X server on most build machines
+
+    if backend is None:
+        return moderngl.create_standalone_context(require=330)
+    else:
+        return moderngl.create_standalone_context(require=330, backend=backend)
+
+def run_headless(input_path: str, output_path: str, image_format: str = "png",
+                 size = (1280, 720), fps: float = 60, frames_per_state: int = 1, samples: int = 4,
+                 spectate_idx: int = 0, arena_geom_shader: bool = False, gl_backend: str = None,
+                 profile_trace_path: str = None, env_id: int = None):
+    if output_path == "-":
+        # Keep our own prints out of raw frames piped through stdout
+        sys.stdout = sys.stderr
+
+    ctx = create_headless_context(gl_backend)
+    print("Created headless GL context:", ctx.info["GL_RENDERER"])
+
+    target = FrameTarget(ctx, size, samples)
+    ctx.multisample = samples > 1
+
+    renderer = Renderer(ctx, Config(), arena_geom_shader, wait_for_arena_meshes=True)
+    renderer.framebuffer = target.framebuffer
+    renderer.spectate_idx = spectate_idx
+    renderer.profiler.set_enabled(not (profile_trace_path is None))
+
+    writer = FrameWriter(output_path, image_format)
+    state = GameState()
+    delta_time = 1 / fps
+
+    start_time = time.perf_counter()
+    state_count = 0
+    try:
+        for data in read_input_packets(input_path):
+            if not (env_id is None) and packet_reader.peek_env_id(data) != env_id:
+                continue
+            if not packet_reader.apply_packet(state, data):
+                continue
+            state_count += 1
+
+            for frame_idx in range(frames_per_state):
+                interp_ratio = (frame_idx + 1) / frames_per_state
+
+                renderer.profiler.begin_frame()
+                renderer.render(state, delta_time, interp_ratio, size[0], size[1])
+                renderer.profiler.phase("readback")
+                frame = target.read()
+                renderer.profiler.phase("write")
+                writer.write(frame)
+                renderer.profiler.end_frame()
+    except EOFError as err:
+        print("Stopped reading input:", err)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start_time
+    print("Rendered {} frames from {} states in {:.2f}s ({:.1f} fps)".format(
+        writer.frame_count, state_count, elapsed, writer.frame_count / max(elapsed, 1e-6)
+    ))
+
+    if not (profile_trace_path is None):
+        renderer.profiler.finish()
+        renderer.profiler.dump_trace(profile_trace_path)
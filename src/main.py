@@ -4,26 +4,28 @@ import random
 import threading
 import sys 
 import argparse
-import copy
 import struct
 
 from const import *
 from shaders import *
 from arena_shaders import *
 from socket_listener import SocketListener
+from state_recording import StateRecorder
+from replay_player import ReplayPlayer
+from rewind_buffer import RewindBuffer, RewindViewer
 from state_manager import *
 from ribbon import *
 from outline_renderer import OutlineRenderer
+from renderer import Renderer, make_ghost_tint
+from frame_scheduler import FrameScheduler
+from frame_profiler import FrameProfiler
+from frame_recorder import FrameRecorder
+import headless
 import ui
 from ui import get_ui, get_rewards_panel, QUIBarWidget, QRSVWindow
 from config import Config, ConfigVal
-from collision_mesh_loader import find_collision_mesh_root, load_collision_meshes_for_mode
 
 import moderngl
-import moderngl_window
-import moderngl_window.loaders.scene.wavefront as wvf
-from moderngl_window import resources
-from moderngl_window.meta import TextureDescription
 
 from PyQt5 import QtOpenGL, QtWidgets
 from PyQt5.QtCore import QSize, Qt
@@ -32,36 +34,52 @@ from PyQt5.QtGui import QScreen, QColor
 from OpenGL.GL import *
 from OpenGL.GLU import *
 
-import numpy as np
-
-from pyrr import Quaternion, Matrix33, Matrix44, Vector3, Vector4
+from pyrr import Quaternion, Matrix33
 
 import pywavefront
 
-# TODO: Move
-def safe_normalize(vec: pyrr.Vector3):
-    length = max(vec.length, 1e-6)
-    return vec / length
-
 # TODO: Move game logic out of here
 class QRSVGLWidget(QtOpenGL.QGLWidget):
-    def __init__(self, screen: QScreen):
+    def __init__(self, screen: QScreen, arena_geom_shader: bool = False,
+                 max_fps: float = 0, on_demand: bool = False,
+                 profile: bool = False, profile_trace_path: str = None,
+                 record_dir: str = None, record_fps: float = 60, grid_size: int = 0,
+                 ghosts: bool = False):
 
         self.config = Config()
 
         self.spectate_count = 0
-        self.spectate_idx = 0
         self.prev_interp_ratio = 0
-        self.car_cam_time = 0
         self.last_render_time = time.time()
         self.fps_counter = 0
         self.last_fps = 0
         self.prev_state = None # type: GameState
 
-        self.arena_mesh_cache = {}
-        self.arena_mesh_vertex_counts = {}
-        self.arena_mesh_vbos = {}
-        self.collision_mesh_root = None
+        # Received states are kept here, so we can pause and rewind
+        self.rewind_buffer = RewindBuffer(self.config)
+        self.rewind_viewer = RewindViewer(self.rewind_buffer)
+
+        self.drawn_publish_count = -1
+
+        # Envs per side of the grid, 0 to only show the selected env, toggled with G
+        self.grid_size = 0
+        self.set_grid_size(grid_size)
+
+        # Draw every other env's cars and balls as ghosts in the selected env's arena, toggled with O
+        global_env_table.set_ghosts_enabled(ghosts)
+
+        # Does all of the drawing, created with the GL context
+        self.renderer = None # type: Renderer
+        self.arena_geom_shader = arena_geom_shader
+
+        # Per-phase timings, toggled with F3 and dumped with F4
+        self.profile_on_start = profile
+        self.profile_trace_path = profile_trace_path
+
+        # Video recording of what's drawn, toggled with F5
+        self.frame_recorder = None # type: FrameRecorder
+        self.record_dir = record_dir if record_dir else (ROOT_PATH + "recordings/")
+        self.record_fps = record_fps
 
         ########################################################################
 
@@ -83,328 +101,66 @@ class QRSVGLWidget(QtOpenGL.QGLWidget):
 
         self.setMouseTracking(True)
 
-    def load_texture_2d(self, path: str) -> moderngl.Texture:
-        return resources.textures.load(TextureDescription(path=path))
-
-    def initializeGL(self):
-
-        self.ctx = moderngl.create_context()
-        moderngl_window.activate_context(None, self.ctx)
-
-        ##########################################
-
-        print("Creating shader programs...")
-
-        self.prog = self.ctx.program(
-            vertex_shader=VERT_SHADER,
-            fragment_shader=FRAG_SHADER,
+        self.frame_scheduler = FrameScheduler(
+            self,
+            lambda: self.get_publish_count() != self.drawn_publish_count,
+            max_fps, on_demand
         )
 
-        self.prog_arena = self.ctx.program(
-            vertex_shader=ARENA_VERT_SHADER,
-            fragment_shader=ARENA_FRAG_SHADER,
-            geometry_shader=ARENA_GEOM_SHADER
-        )
-
-        print("Creating outline renderer...")
-        #self.outline_renderer = OutlineRenderer(self.ctx, (self.width(), self.height())) # TODO: Fix resizing bugs
-        self.outline_renderer = None # Disabled due to weird shader compilation issues
-
-        print("Linking shader varaibles...")
-        self.pr_m_vp = self.prog['m_vp']
-        self.pr_m_model = self.prog['m_model']
-        self.pr_global_color = self.prog['globalColor']
-        self.pr_camera_pos = self.prog['cameraPos']
-
-        self.pra_m_vp = self.prog_arena['m_vp']
-        self.pra_m_model = self.prog_arena['m_model']
-        self.pra_ball_pos = self.prog_arena['ballPos']
-
-        ##########################################
-
-        self.ball_ribbon = RibbonEmitter()
-        self.car_ribbons = []
-
-        print("Data path:", DATA_DIR_PATH)
-        print("Loading models and textures...")
-
-        self.vaos = {}
-        self.load_vao("ArenaMeshCustom.obj", self.prog_arena)
-
-        self.load_vao("Octane.obj")
-        self.load_vao("Ball.obj")
-        self.load_vao("Puck.obj")
-
-        self.load_vao("BoostPad_Small_0.obj")
-        self.load_vao("BoostPad_Small_1.obj")
-        self.load_vao("BoostPad_Big_0.obj")
-        self.load_vao("BoostPad_Big_1.obj")
-
-        self.ts_octane = [
-            self.load_texture_2d(DATA_DIR_PATH + "T_Octane_B.png"),
-            self.load_texture_2d(DATA_DIR_PATH + "T_Octane_O.png")
-        ]
-        self.t_ball = self.load_texture_2d(DATA_DIR_PATH + "T_Ball.png")
-        self.t_puck = self.load_texture_2d(DATA_DIR_PATH + "T_Puck.png")
-        self.t_boostpad = self.load_texture_2d(DATA_DIR_PATH + "T_BoostPad.png")
-        self.t_boost_glow = self.load_texture_2d(DATA_DIR_PATH + "T_Boost_Glow.png")
-        self.t_black = self.load_texture_2d(DATA_DIR_PATH + "T_Black.png")
-        self.t_none = self.load_texture_2d(DATA_DIR_PATH + "T_None.png")
-
-        ############################################
-
-        # Make ribbon mesh
-        self.ribbon_max_verts = 1000
-        self.ribbon_verts = np.random.randn(self.ribbon_max_verts * 3) * 100
-        self.ribbon_vbo = self.ctx.buffer(self.ribbon_verts.astype('f4'))
-        self.ribbon_vao = self.ctx.simple_vertex_array(self.prog, self.ribbon_vbo, "in_position")
-        self.vaos['ribbon'] = self.ribbon_vao
-
-        # Make debug lines mesh
-        self.lines_max_verts = RenderState.MAX_LINES * 2
-        self.lines_verts = np.random.randn(self.lines_max_verts * 3) * 100
-        self.lines_vbo = self.ctx.buffer(self.lines_verts.astype('f4'))
-        self.lines_vao = self.ctx.simple_vertex_array(self.prog, self.lines_vbo, "in_position")
-        self.vaos['render_lines'] = self.lines_vao
-
-        ############################################
-
-        # Auto-enable multisampling if we have multiple samples
-        self.ctx.multisample = self.samples > 1
-
-        ############################################
-
-        print("Done.")
-
-    def load_vao(self, model_name, program = None):
-        loader = wvf.Loader(wvf.SceneDescription(path = DATA_DIR_PATH + "/" + model_name))
-        model = loader.load()
-        self.vaos[model_name] = model.root_nodes[0].mesh.vao.instance(self.prog if (program is None) else program)
-        if not (self.outline_renderer is None):
-            self.outline_renderer.load_vao(model_name, model)
-
-    def load_collision_arena_mesh(self, gamemode: str):
-        if self.collision_mesh_root is None:
-            self.collision_mesh_root = find_collision_mesh_root()
+    GRID_SIZES = (0, 2, 3, 4)
 
-        if self.collision_mesh_root is None:
-            return None
+    def set_grid_size(self, grid_size: int):
+        self.grid_size = grid_size
+        global_env_table.set_grid_size(grid_size * grid_size, time.time())
 
-        try:
-            packed, vert_count = load_collision_meshes_for_mode(self.collision_mesh_root, gamemode)
-        except Exception as exc:
-            print(f"Failed to load collision meshes for {gamemode}: {exc}")
-            return None
+    def get_publish_count(self) -> int:
+        """Total states published to what we draw, so the frame scheduler can tell if there's anything new"""
+        count = global_state_manager.publish_count
+        for env_id in global_env_table.get_grid_ids() + global_env_table.get_ghost_ids(time.time()):
+            count += global_env_table.get_state_manager(env_id).publish_count
+        return count
 
-        model_name = f"ArenaCollision_{gamemode}"
-        if model_name in self.vaos:
-            return model_name
-
-        vbo = self.ctx.buffer(packed.tobytes())
-        vao = self.ctx.vertex_array(
-            self.prog_arena,
-            [(vbo, "3f 4f", "in_position", "in_normal")]
-        )
-
-        self.vaos[model_name] = vao
-        self.arena_mesh_vertex_counts[model_name] = vert_count
-        self.arena_mesh_vbos[model_name] = vbo
-
-        return model_name
-
-    def get_arena_mesh_for_state(self, state: GameState):
-        gamemode = (state.gamemode or "soccar").lower()
+    @staticmethod
+    def calc_interp_ratio(state: GameState, cur_time: float) -> float:
+        interp_interval = max(state.recv_interval, 1e-6)
+        return min(max((cur_time - state.recv_time) / interp_interval, 0), 1)
 
-        if gamemode not in self.arena_mesh_cache:
-            model_name = self.load_collision_arena_mesh(gamemode)
-            if model_name is None:
-                model_name = "ArenaMeshCustom.obj"
-            self.arena_mesh_cache[gamemode] = model_name
+    @property
+    def spectate_idx(self) -> int:
+        return self.renderer.spectate_idx
 
-        model_name = self.arena_mesh_cache[gamemode]
-        return model_name, self.arena_mesh_vertex_counts.get(model_name)
+    @spectate_idx.setter
+    def spectate_idx(self, value: int):
+        self.renderer.spectate_idx = value
 
-    def render_model(self,
-                     pos, forward, up,
-                     model_name, texture, scale = 1.0, global_color = None,
-                     mode = moderngl.TRIANGLES, outline_color: Vector3 = None, vert_amount = None):
+    @property
+    def profiler(self) -> FrameProfiler:
+        return self.renderer.profiler
 
-        if pos is None:
-            model_mat = Matrix44.identity()
-        else:
-            pos = Vector3(pos)
-            forward = Vector3(forward)
-            up = Vector3(up)
-            right = Vector3(pyrr.vector3.cross(forward, up))
-
-            forward *= scale
-            right *= scale
-            up *= scale
-
-            model_mat = Matrix44([
-                forward[0], forward[1], forward[2], 0,
-                -right[0], -right[1], -right[2], 0,
-                up[0], up[1], up[2], 0,
-                pos[0], pos[1], pos[2], 1
-            ])
-
-        self.pr_m_model.write(model_mat.astype('f4'))
-        self.pra_m_model.write(model_mat.astype('f4'))
-
-        if global_color is None:
-            global_color = Vector4((0, 0, 0, 0))
-        self.pr_global_color.write(global_color.astype('f4'))
-
-        if texture is not None:
-            texture.use()
-        else:
-            self.t_none.use()
-
-        self.ctx.screen.use()
-        self.vaos[model_name].render(mode, vertices=(-1 if (vert_amount is None) else vert_amount))
-
-        if outline_color is not None:
-            self.outline_renderer.use_framebuf()
-            self.outline_renderer.pr_m_model.write(model_mat.astype('f4'))
-            self.outline_renderer.pr_color.write(Vector4((outline_color.x, outline_color.y, outline_color.z, 1)).astype('f4'))
-            self.outline_renderer.vaos[model_name].render(mode)
-
-    def render_ribbon(self, ribbon: RibbonEmitter, camera_pos, lifetime, width, start_taper_time, color):
-        if len(ribbon.points) == 0:
-            return
-
-        vertices = []
-
-        first_point = ribbon.points[0]
-        cam_to_ribbon_dir = safe_normalize(-(first_point.pos - camera_pos))
-        ribbon_away_dir = safe_normalize(first_point.vel)
-        ribbon_sideways_dir = ribbon_away_dir.cross(cam_to_ribbon_dir)
-
-        for point in ribbon.points: # type: RibbonPoint
-            if not point.connected:
-                continue
-
-            if point.time_active < start_taper_time:
-                width_scale = point.time_active / start_taper_time
-            else:
-                width_scale = 1 - (point.time_active / lifetime)
-
-            offset = ribbon_sideways_dir * width * width_scale
-            for i in range(2):
-                offset_scale = 1 if (i == 1) else -1
-                vertex_pos = point.pos + (offset * offset_scale)
-                if len(vertices) < self.ribbon_max_verts:
-                    vertices.append(vertex_pos)
-                else:
-                    break
-
-        if len(vertices) > 0:
-            while len(vertices) < self.ribbon_max_verts:
-                vertices.append(vertices[-1])
-        else:
-            return
+    def initializeGL(self):
+        self.ctx = moderngl.create_context()
+        self.renderer = Renderer(self.ctx, self.config, self.arena_geom_shader)
 
-        self.ribbon_vbo.write(np.array(vertices).astype('f4'), 0)
+        # Auto-enable multisampling if we have multiple samples
+        self.ctx.multisample = self.samples > 1
 
-        # glDisable(GL_CULL_FACE)
-        self.render_model(
-            None, None, None,
-            "ribbon", self.t_none, scale=20,
-            global_color=color,
-            mode=moderngl.TRIANGLE_STRIP
-        )
-        # glEnable(GL_CULL_FACE)
-
-    def calc_camera_state(self, state, interp_ratio, delta_time):
-        pos = Vector3((-4000, 0, 1000))
-        ball_pos = state.ball_state.get_pos(interp_ratio)
-
-        cam_dir = safe_normalize(ball_pos - pos)
-
-        is_spectating_car = self.spectate_idx > -1 and len(state.car_states) > self.spectate_idx
-        if is_spectating_car:
-            car_pos = state.car_states[self.spectate_idx].phys.get_pos(interp_ratio)
-            car_vel = state.car_states[self.spectate_idx].phys.get_vel(interp_ratio)
-            car_forward = state.car_states[self.spectate_idx].phys.get_forward(interp_ratio)
-
-            # Calculate ball cam
-            if True:
-                height = self.config.camera_height.val
-                dist = self.config.camera_distance.val
-
-                ball_cam_offset_dir = safe_normalize(safe_normalize(ball_pos - car_pos) * Vector3((1, 1, 0))).normalized
-
-                # As we tilt up, move the camera down
-                lean_scale = safe_normalize(ball_pos - car_pos).z
-                height_clamp = abs(ball_pos.z - car_pos.z) / self.config.camera_lean_min_height_clamp.val
-                if lean_scale > 0:
-                    height *= 1 - min(lean_scale * self.config.camera_lean_height_scale.val, height_clamp)
-
-                    # As we tilt up, move the camera closer
-                    dist *= 1 - lean_scale * self.config.camera_lean_dist_scale.val
-
-                ball_cam_offset = -ball_cam_offset_dir * dist
-                ball_cam_offset.z += height
-
-                # Make sure we are actually of the correct distance
-                ball_cam_offset = safe_normalize(ball_cam_offset) * dist
-                ball_cam_pos = car_pos + ball_cam_offset
-                ball_cam_dir = safe_normalize(ball_pos - ball_cam_pos)
-
-            # Calculate car cam dir
-            if True:
-                if car_vel.length > 0:
-                    car_cam_dir = safe_normalize(car_vel * Vector3((1, 1, 0)))
-                else:
-                    car_cam_dir = (car_forward * Vector3((1, 1, 0)))
-                    if car_cam_dir.length > 0:
-                        car_cam_dir = safe_normalize(car_cam_dir)
-                    else:
-                        car_cam_dir = Vector3((1, 1, 0))
-                car_cam_offset = -car_cam_dir * self.config.camera_distance.val
-                car_cam_offset.z = self.config.camera_height.val
-                car_cam_pos = car_pos + car_cam_offset
-
-            # Determine if dribbling
-            car_ball_delta = ball_pos - car_pos
-            dribbling = False
-            if car_vel.length > 500:
-                if 90 < car_ball_delta.z < 200:
-                    if (car_ball_delta * Vector3((1, 1, 0))).length < 135:
-                        if ball_pos.z < 300:
-                            dribbling = True
-
-            car_cam_start_delay = 0.25
-            car_cam_max_time = 0.65
-            car_cam_inc_speed = 0.8
-            car_cam_dec_speed = 0.5
-            if car_ball_delta.length > 1000:
-                car_cam_dec_speed *= 2 # Speed up when ball moved away quickly
-
-            if dribbling:
-                self.car_cam_time += car_cam_inc_speed * delta_time
-            else:
-                self.car_cam_time = min(self.car_cam_time, car_cam_max_time)
-                self.car_cam_time = max(0, self.car_cam_time - car_cam_dec_speed * delta_time)
-
-            # TODO: Auto car-cam is annoying, activates at bad times
-            car_cam_ratio = np.clip((self.car_cam_time - car_cam_start_delay) / (car_cam_max_time - car_cam_start_delay), 0, 1)
-
-            pos = ball_cam_pos*(1-car_cam_ratio) + car_cam_pos*car_cam_ratio
-            cam_dir = safe_normalize(ball_cam_dir*(1-car_cam_ratio) + car_cam_dir*car_cam_ratio)
-        else:
-            self.car_cam_time = 0
+        self.profiler.set_enabled(self.profile_on_start)
 
-        return pos, pos + cam_dir, (self.config.camera_fov.val if is_spectating_car else self.config.camera_bird_fov.val)
+        self.frame_recorder = FrameRecorder(self.ctx, self.record_dir, self.record_fps)
 
     def paintGL(self):
         pixel_ratio = self.devicePixelRatioF()
         width, height = int(self.width() * pixel_ratio), int(self.height() * pixel_ratio)
-        self.ctx.viewport = (0, 0, width, height)
+
+        self.frame_scheduler.frame_started()
+        self.profiler.begin_frame()
 
         cur_time = time.time()
         delta_time = cur_time - self.last_render_time
-        self.render(cur_time, delta_time, width, height)
+        self.render(delta_time, width, height)
+
+        self.profiler.phase("capture")
+        self.frame_recorder.capture(self.renderer.framebuffer)
 
         self.fps_counter += 1
 
@@ -414,210 +170,55 @@ class QRSVGLWidget(QtOpenGL.QGLWidget):
 
         self.last_render_time = cur_time
 
-        self.update()
+        self.profiler.end_frame()
+        keep_drawing = self.renderer.is_animating or self.profiler.enabled or self.frame_recorder.is_recording
+        self.frame_scheduler.frame_finished(keep_drawing)
 
-    def render(self, total_time, delta_time, width, height):
-        with global_state_mutex:
-            if not global_state_manager.state.ball_state.has_rot:
-                global_state_manager.state.ball_state.rotate_with_ang_vel(delta_time)
+    def render(self, delta_time, width, height):
+        self.profiler.phase("state")
 
-            state = copy.deepcopy(global_state_manager.state)
+        # Snapshot is ours until the next acquire(), no copy or lock needed
+        # Count is read first, so anything published after it is seen as new data
+        self.drawn_publish_count = self.get_publish_count()
+        state = global_state_manager.acquire()
+        if self.rewind_viewer.is_paused:
+            state = self.rewind_viewer.state
         self.prev_state = state
         self.spectate_count = len(state.car_states)
 
-        while len(self.car_ribbons) != len(state.car_states):
-            if len(self.car_ribbons) < len(state.car_states):
-                self.car_ribbons.append(RibbonEmitter())
-            else:
-                self.car_ribbons.pop()
-
         cur_time = time.time()
-        interp_interval = max(state.recv_interval, 1e-6)
-        interp_ratio = min(max((cur_time - state.recv_time) / interp_interval, 0), 1)
-
-        if not (self.outline_renderer is None):
-            self.outline_renderer.clear()
-
-        self.ctx.clear(0, 0, 0)
-        self.ctx.enable(moderngl.DEPTH_TEST)
-        self.ctx.enable(moderngl.BLEND)
-
-        self.ctx.cull_face = "back"
-        self.ctx.front_face = "cw"
-        self.ctx.enable(moderngl.CULL_FACE)
-
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA) # Normal blending
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR) # Use linear interpolation of pixels for supersampling
-
-        camera_pos, camera_target_pos, camera_fov = self.calc_camera_state(state, interp_ratio, delta_time)
-        proj = Matrix44.perspective_projection(camera_fov, -width/height, 0.1, 50 * 1000.0)
-        lookat = Matrix44.look_at(
-            camera_pos,
-            camera_target_pos,
-            (0.0, 0.0, 1.0),
-        )
-
-        self.pr_camera_pos.write(camera_pos.astype('f4'))
-        self.pr_m_vp.write((proj * lookat).astype('f4'))
-        self.pra_m_vp.write((proj * lookat).astype('f4'))
-        if not (self.outline_renderer is None):
-            self.outline_renderer.pr_m_vp.write((proj * lookat).astype('f4'))
-
-        if not (state.boost_pad_states is None) and state.gamemode != "heatseeker": # Render boost pads
-            for i in range(len(state.boost_pad_states)):
-                is_big = state.is_boost_big(i)
-
-                is_active = state.boost_pad_states[i]
-
-                pos = state.boost_pad_locations[i].copy()
-                pos.z = 0
-
-                model_name = "BoostPad"
-                model_name += "_Big_" if is_big else "_Small_"
-                model_name += "1" if is_active else "0"
-                model_name += ".obj"
-
-                self.render_model(
-                    pos, Vector3((1, 0, 0)), Vector3((0, 0, 1)),
-                    model_name,
-                    self.t_boostpad,
-                    scale=2.5,
-                )
-
-        if True: # Render ball/puck
-            ball_phys = state.ball_state
-            ball_pos = ball_phys.get_pos(interp_ratio)
-            
-            # Use puck model for snowday mode, ball for everything else
-            if state.gamemode == "snowday":
-                ball_model = 'Puck.obj'
-                ball_texture = self.t_puck
-            else:
-                ball_model = 'Ball.obj'
-                ball_texture = self.t_ball
-
-            ball_forward = ball_phys.get_forward(interp_ratio)
-            ball_up = ball_phys.get_up(interp_ratio)
-            
-            self.render_model(
-                ball_pos,
-                ball_forward, ball_up, ball_model, ball_texture,
-
-                #outline_color = Vector4((1, 1, 1, 1))
-            )
-
-            if state.gamemode == "heatseeker": # Update and render ball ribbon
-                ball_speed = ball_phys.get_vel(interp_ratio).length
-                speed_frac = (max(0, min(1, ball_speed / 2800)) ** 2)
-                ribbon_alpha = 0.75
-                ribbon_lifetime = 0.8
-
-                self.ball_ribbon.update(
-                    ball_speed > 600,
-                    0,
-                    ball_pos,
-                    Vector3((100,0,0)),
-                    ribbon_lifetime,
-                    delta_time
-                )
-
-                if ball_phys.is_teleporting():
-                    self.ball_ribbon.points.clear()
-
-                self.render_ribbon(
-                    self.ball_ribbon,
-                    camera_pos,
-                    ribbon_lifetime,
-                    width=50,
-                    start_taper_time=ribbon_lifetime / 10,
-                    color=Vector4((1, 1, 1, ribbon_alpha))
-                )
-
-        if True: # Render cars
-            for i in range(len(state.car_states)):
-                car_state = state.car_states[i]
-                if car_state.is_demoed:
-                    continue
-
-                car_ribbon = self.car_ribbons[i]
-
-                car_pos = car_state.phys.get_pos(interp_ratio)
-                car_forward = car_state.phys.get_forward(interp_ratio)
-                car_up = car_state.phys.get_up(interp_ratio)
-                outline_brightness = 1 - (1 / (1 + (car_pos - camera_pos).length / 1000))
-                self.render_model(
-                    car_pos, car_forward, car_up,
-                    model_name='Octane.obj', texture=self.ts_octane[car_state.team_num],
-
-                    #outline_color = (Vector3((0, 0.5, 1)) if (car_state.team_num == 0) else Vector3((1, 0.5, 0))) * outline_brightness
-                )
-
-                if True: # Update and render car ribbon
-                    RIBBON_LIFETIME = 0.3
-                    ribbon_emit_pos = car_pos - (car_forward * 40) + (car_up * 10)
-                    ribbon_vel = car_forward * -100
-                    car_ribbon.update(
-                        car_state.is_boosting,
-                        0,
-                        ribbon_emit_pos,
-                        ribbon_vel,
-                        RIBBON_LIFETIME,
-                        delta_time
-                    )
-
-                    if car_state.phys.is_teleporting():
-                        car_ribbon.points.clear()
-
-                    self.render_ribbon(
-                        car_ribbon,
-                        camera_pos,
-                        RIBBON_LIFETIME,
-                        20,
-                        RIBBON_LIFETIME / 10,
-                        Vector4((1, 0.9, 0.4, 1))
-                    )
-
-        ###########################################
-
-        arena_model_name, arena_vert_count = self.get_arena_mesh_for_state(state)
-        self.pra_ball_pos.write(state.ball_state.get_pos(interp_ratio).astype('f4'))
-        # self.ctx.disable(moderngl.CULL_FACE)
-        self.render_model(
-            None, None, None,
-            model_name=arena_model_name, texture=self.t_none, scale=1, global_color=Vector4((1,1,1,1)),
-            vert_amount=arena_vert_count
-        )
-        # self.ctx.enable(moderngl.CULL_FACE)
-
-        if not (self.outline_renderer is None):
-            self.outline_renderer.render_quad()
-
-        ###########################################
-
-        if len(state.render_state.lines) > 0:
-
-            vertices_flat = np.array(state.render_state.lines).flatten()
-            num_verts = vertices_flat.shape[0] // 3
-
-            # TODO: Manual construction of VBO and VAO every frame is very inefficient
-            # Instead, maybe keep a buffer of the max number of vertices and do a partial render from the occupied regions
-            self.lines_vbo.write(vertices_flat.astype('f4'))
-
-            self.ctx.disable(moderngl.DEPTH_TEST)
-
-            self.render_model(
-                None, None, None,
-                "render_lines", self.t_boost_glow, 1, Vector4((1, 1, 1, 1)),
-                mode=GL_LINES,
-                vert_amount=num_verts
-            )
-            self.ctx.enable(moderngl.DEPTH_TEST)
+        interp_ratio = self.calc_interp_ratio(state, cur_time)
+
+        # Live envs only, the single view is still used for replays and while rewinding
+        grid_ids = global_env_table.get_grid_ids()
+        if len(grid_ids) > 0 and not self.rewind_viewer.is_paused:
+            tiles = []
+            for env_id in grid_ids:
+                tile_state = global_env_table.get_state_manager(env_id).acquire()
+                tiles.append((env_id, tile_state, self.calc_interp_ratio(tile_state, cur_time)))
+            self.renderer.render_grid(tiles, delta_time, width, height, self.grid_size, self.grid_size)
+        else:
+            ghosts = None
+            if global_env_table.ghosts_enabled and not self.rewind_viewer.is_paused:
+                ghosts = []
+                ghost_alpha = self.config.ghost_alpha.val
+                for env_id in global_env_table.get_ghost_ids(cur_time):
+                    ghost_state = global_env_table.get_state_manager(env_id).acquire()
+                    if ghost_state.recv_time < 0: # Nothing received since ghosts were enabled
+                        continue
+                    ghosts.append((ghost_state, self.calc_interp_ratio(ghost_state, cur_time), make_ghost_tint(env_id, ghost_alpha)))
+
+            self.renderer.render(state, delta_time, interp_ratio, width, height, ghosts)
 
         ###########################################
 
+        self.profiler.phase("ui")
         ui_text = ""
         ui_text += "Render FPS: {}".format(self.last_fps) + "\n"
         ui_text += "Connected: {}".format(state.recv_time > 0) + "\n"
+        env_text = global_env_table.get_status_text(cur_time)
+        if env_text:
+            ui_text += env_text + "\n"
         game_mode = state.gamemode if state.gamemode else "unknown"
         ui_text += "Game Mode: {}".format(game_mode.replace("_", " ").title()) + "\n"
         blue_count = 0
@@ -633,11 +234,28 @@ class QRSVGLWidget(QtOpenGL.QGLWidget):
             ui_text += "Game Type: N/A" + "\n"
         if state.recv_interval > 0:
             ui_text += "Network rate: {:.2f}fps".format(1 / state.recv_interval) + "\n"
+        if not (g_socket_listener is None) and g_socket_listener.drain:
+            ui_text += "Packets applied/dropped: {}/{}".format(g_socket_listener.packets_applied, g_socket_listener.packets_dropped) + "\n"
+        if not (g_socket_listener is None) and g_socket_listener.fragments.packets_dropped > 0:
+            ui_text += "Incomplete fragmented packets: {}".format(g_socket_listener.fragments.packets_dropped) + "\n"
+        if not (g_socket_listener is None) and not (g_socket_listener.recorder is None):
+            recorder = g_socket_listener.recorder
+            ui_text += "Recorded states: {} ({:.1f} MB)".format(recorder.packets_recorded, recorder.bytes_written / (1024 * 1024)) + "\n"
+        if not (g_replay_player is None):
+            ui_text += g_replay_player.get_status_text() + "\n"
+        if self.rewind_viewer.is_paused:
+            ui_text += self.rewind_viewer.get_status_text() + "\n"
         ui_text += "Ball speed: {:.2f}kph".format(state.ball_state.prev_vel.length * (9 / 250)) + "\n"
         
         # Add any custom info lines from the sender
         for key, value in state.custom_info:
             ui_text += "{}: {}\n".format(key, value)
+
+        if self.frame_recorder.is_recording:
+            ui_text += "Recording: {} frames ({} dropped)".format(self.frame_recorder.frames_captured, self.frame_recorder.frames_dropped) + "\n"
+
+        if self.profiler.enabled:
+            ui_text += self.profiler.get_summary_text()
             
         get_ui().set_text(ui_text)
         
@@ -646,12 +264,9 @@ class QRSVGLWidget(QtOpenGL.QGLWidget):
         if rewards_panel:
             rewards_panel.update_rewards(state.car_states, self.spectate_idx)
 
-        ###########################################
 
         self.prev_interp_ratio = interp_ratio
 
-        ####################################################
-
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
             if self.spectate_count == 0:
@@ -661,6 +276,8 @@ class QRSVGLWidget(QtOpenGL.QGLWidget):
             if self.spectate_idx >= self.spectate_count:
                 self.spectate_idx = -1
 
+            self.frame_scheduler.request_frame()
+
     def keyPressEvent(self, event):
         # Switch to player closest to ball
         if event.key() == Qt.Key_P:
@@ -675,12 +292,99 @@ class QRSVGLWidget(QtOpenGL.QGLWidget):
                         closest_dist = dist_to_ball
 
                 self.spectate_idx = closest_idx
+                self.frame_scheduler.request_frame()
+
+        # Replay controls
+        elif not (g_replay_player is None) and self.handle_replay_key(event):
+            self.frame_scheduler.request_frame()
+
+        # Show several envs at once in a grid, or back to one
+        elif event.key() == Qt.Key_G:
+            grid_idx = self.GRID_SIZES.index(self.grid_size) if self.grid_size in self.GRID_SIZES else 0
+            self.set_grid_size(self.GRID_SIZES[(grid_idx + 1) % len(self.GRID_SIZES)])
+            self.frame_scheduler.request_frame()
+
+        # Draw the other envs as ghosts, or not
+        elif event.key() == Qt.Key_O:
+            global_env_table.set_ghosts_enabled(not global_env_table.ghosts_enabled)
+            self.frame_scheduler.request_frame()
+
+        # Switch to the next (or with shift, previous) env
+        elif event.key() == Qt.Key_E:
+            global_env_table.cycle(-1 if (event.modifiers() & Qt.ShiftModifier) else 1, time.time())
+            self.frame_scheduler.request_frame()
+
+        # Rewind controls
+        elif self.handle_rewind_key(event):
+            self.frame_scheduler.request_frame()
+
+        # Toggle the profiler
+        elif event.key() == Qt.Key_F3:
+            self.profiler.toggle()
+            self.frame_scheduler.request_frame()
+
+        # Dump the profiler's recorded frames
+        elif event.key() == Qt.Key_F4:
+            self.dump_profiler_trace()
+
+        # Start or stop recording video
+        elif event.key() == Qt.Key_F5:
+            pixel_ratio = self.devicePixelRatioF()
+            self.frame_recorder.toggle((int(self.width() * pixel_ratio), int(self.height() * pixel_ratio)))
+            self.frame_scheduler.request_frame()
+
+    def handle_replay_key(self, event) -> bool:
+        skip_time = 30 if (event.modifiers() & Qt.ShiftModifier) else 5
+        if event.key() == Qt.Key_Space:
+            g_replay_player.toggle_pause()
+        elif event.key() == Qt.Key_Left:
+            g_replay_player.skip(-skip_time)
+        elif event.key() == Qt.Key_Right:
+            g_replay_player.skip(skip_time)
+        elif event.key() == Qt.Key_Up:
+            g_replay_player.change_speed(1)
+        elif event.key() == Qt.Key_Down:
+            g_replay_player.change_speed(-1)
+        elif event.key() == Qt.Key_Home:
+            g_replay_player.seek(0)
+        else:
+            return False
+        return True
+
+    def handle_rewind_key(self, event) -> bool:
+        if event.key() == Qt.Key_F6:
+            self.rewind_viewer.toggle_pause()
+        elif event.key() == Qt.Key_Comma:
+            self.rewind_viewer.step(-1)
+        elif event.key() == Qt.Key_Period:
+            self.rewind_viewer.step(1)
+        elif event.key() == Qt.Key_BracketLeft:
+            self.rewind_viewer.skip(-1)
+        elif event.key() == Qt.Key_BracketRight:
+            self.rewind_viewer.skip(1)
+        else:
+            return False
+        return True
+
+    def stop_recording(self):
+        if not (self.frame_recorder is None) and self.frame_recorder.is_recording:
+            # Frames still in flight are read back from the GL context
+            self.makeCurrent()
+            self.frame_recorder.stop()
+
+    def dump_profiler_trace(self):
+        if self.profile_trace_path:
+            path = self.profile_trace_path
+        else:
+            path = ROOT_PATH + "traces/frame_trace_{}.json".format(time.strftime("%Y%m%d_%H%M%S"))
+        self.profiler.dump_trace(path)
 
 
 g_socket_listener = None
-def run_socket_thread(bind_addr, port):
+g_replay_player = None
+def run_socket_thread(bind_addr, port, drain, recorder, rewind_buffer):
     global g_socket_listener
-    g_socket_listener = SocketListener()
+    g_socket_listener = SocketListener(drain, recorder, rewind_buffer)
     g_socket_listener.run(bind_addr, port)
 
 
@@ -688,30 +392,108 @@ def parse_args():
     parser = argparse.ArgumentParser(description="RocketSim Visualizer")
     parser.add_argument("--port", "-p", type=int, default=9273, help="UDP port to listen on")
     parser.add_argument("--bind", "-b", type=str, default="127.0.0.1", help="Address to bind the UDP socket to (e.g. 0.0.0.0 for all interfaces)")
+    parser.add_argument("--arena-geometry-shader", action="store_true", help="Draw the arena wireframe with the old geometry shader path, instead of precomputed edge attributes")
+    parser.add_argument("--fps-cap", type=float, default=0, help="Maximum frames per second to render (0 for no cap besides vsync)")
+    parser.add_argument("--on-demand", action="store_true", help="Only render while something is moving or new states arrive, instead of constantly")
+    parser.add_argument("--profile", action="store_true", help="Start with the frame profiler enabled (toggle with F3)")
+    parser.add_argument("--profile-trace", type=str, default=None, help="Path to write the profiler's Chrome trace to, with F4 and on exit (default: traces/ with a timestamp, F4 only)")
+    parser.add_argument("--record-dir", type=str, default=None, help="Directory to save recordings to (toggle recording with F5, default: recordings/)")
+    parser.add_argument("--record-fps", type=float, default=60, help="Frame rate to record video at")
+    parser.add_argument("--replay", type=str, default=None, help="Play a state recording instead of listening on UDP (space: pause, left/right: seek, up/down: speed)")
+    parser.add_argument("--record-states", type=str, default=None, help="File to record every received state to, for replaying later")
+    parser.add_argument("--grid", type=int, default=0, choices=range(0, 5), metavar="N", help="Show N by N envs at once (up to 4, toggle with G), when several envs send states")
+    parser.add_argument("--ghosts", action="store_true", help="Draw the cars and balls of every other env as ghosts in the selected env's arena (toggle with O), this decodes every env's states")
+    parser.add_argument("--drain", action="store_true", help="Only decode the newest received state each frame, dropping older queued packets (use when sending faster than real time, rewards from dropped packets are not accumulated)")
+
+    headless_args = parser.add_argument_group("headless rendering", "Render states from a file or pipe to frames without a window, instead of listening on UDP")
+    headless_args.add_argument("--headless", action="store_true", help="Render frames offscreen instead of opening a window")
+    headless_args.add_argument("--input", "-i", type=str, default="-", help="State recording, or file of packets to render (binary packets back to back or one JSON state per line) (\"-\" for stdin)")
+    headless_args.add_argument("--output", "-o", type=str, default="frames", help="Directory for PNG frames, or file for raw frames (\"-\" for stdout)")
+    headless_args.add_argument("--format", type=str, default="png", choices=["png", "raw"], help="PNG files, or raw RGB24 frames (e.g. for ffmpeg -f rawvideo -pix_fmt rgb24)")
+    headless_args.add_argument("--size", type=str, default="1280x720", help="Frame size as WIDTHxHEIGHT")
+    headless_args.add_argument("--fps", type=float, default=60, help="Frame rate of the output, which sets the time step of ribbons and the camera")
+    headless_args.add_argument("--frames-per-state", type=int, default=1, help="Frames to render per input state, interpolating from the previous state")
+    headless_args.add_argument("--samples", type=int, default=4, help="Multisampling samples (1 to disable)")
+    headless_args.add_argument("--env", type=int, default=None, help="Only render states from this env id, when the input has states from several envs")
+    headless_args.add_argument("--spectate", type=int, default=0, help="Index of the car to follow, or -1 for the ball cam")
+    headless_args.add_argument("--gl-backend", type=str, default=None, help="moderngl standalone context backend (default: egl on Linux)")
     return parser.parse_args()
 
+def run_headless(args):
+    try:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+    except ValueError:
+        print("Invalid --size \"{}\", should be WIDTHxHEIGHT".format(args.size))
+        exit(1)
+
+    headless.run_headless(
+        args.input, args.output, args.format,
+        size=(width, height), fps=args.fps, frames_per_state=max(args.frames_per_state, 1), samples=args.samples,
+        spectate_idx=args.spectate, arena_geom_shader=args.arena_geometry_shader, gl_backend=args.gl_backend,
+        profile_trace_path=args.profile_trace, env_id=args.env
+    )
+
 def main():
+    global g_replay_player
+
     args = parse_args()
+    if args.headless:
+        run_headless(args)
+        return
+
     port = args.port
     bind_addr = args.bind
     
     print("Starting RocketSimVis...")
-    print(f"Binding UDP listener to {bind_addr}:{port}...")
-    print("Starting socket thread...")
-    socket_thread = threading.Thread(target=run_socket_thread, args=(bind_addr, int(port)))
-    socket_thread.start()
-
-    print("Starting visualizer window...")
 
     app = QtWidgets.QApplication([])
     ui.update_scaling_factor(app)
 
-    window = QRSVWindow(QRSVGLWidget(app.primaryScreen()))
+    gl_widget = QRSVGLWidget(
+        app.primaryScreen(), args.arena_geometry_shader,
+        max_fps=args.fps_cap, on_demand=args.on_demand,
+        profile=args.profile, profile_trace_path=args.profile_trace,
+        record_dir=args.record_dir, record_fps=args.record_fps, grid_size=args.grid,
+        ghosts=args.ghosts
+    )
+
+    state_recorder = None
+    if args.replay:
+        print("Opening replay \"{}\"...".format(args.replay))
+        g_replay_player = ReplayPlayer(args.replay)
+        socket_thread = threading.Thread(target=g_replay_player.run)
+    else:
+        print(f"Binding UDP listener to {bind_addr}:{port}...")
+        print("Starting socket thread...")
+        if args.record_states:
+            state_recorder = StateRecorder(args.record_states)
+            print("Recording received states to \"{}\"".format(args.record_states))
+
+        socket_thread = threading.Thread(
+            target=run_socket_thread,
+            args=(bind_addr, int(port), args.drain, state_recorder, gl_widget.rewind_buffer)
+        )
+    socket_thread.start()
+
+    print("Starting visualizer window...")
+
+    window = QRSVWindow(gl_widget)
     window.showNormal()
     app.exec_()
 
+    gl_widget.stop_recording()
+
+    if args.profile_trace and not (gl_widget.renderer is None) and len(gl_widget.profiler.trace) > 0:
+        gl_widget.profiler.dump_trace(args.profile_trace)
+
     print("Shutting down...")
-    g_socket_listener.stop_async()
+    if not (g_replay_player is None):
+        g_replay_player.stop_async()
+    else:
+        g_socket_listener.stop_async()
+    if not (state_recorder is None):
+        socket_thread.join()
+        state_recorder.close()
     exit()
 
 if __name__ == "__main__":
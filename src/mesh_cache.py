@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+import moderngl
+import moderngl_window.loaders.scene.wavefront as wvf
+from moderngl_window.opengl.vao import VAO
+
+from const import CACHE_DIR_PATH
+
+# Bump this when the layout of anything cached changes, so old caches are ignored
+CACHE_VERSION = 1
+
+# Disk cache of preprocessed mesh arrays
+# Each entry is a set of .npy files plus a .json file of metadata, all named by a key of the source files
+# The .json is written last, so an entry is only seen once it is complete
+
+def get_source_key(paths) -> str:
+    """Key of the source files' paths, sizes and modification times"""
+    hasher = hashlib.sha1(str(CACHE_VERSION).encode())
+    for path in paths:
+        stat = os.stat(path)
+        hasher.update("{}|{}|{}\n".format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns).encode())
+    return hasher.hexdigest()[:16]
+
+def _get_entry_dir(name: str) -> str:
+    return os.path.join(CACHE_DIR_PATH, name)
+
+def load(name: str, key: str) -> Optional[Tuple[dict, dict]]:
+    """Get the memory-mapped arrays and metadata of a cache entry, or None if there is no valid entry"""
+    entry_dir = _get_entry_dir(name)
+    meta_path = os.path.join(entry_dir, key + ".json")
+    if not os.path.isfile(meta_path):
+        return None
+
+    try:
+        with open(meta_path, "r") as meta_file:
+            meta = json.load(meta_file)
+
+        arrays = {}
+        for array_name in meta["arrays"]:
+            arrays[array_name] = np.load(os.path.join(entry_dir, "{}.{}.npy".format(key, array_name)), mmap_mode="r")
+        return arrays, meta["meta"]
+    except Exception as err:
+        print("Failed to read mesh cache entry {}/{}: {}".format(name, key, err))
+        return None
+
+def save(name: str, key: str, arrays: dict, meta: dict):
+    """Write a cache entry, replacing any older entries of the same name"""
+    entry_dir = _get_entry_dir(name)
+    try:
+        os.makedirs(entry_dir, exist_ok=True)
+
+        for file_name in os.listdir(entry_dir):
+            if not file_name.startswith(key + "."):
+                os.remove(os.path.join(entry_dir, file_name))
+
+        for array_name, array in arrays.items():
+            np.save(os.path.join(entry_dir, "{}.{}.npy".format(key, array_name)), np.ascontiguousarray(array))
+
+        meta_path = os.path.join(entry_dir, key + ".json")
+        with open(meta_path + ".tmp", "w") as meta_file:
+            json.dump({ "arrays": list(arrays.keys()), "meta": meta }, meta_file)
+        os.replace(meta_path + ".tmp", meta_path)
+    except OSError as err:
+        print("Failed to write mesh cache entry {}/{}: {}".format(name, key, err))
+
+def read_vao_attributes(vao: VAO, attribute_names: list) -> dict:
+    """Read float attributes of a moderngl_window VAO back from the GPU, as (N, components) arrays"""
+    arrays = {}
+    for attribute_name in attribute_names:
+        buffer_info = vao.get_buffer_by_name(attribute_name)
+        data = np.frombuffer(buffer_info.buffer.read(), dtype=np.uint8).reshape(buffer_info.vertices, buffer_info.vertex_size)
+
+        offset = 0
+        for attrib_format, name in zip(buffer_info.attrib_formats, buffer_info.attributes):
+            if name == attribute_name:
+                arrays[name] = data[:, offset:offset + attrib_format.bytes_total].copy().view("<f4")
+            offset += attrib_format.bytes_total
+    return arrays
+
+def load_wavefront_vao(ctx: moderngl.Context, path: str) -> VAO:
+    """
+    Load a Wavefront OBJ mesh as a moderngl_window VAO.
+    The interleaved vertex data is cached on first load, so later loads skip parsing the OBJ entirely.
+    """
+    name = os.path.basename(path)
+    key = get_source_key([path])
+
+    cached = load(name, key)
+    if not (cached is None):
+        arrays, meta = cached
+        vao = VAO(name, mode=meta["mode"])
+        vao.buffer(ctx.buffer(arrays["vertices"]), meta["format"], meta["attributes"])
+        return vao
+
+    scene = wvf.Loader(wvf.SceneDescription(path = path)).load()
+    vao = scene.root_nodes[0].mesh.vao
+
+    # The loader gives a single interleaved buffer
+    buffer_info = vao.get_buffer_by_name("in_position")
+    vertices = np.frombuffer(buffer_info.buffer.read(), dtype=np.uint8)
+    save(
+        name, key,
+        { "vertices": vertices },
+        {
+            "mode": vao.mode,
+            "format": " ".join(attrib_format.format for attrib_format in buffer_info.attrib_formats),
+            "attributes": list(buffer_info.attributes),
+        }
+    )
+    return vao
@@ -43,8 +43,8 @@ class OutlineRenderer:
         self.pr_m_vp.write(m_vp.astype('f4'))
         self.pr_m_model.write(m_model.astype('f4'))
 
-    def load_vao(self, model_name, model):
-        self.vaos[model_name] = model.root_nodes[0].mesh.vao.instance(self.prog_unlit)
+    def load_vao(self, model_name, mesh):
+        self.vaos[model_name] = mesh.instance(self.prog_unlit)
 
     def use_framebuf(self):
         self.offscreen.use()
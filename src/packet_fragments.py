@@ -0,0 +1,102 @@
+import struct
+
+# Packets too big for one UDP datagram are sent as fragments, see "Large packets" in networking-format.md
+# Every fragment starts with FRAGMENT_MAGIC, so the listener can tell them apart from whole packets
+
+FRAGMENT_MAGIC = b"RSVF"
+FRAGMENT_VERSION = 1
+
+# magic, version, reserved, fragment index, fragment count, sequence number
+FRAGMENT_HEADER_STRUCT = struct.Struct("<4sBBHHI")
+
+def is_fragment(data) -> bool:
+    return data[:len(FRAGMENT_MAGIC)] == FRAGMENT_MAGIC
+
+def is_newer_seq(seq: int, other_seq: int) -> bool:
+    """If seq comes after other_seq, allowing for the u32 sequence number wrapping around"""
+    return 0 < ((seq - other_seq) & 0xFFFFFFFF) < 0x80000000
+
+class PartialPacket:
+    def __init__(self, seq: int, count: int, start_time: float):
+        self.seq = seq
+        self.parts = [None] * count
+        self.num_received = 0
+        self.size = 0
+        self.start_time = start_time
+
+class FragmentAssembler:
+    """
+    Puts fragmented packets back together, as they're received.
+
+    Each sender (address) has at most one packet being reassembled, so memory is bounded and one lost fragment only loses one packet:
+    a fragment of a newer packet drops the incomplete one, and fragments of older packets are ignored.
+    Packets that aren't complete after TIMEOUT are dropped too, as are ones past MAX_PACKET_SIZE.
+    """
+
+    # How long the fragments of one packet can take to all arrive
+    TIMEOUT = 0.5
+
+    MAX_PACKET_SIZE = 16 * 1024 * 1024
+
+    def __init__(self):
+        self.partial_packets = {} # Sender address -> PartialPacket
+        self.packets_dropped = 0
+
+    def add(self, data, addr, recv_time: float):
+        """Add a received fragment, returns the whole packet if this was its last missing fragment or None otherwise"""
+        if len(data) < FRAGMENT_HEADER_STRUCT.size:
+            print("ERROR: Fragment too small for header ({} bytes)".format(len(data)))
+            return None
+
+        _, version, _, index, count, seq = FRAGMENT_HEADER_STRUCT.unpack_from(data, 0)
+        if version != FRAGMENT_VERSION:
+            print("ERROR: Unsupported fragment version {}, expected {}".format(version, FRAGMENT_VERSION))
+            return None
+        if index >= count:
+            print("ERROR: Fragment index {} out of range of its {} fragments".format(index, count))
+            return None
+
+        self.drop_timed_out(recv_time)
+
+        packet = self.partial_packets.get(addr)
+        if not (packet is None) and packet.seq != seq:
+            if is_newer_seq(packet.seq, seq):
+                return None # Late fragment of a packet we've already given up on
+
+            # Newer packet started, this one won't be completed
+            self.packets_dropped += 1
+            packet = None
+
+        if packet is None:
+            packet = PartialPacket(seq, count, recv_time)
+            self.partial_packets[addr] = packet
+        elif len(packet.parts) != count:
+            print("ERROR: Fragment count changed from {} to {} within a packet".format(len(packet.parts), count))
+            self.drop(addr)
+            return None
+
+        if not (packet.parts[index] is None):
+            return None # Duplicate
+
+        payload = data[FRAGMENT_HEADER_STRUCT.size:]
+        packet.size += len(payload)
+        if packet.size > self.MAX_PACKET_SIZE:
+            print("ERROR: Fragmented packet is over the maximum size of {} bytes".format(self.MAX_PACKET_SIZE))
+            self.drop(addr)
+            return None
+
+        packet.parts[index] = payload
+        packet.num_received += 1
+        if packet.num_received < count:
+            return None
+
+        del self.partial_packets[addr]
+        return b"".join(packet.parts)
+
+    def drop(self, addr):
+        del self.partial_packets[addr]
+        self.packets_dropped += 1
+
+    def drop_timed_out(self, cur_time: float):
+        for addr in [addr for addr, packet in self.partial_packets.items() if cur_time - packet.start_time > self.TIMEOUT]:
+            self.drop(addr)
@@ -0,0 +1,115 @@
+import json
+import re
+import traceback
+
+import binary_format
+from states import GameState
+
+# Decoding of received packets (JSON or binary) into a GameState, shared by the socket listener and headless rendering
+
+# Finds "env_id" in JSON text without parsing the rest, senders should put it first so the search stops early
+# NOTE: This would also match an "env_id" key nested in other objects, there are none in the format
+_JSON_ENV_ID_PATTERN = re.compile(rb'"env_id"\s*:\s*(\d+)')
+
+def peek_env_id(data) -> int:
+    """Env id of a packet (JSON or binary) without decoding it, 0 if it has none"""
+    if binary_format.is_binary_packet(data):
+        return binary_format.peek_env_id(data)
+
+    match = _JSON_ENV_ID_PATTERN.search(data)
+    if match is None:
+        return 0
+    return int(match.group(1))
+
+def split_packets(data) -> list:
+    """
+    The packets of a datagram, to apply one by one: the env packets of a batch packet (as views of it, not copies),
+    or just the datagram itself
+    """
+    if not binary_format.is_batch_packet(data):
+        return [data]
+
+    try:
+        return binary_format.split_batch(data)
+    except ValueError as err:
+        print("ERROR decoding batch packet:", err)
+        return []
+
+def decode_json(data):
+    try:
+        return json.loads(data.decode("utf-8"))
+    except json.decoder.JSONDecodeError as err:
+        print("ERROR parsing received text to JSON:", err)
+
+        view_range = 10
+        start, stop = max(0, err.pos - view_range), min(err.pos + view_range, len(err.doc) - 1)
+        snippet = err.doc[start:stop].replace('\r', '').replace('\n', ' ')
+        snippet_prefix = "Received JSON: "
+        underline = (' ' * (len(snippet)//2 + len(snippet_prefix))) + '^ HERE'
+        print("\t" + snippet_prefix + snippet)
+        print("\t" + underline)
+        return None
+
+def decode_binary(data):
+    try:
+        return binary_format.decode_packet(data)
+    except ValueError as err:
+        print("ERROR decoding binary packet:", err)
+        return None
+
+def apply_packet(state: GameState, data) -> bool:
+    """Read a packet into the state, returns False if it couldn't be decoded at all"""
+    is_binary = binary_format.is_binary_packet(data)
+    if is_binary:
+        j = decode_binary(data)
+    else:
+        j = decode_json(data)
+
+    if j is None:
+        return False
+
+    try:
+        if is_binary:
+            state.read_from_binary(j)
+        else:
+            state.read_from_json(j)
+    except:
+        print("ERROR reading received {}:".format("binary packet" if is_binary else "JSON"))
+        traceback.print_exc()
+
+    return True
+
+def _read_exact(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError("Packet stream ended in the middle of a packet")
+    return data
+
+def read_packet_stream(stream):
+    """
+    Yield the packets of a binary file-like stream, in the same formats as sent over UDP.
+    Binary packets are back to back (their size is in their header), JSON packets are one per line.
+    The two can be mixed. Batch packets are split into their env packets.
+    """
+    magic_size = len(binary_format.MAGIC)
+    while True:
+        start = stream.read(magic_size)
+        if len(start) < magic_size:
+            if start.strip():
+                raise EOFError("Packet stream ended in the middle of a packet")
+            return
+
+        if binary_format.is_batch_packet(start):
+            # The batch header and the header of its first packet give the batch size
+            header = start + _read_exact(stream, binary_format.BATCH_HEADER_STRUCT.size - magic_size)
+            num_envs = binary_format.BATCH_HEADER_STRUCT.unpack_from(header, 0)[-1]
+            if num_envs > 0:
+                header += _read_exact(stream, binary_format.HEADER_STRUCT.size)
+            yield from split_packets(header + _read_exact(stream, binary_format.get_batch_size(header) - len(header)))
+        elif binary_format.is_binary_packet(start):
+            header = start + _read_exact(stream, binary_format.HEADER_STRUCT.size - magic_size)
+            yield header + _read_exact(stream, binary_format.get_packet_size(header) - len(header))
+        else:
+            line = start + stream.readline()
+            if line.strip():
+                yield line
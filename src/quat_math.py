@@ -0,0 +1,98 @@
+import numpy as np
+
+# Batched quaternion math on (N, 4) float32 arrays in (x, y, z, w) order, same as pyrr
+# Rotations map the local x axis to an object's forward and the local z axis to its up
+
+def normalize_quats(q: np.ndarray) -> np.ndarray:
+    return q / np.maximum(np.linalg.norm(q, axis=-1, keepdims=True), 1e-8)
+
+def identity_quats(count: int) -> np.ndarray:
+    q = np.zeros((count, 4), dtype=np.float32)
+    q[:, 3] = 1
+    return q
+
+def quats_from_basis(forward: np.ndarray, up: np.ndarray) -> np.ndarray:
+    """Rotations from (N, 3) forward and up directions"""
+    forward = np.asarray(forward, dtype=np.float32)
+    up = np.asarray(up, dtype=np.float32)
+    left = np.cross(up, forward)
+
+    # Columns of the rotation matrix are forward, left and up
+    m00, m10, m20 = forward[:, 0], forward[:, 1], forward[:, 2]
+    m01, m11, m21 = left[:, 0], left[:, 1], left[:, 2]
+    m02, m12, m22 = up[:, 0], up[:, 1], up[:, 2]
+
+    # Compute all four standard solutions, and take the most numerically stable one per row
+    trace = m00 + m11 + m22
+    case = np.argmax(np.stack((trace, m00, m11, m22), axis=1), axis=1)
+
+    def safe_scale(v):
+        return np.sqrt(np.maximum(v, 1e-12)) * 2
+
+    s = safe_scale(1 + trace)
+    q_w = np.stack(((m21 - m12) / s, (m02 - m20) / s, (m10 - m01) / s, s / 4), axis=1)
+    s = safe_scale(1 + m00 - m11 - m22)
+    q_x = np.stack((s / 4, (m01 + m10) / s, (m02 + m20) / s, (m21 - m12) / s), axis=1)
+    s = safe_scale(1 + m11 - m00 - m22)
+    q_y = np.stack(((m01 + m10) / s, s / 4, (m12 + m21) / s, (m02 - m20) / s), axis=1)
+    s = safe_scale(1 + m22 - m00 - m11)
+    q_z = np.stack(((m02 + m20) / s, (m12 + m21) / s, s / 4, (m10 - m01) / s), axis=1)
+
+    q = np.choose(case[:, None], (q_w, q_x, q_y, q_z))
+    return normalize_quats(q).astype(np.float32)
+
+def quats_to_basis(q: np.ndarray):
+    """Forward and up directions, both (N, 3), of rotations"""
+    x, y, z, w = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    forward = np.stack((
+        1 - 2 * (y * y + z * z),
+        2 * (x * y + z * w),
+        2 * (x * z - y * w),
+    ), axis=1)
+    up = np.stack((
+        2 * (x * z + y * w),
+        2 * (y * z - x * w),
+        1 - 2 * (x * x + y * y),
+    ), axis=1)
+    return forward, up
+
+def quat_mul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Hamilton product a * b (applies b, then a)"""
+    ax, ay, az, aw = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bx, by, bz, bw = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+    return np.stack((
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+        aw * bw - ax * bx - ay * by - az * bz,
+    ), axis=-1)
+
+def quat_slerp(q0: np.ndarray, q1: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Spherical interpolation along the shortest arc, t is (N,) or (N, 1)"""
+    t = np.asarray(t, dtype=np.float32).reshape(-1, 1)
+
+    dot = np.sum(q0 * q1, axis=1, keepdims=True)
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.minimum(dot, 1))
+    sin_theta = np.sin(theta)
+
+    # Nearly identical rotations fall back to a linear blend
+    is_small = sin_theta < 1e-4
+    safe_sin_theta = np.where(is_small, 1, sin_theta)
+    w0 = np.where(is_small, 1 - t, np.sin((1 - t) * theta) / safe_sin_theta)
+    w1 = np.where(is_small, t, np.sin(t * theta) / safe_sin_theta)
+
+    return normalize_quats(q0 * w0 + q1 * w1).astype(np.float32)
+
+def integrate_ang_vel(q: np.ndarray, ang_vel: np.ndarray, delta_time: float) -> np.ndarray:
+    """Rotate (N, 4) rotations by world-space (N, 3) angular velocities over delta_time"""
+    # https://stackoverflow.com/questions/24197182/efficient-quaternion-angular-velocity/24201879#24201879
+    s_ang_vel = ang_vel * delta_time
+    angle = np.linalg.norm(s_ang_vel, axis=1, keepdims=True)
+    axis = s_ang_vel / np.maximum(angle, 1e-8)
+    half = angle / 2
+
+    rot = np.concatenate((axis * np.sin(half), np.cos(half)), axis=1)
+    return normalize_quats(quat_mul(rot, q)).astype(np.float32)
@@ -0,0 +1,971 @@
+import colorsys
+
+import numpy as np
+
+import moderngl
+import moderngl_window
+from moderngl_window import resources
+from moderngl_window.meta import TextureDescription
+
+import pyrr
+from pyrr import Matrix44, Vector3, Vector4
+
+from const import *
+from shaders import *
+from arena_shaders import *
+from states import *
+from ribbon import RibbonEmitter
+from car_renderer import CarRenderer
+from frame_profiler import FrameProfiler
+from config import Config
+from collision_mesh_loader import find_collision_mesh_root, make_edge_mesh
+from arena_mesh_preloader import ArenaMeshPreloader
+import quat_math
+import mesh_cache
+
+def safe_normalize(vec: pyrr.Vector3):
+    length = max(vec.length, 1e-6)
+    return vec / length
+
+def make_ghost_tint(env_id: int, alpha: float) -> tuple:
+    """RGBA tint of an env's ghosts, hues are spread by the golden ratio so nearby ids look different"""
+    hue = (env_id * 0.618033988749895) % 1
+    return (*colorsys.hsv_to_rgb(hue, 0.7, 1), alpha)
+
+# Per-instance data of a boost pad
+PAD_INSTANCE_DTYPE = np.dtype([
+    ("pos", "<f4", 3),
+    ("flags", "<f4", 2), # (is_big, is_active)
+    ("tile", "<f4"), # Viewport tile, see TILE_VERT_FUNCS
+])
+
+# Not in moderngl's flags, enabled with ctx.enable_direct()
+GL_CLIP_DISTANCE0 = 0x3000
+
+# Static stadium camera, used when not spectating a car and for every tile in grid mode
+BIRD_CAMERA_POS = (-4000, 0, 1000)
+
+# Pixels between tiles in grid mode
+GRID_TILE_GAP = 1
+GRID_BACKGROUND_COLOR = (0.2, 0.2, 0.2)
+
+class Renderer:
+    """
+    Draws game states with a moderngl context, into any framebuffer.
+    Doesn't depend on Qt, so it can run in a window or on a standalone (headless) context.
+    """
+    def __init__(self, ctx: moderngl.Context, config: Config, arena_geom_shader: bool = False,
+                 wait_for_arena_meshes: bool = False):
+        self.ctx = ctx
+        self.config = config
+
+        # Framebuffer drawn to by render()
+        self.framebuffer = ctx.screen
+
+        # -1 for the ball cam, otherwise the index of the car being spectated
+        self.spectate_idx = 0
+        self.car_cam_time = 0
+
+        # If the last frame would look different when drawn again, see FrameScheduler
+        self.is_animating = True
+
+        # Tracks the ball's rotation ourselves when the sender doesn't provide it
+        self.ball_spin_rot = quat_math.identity_quats(1)
+
+        # Cameras and rects of the tiles the instanced shaders draw into, see TILE_VERT_FUNCS
+        # Outside of grid mode, only tile 0 is used and it covers the whole viewport
+        self.tile_m_vps = np.zeros((MAX_GRID_TILES, 4, 4), dtype=np.float32)
+        self.tile_rects = np.zeros((MAX_GRID_TILES, 4), dtype=np.float32)
+
+        # Per-tile state in grid mode, indexed by tile
+        self.grid_ball_spin_rots = {} # Env id -> (1, 4) ball spin, see spin_ball()
+        self.grid_pad_instances = [None] * MAX_GRID_TILES # (locations, states, gamemode, instances)
+
+        self.arena_mesh_cache = {}
+        self.arena_mesh_vertex_counts = {}
+        self.arena_mesh_vbos = {}
+
+        # Draw the arena wireframe with ARENA_GEOM_SHADER, instead of from precomputed edge coordinates
+        self.arena_geom_shader = arena_geom_shader
+
+        # Collision meshes of all gamemodes are decoded in the background, until then the default arena mesh is shown
+        # When exporting frames, we'd rather wait for them than draw the wrong arena
+        self.wait_for_arena_meshes = wait_for_arena_meshes
+        self.collision_mesh_root = find_collision_mesh_root()
+        if self.collision_mesh_root is None:
+            self.arena_mesh_preloader = None
+        else:
+            self.arena_mesh_preloader = ArenaMeshPreloader(self.collision_mesh_root, make_edge_meshes=not arena_geom_shader)
+            self.arena_mesh_preloader.start()
+
+        moderngl_window.activate_context(None, self.ctx)
+
+        ##########################################
+
+        print("Creating shader programs...")
+
+        self.prog = self.ctx.program(
+            vertex_shader=VERT_SHADER,
+            fragment_shader=FRAG_SHADER,
+        )
+
+        self.prog_arena = self.ctx.program(
+            vertex_shader=ARENA_VERT_SHADER,
+            fragment_shader=ARENA_FRAG_SHADER,
+            geometry_shader=ARENA_GEOM_SHADER
+        )
+
+        self.prog_arena_indexed = self.ctx.program(
+            vertex_shader=ARENA_VERT_SHADER,
+            fragment_shader=ARENA_FRAG_SHADER,
+            geometry_shader=ARENA_INDEXED_GEOM_SHADER
+        )
+
+        self.prog_arena_edge = self.ctx.program(
+            vertex_shader=ARENA_EDGE_VERT_SHADER,
+            fragment_shader=ARENA_EDGE_FRAG_SHADER
+        )
+
+        # All arena programs share the same uniforms
+        self.arena_progs = [self.prog_arena, self.prog_arena_indexed, self.prog_arena_edge]
+
+        self.prog_lines = self.ctx.program(
+            vertex_shader=LINE_VERT_SHADER,
+            fragment_shader=LINE_FRAG_SHADER,
+        )
+
+        self.prog_pad = self.ctx.program(
+            vertex_shader=PAD_VERT_SHADER,
+            fragment_shader=FRAG_SHADER,
+        )
+
+        print("Creating outline renderer...")
+        #self.outline_renderer = OutlineRenderer(self.ctx, (self.width(), self.height())) # TODO: Fix resizing bugs
+        self.outline_renderer = None # Disabled due to weird shader compilation issues
+
+        print("Linking shader varaibles...")
+        self.pr_m_vp = self.prog['m_vp']
+        self.pr_m_model = self.prog['m_model']
+        self.pr_global_color = self.prog['globalColor']
+        self.pr_camera_pos = self.prog['cameraPos']
+
+        self.pra_m_vps = [prog['m_vp'] for prog in self.arena_progs]
+        self.pra_m_models = [prog['m_model'] for prog in self.arena_progs]
+        self.pra_ball_poses = [prog['ballPos'] for prog in self.arena_progs]
+
+        self.prl_m_vp = self.prog_lines['m_vp']
+
+        self.prp_m_vps = self.prog_pad['m_vps']
+        self.prp_tile_rects = self.prog_pad['tileRects']
+        self.prp_camera_pos = self.prog_pad['cameraPos']
+        self.prp_pad_type = self.prog_pad['padType']
+        self.prog_pad['padScale'].value = 2.5
+        self.prog_pad['globalColor'].value = (0, 0, 0, 0)
+
+        ##########################################
+
+        self.ball_ribbon = RibbonEmitter()
+        self.car_ribbons = []
+
+        print("Data path:", DATA_DIR_PATH)
+        print("Loading models and textures...")
+
+        self.vaos = {}
+        self.meshes = {} # Model name -> VAO, see load_mesh()
+        if self.arena_geom_shader:
+            self.load_vao("ArenaMeshCustom.obj", self.prog_arena)
+        else:
+            arena_mesh = mesh_cache.read_vao_attributes(self.load_mesh("ArenaMeshCustom.obj"), ["in_position", "in_normal"])
+            self.vaos["ArenaMeshCustom.obj"], _ = self.make_arena_edge_vao(make_edge_mesh(
+                arena_mesh["in_position"].reshape(-1, 3, 3),
+                arena_mesh["in_normal"].reshape(-1, 3, 3)
+            ))
+
+        self.load_vao("Ball.obj")
+        self.load_vao("Puck.obj")
+
+        # Boost pads share one instance buffer, see update_pad_instances()
+        self.pad_instance_vbo = self.ctx.buffer(reserve=len(default_boost_pad_locations) * PAD_INSTANCE_DTYPE.itemsize)
+        self.pad_instance_count = 0
+        self.pad_instance_locations = None
+        self.pad_instance_states = None
+        self.pad_instance_gamemode = None
+        self.pad_vaos = {}
+        for is_big in (False, True):
+            for is_active in (False, True):
+                model_name = "BoostPad"
+                model_name += "_Big_" if is_big else "_Small_"
+                model_name += "1" if is_active else "0"
+                model_name += ".obj"
+                self.pad_vaos[(is_big, is_active)] = self.load_instanced_vao(
+                    model_name, self.prog_pad,
+                    (self.pad_instance_vbo, "3f 2f 1f/i", "in_pad_pos", "in_pad_flags", "in_tile")
+                )
+
+        self.ts_octane = [
+            self.load_texture_2d(DATA_DIR_PATH + "T_Octane_B.png"),
+            self.load_texture_2d(DATA_DIR_PATH + "T_Octane_O.png")
+        ]
+        self.t_ball = self.load_texture_2d(DATA_DIR_PATH + "T_Ball.png")
+        self.t_puck = self.load_texture_2d(DATA_DIR_PATH + "T_Puck.png")
+        self.t_boostpad = self.load_texture_2d(DATA_DIR_PATH + "T_BoostPad.png")
+        self.t_boost_glow = self.load_texture_2d(DATA_DIR_PATH + "T_Boost_Glow.png")
+        self.t_black = self.load_texture_2d(DATA_DIR_PATH + "T_Black.png")
+        self.t_none = self.load_texture_2d(DATA_DIR_PATH + "T_None.png")
+
+        self.car_renderer = CarRenderer(self.ctx, self.load_mesh("Octane.obj"), self.ts_octane)
+
+        # Other envs' cars and balls in ghost mode, see render_ghosts()
+        self.ghost_car_renderer = CarRenderer(self.ctx, self.load_mesh("Octane.obj"), self.ts_octane, initial_capacity=64)
+        self.ghost_ball_renderers = {
+            model_name: CarRenderer(self.ctx, self.load_mesh(model_name), [texture], initial_capacity=16)
+            for model_name, texture in (("Ball.obj", self.t_ball), ("Puck.obj", self.t_puck))
+        }
+
+        ############################################
+
+        # Make ribbon mesh
+        self.ribbon_max_verts = 1000
+        self.ribbon_vbo = self.ctx.buffer(reserve=self.ribbon_max_verts * 3 * 4)
+        self.ribbon_vao = self.ctx.simple_vertex_array(self.prog, self.ribbon_vbo, "in_position")
+        self.vaos['ribbon'] = self.ribbon_vao
+
+        # Make debug lines mesh
+        # Vertices are (position, RGBA), only re-uploaded when the state's lines change
+        self.lines_max_verts = RenderState.MAX_LINES * 2
+        self.lines_verts = np.zeros((self.lines_max_verts, 7), dtype=np.float32)
+        self.lines_vbo = self.ctx.buffer(reserve=self.lines_verts.nbytes)
+        self.lines_vao = self.ctx.vertex_array(self.prog_lines, [(self.lines_vbo, "3f 4f", "in_position", "in_color")])
+        self.lines_vert_count = 0
+        self.lines_render_state = None
+
+        ############################################
+
+        self.profiler = FrameProfiler(self.ctx)
+
+        ############################################
+
+        print("Done.")
+
+    def load_texture_2d(self, path: str) -> moderngl.Texture:
+        return resources.textures.load(TextureDescription(path=path))
+
+    def load_mesh(self, model_name):
+        """Load a model once, every renderer drawing it shares its buffers"""
+        mesh = self.meshes.get(model_name)
+        if mesh is None:
+            mesh = self.meshes[model_name] = mesh_cache.load_wavefront_vao(self.ctx, DATA_DIR_PATH + model_name)
+        return mesh
+
+    def load_vao(self, model_name, program = None):
+        mesh = self.load_mesh(model_name)
+        self.vaos[model_name] = mesh.instance(self.prog if (program is None) else program)
+        if not (self.outline_renderer is None):
+            self.outline_renderer.load_vao(model_name, mesh)
+
+    def load_instanced_vao(self, model_name, program, instance_content):
+        mesh_buffer = self.load_mesh(model_name).get_buffer_by_name("in_position")
+        return self.ctx.vertex_array(
+            program,
+            [
+                mesh_buffer.content(["in_position", "in_normal", "in_texcoord_0"]),
+                instance_content
+            ]
+        )
+
+    @staticmethod
+    def make_pad_instances(state: GameState, tile: int = 0) -> np.ndarray:
+        pad_count = len(state.boost_pad_states)
+        instances = np.zeros(pad_count, dtype=PAD_INSTANCE_DTYPE)
+        if pad_count > 0:
+            instances["pos"][:, :2] = np.array(state.boost_pad_locations, dtype=np.float32)[:, :2]
+            instances["flags"][:, 0] = [state.is_boost_big(i) for i in range(pad_count)]
+            instances["flags"][:, 1] = state.boost_pad_states
+            instances["tile"] = tile
+        return instances
+
+    def write_pad_instances(self, instances: np.ndarray):
+        if instances.nbytes > self.pad_instance_vbo.size:
+            self.pad_instance_vbo.orphan(instances.nbytes)
+        if len(instances) > 0:
+            self.pad_instance_vbo.write(instances.tobytes())
+        self.pad_instance_count = len(instances)
+
+    def update_pad_instances(self, state: GameState):
+        # Locations are replaced (never modified) when they change, states are a new list every packet
+        if (state.boost_pad_locations is self.pad_instance_locations
+                and state.boost_pad_states == self.pad_instance_states
+                and state.gamemode == self.pad_instance_gamemode):
+            return
+
+        self.pad_instance_locations = state.boost_pad_locations
+        self.pad_instance_states = state.boost_pad_states
+        self.pad_instance_gamemode = state.gamemode
+
+        self.write_pad_instances(self.make_pad_instances(state))
+
+    def update_lines(self, render_state: RenderState):
+        self.lines_render_state = render_state
+
+        line_count = len(render_state.lines)
+        verts = self.lines_verts[:line_count * 2].reshape(line_count, 2, 7)
+        verts[:, 0, :3] = render_state.lines[:, :3]
+        verts[:, 1, :3] = render_state.lines[:, 3:]
+        if render_state.line_colors is None:
+            verts[:, :, 3:] = 1
+        else:
+            verts[:, :, 3:] = render_state.line_colors[:, None]
+
+        # Only the used range is uploaded
+        self.lines_vbo.write(self.lines_verts[:line_count * 2])
+        self.lines_vert_count = line_count * 2
+
+    def make_arena_edge_vao(self, edge_mesh: np.ndarray):
+        vbo = self.ctx.buffer(edge_mesh)
+        vao = self.ctx.vertex_array(
+            self.prog_arena_edge,
+            [(vbo, "3f 3f 3f", "in_position", "in_normal", "in_edge_coords")]
+        )
+        return vao, vbo
+
+    def upload_collision_arena_mesh(self, gamemode: str, mesh):
+        model_name = f"ArenaCollision_{gamemode}"
+        if model_name in self.vaos:
+            return model_name
+
+        if self.arena_geom_shader:
+            positions, indices = mesh
+            vbo = self.ctx.buffer(positions)
+            ibo = self.ctx.buffer(indices)
+            vao = self.ctx.vertex_array(
+                self.prog_arena_indexed,
+                [(vbo, "3f", "in_position")],
+                ibo, 4
+            )
+            self.arena_mesh_vertex_counts[model_name] = len(indices)
+            self.arena_mesh_vbos[model_name] = (vbo, ibo)
+        else:
+            vao, vbo = self.make_arena_edge_vao(mesh)
+            self.arena_mesh_vertex_counts[model_name] = len(mesh)
+            self.arena_mesh_vbos[model_name] = vbo
+
+        self.vaos[model_name] = vao
+
+        return model_name
+
+    def get_arena_mesh_for_state(self, state: GameState):
+        gamemode = (state.gamemode or "soccar").lower()
+        if not (self.arena_mesh_preloader is None):
+            # Cached by the mesh used, so gamemodes sharing an arena share one upload
+            gamemode = self.arena_mesh_preloader.resolve(gamemode)
+
+        if gamemode not in self.arena_mesh_cache:
+            model_name = None
+            if not (self.arena_mesh_preloader is None):
+                is_done, mesh, error = self.arena_mesh_preloader.get(gamemode)
+                if not is_done and self.wait_for_arena_meshes:
+                    is_done, mesh, error = self.arena_mesh_preloader.wait(gamemode)
+                if not is_done:
+                    # Still loading, check again next frame
+                    return "ArenaMeshCustom.obj", None
+
+                if mesh is None:
+                    print(f"Failed to load collision meshes for {gamemode}: {error}")
+                else:
+                    model_name = self.upload_collision_arena_mesh(gamemode, mesh)
+
+            if model_name is None:
+                model_name = "ArenaMeshCustom.obj"
+            self.arena_mesh_cache[gamemode] = model_name
+
+        model_name = self.arena_mesh_cache[gamemode]
+        return model_name, self.arena_mesh_vertex_counts.get(model_name)
+
+    def render_model(self,
+                     pos, forward, up,
+                     model_name, texture, scale = 1.0, global_color = None,
+                     mode = moderngl.TRIANGLES, outline_color: Vector3 = None, vert_amount = None):
+
+        if pos is None:
+            model_mat = Matrix44.identity()
+        else:
+            pos = Vector3(pos)
+            forward = Vector3(forward)
+            up = Vector3(up)
+            right = Vector3(pyrr.vector3.cross(forward, up))
+
+            forward *= scale
+            right *= scale
+            up *= scale
+
+            model_mat = Matrix44([
+                forward[0], forward[1], forward[2], 0,
+                -right[0], -right[1], -right[2], 0,
+                up[0], up[1], up[2], 0,
+                pos[0], pos[1], pos[2], 1
+            ])
+
+        self.pr_m_model.write(model_mat.astype('f4'))
+        for pra_m_model in self.pra_m_models:
+            pra_m_model.write(model_mat.astype('f4'))
+
+        if global_color is None:
+            global_color = Vector4((0, 0, 0, 0))
+        self.pr_global_color.write(global_color.astype('f4'))
+
+        if texture is not None:
+            texture.use()
+        else:
+            self.t_none.use()
+
+        self.framebuffer.use()
+        self.vaos[model_name].render(mode, vertices=(-1 if (vert_amount is None) else vert_amount))
+
+        if outline_color is not None:
+            self.outline_renderer.use_framebuf()
+            self.outline_renderer.pr_m_model.write(model_mat.astype('f4'))
+            self.outline_renderer.pr_color.write(Vector4((outline_color.x, outline_color.y, outline_color.z, 1)).astype('f4'))
+            self.outline_renderer.vaos[model_name].render(mode)
+
+    def render_ribbon(self, ribbon: RibbonEmitter, camera_pos, lifetime, width, start_taper_time, color):
+        if ribbon.count == 0:
+            return
+
+        order = ribbon.get_order()
+
+        first_idx = order[0]
+        cam_to_ribbon_dir = safe_normalize(-(Vector3(ribbon.pos[first_idx]) - camera_pos))
+        ribbon_away_dir = safe_normalize(Vector3(ribbon.vel[first_idx]))
+        ribbon_sideways_dir = ribbon_away_dir.cross(cam_to_ribbon_dir)
+
+        order = order[ribbon.connected[order]]
+        if len(order) == 0:
+            return
+
+        time_active = ribbon.time_active[order]
+        width_scale = np.where(
+            time_active < start_taper_time,
+            time_active / start_taper_time,
+            1 - (time_active / lifetime)
+        )
+
+        # Two vertices per point, on either side of the ribbon
+        offsets = np.outer(width * width_scale, np.asarray(ribbon_sideways_dir))
+        vertices = np.empty((len(order), 2, 3), dtype=np.float32)
+        vertices[:, 0] = ribbon.pos[order] - offsets
+        vertices[:, 1] = ribbon.pos[order] + offsets
+        vertices = vertices.reshape(-1, 3)[:self.ribbon_max_verts]
+
+        # Only the used range is uploaded and drawn
+        self.ribbon_vbo.write(vertices.tobytes())
+
+        # glDisable(GL_CULL_FACE)
+        self.render_model(
+            None, None, None,
+            "ribbon", self.t_none, scale=20,
+            global_color=color,
+            mode=moderngl.TRIANGLE_STRIP,
+            vert_amount=len(vertices)
+        )
+        # glEnable(GL_CULL_FACE)
+
+    def write_camera(self, m_vp: np.ndarray, camera_pos: Vector3):
+        """Write the camera of the non-instanced programs, the instanced ones use write_tile_cameras()"""
+        self.pr_camera_pos.write(camera_pos.astype('f4'))
+        self.pr_m_vp.write(m_vp)
+        for pra_m_vp in self.pra_m_vps:
+            pra_m_vp.write(m_vp)
+        self.prl_m_vp.write(m_vp)
+        if not (self.outline_renderer is None):
+            self.outline_renderer.pr_m_vp.write(m_vp)
+
+    def write_tile_cameras(self, camera_pos: Vector3):
+        self.prp_m_vps.write(self.tile_m_vps)
+        self.prp_tile_rects.write(self.tile_rects)
+        self.prp_camera_pos.write(camera_pos.astype('f4'))
+        self.car_renderer.write_camera(self.tile_m_vps, self.tile_rects, camera_pos)
+        self.ghost_car_renderer.write_camera(self.tile_m_vps, self.tile_rects, camera_pos)
+        for renderer in self.ghost_ball_renderers.values():
+            renderer.write_camera(self.tile_m_vps, self.tile_rects, camera_pos)
+
+    def calc_camera_state(self, state, frame: PhysFrame, delta_time):
+        pos = Vector3(BIRD_CAMERA_POS)
+        ball_pos = Vector3(frame.pos[0])
+
+        cam_dir = safe_normalize(ball_pos - pos)
+
+        is_spectating_car = self.spectate_idx > -1 and len(state.car_states) > self.spectate_idx
+        if is_spectating_car:
+            car_row = self.spectate_idx + 1
+            car_pos = Vector3(frame.pos[car_row])
+            car_vel = Vector3(frame.vel[car_row])
+            car_forward = Vector3(frame.forward[car_row])
+
+            # Calculate ball cam
+            if True:
+                height = self.config.camera_height.val
+                dist = self.config.camera_distance.val
+
+                ball_cam_offset_dir = safe_normalize(safe_normalize(ball_pos - car_pos) * Vector3((1, 1, 0))).normalized
+
+                # As we tilt up, move the camera down
+                lean_scale = safe_normalize(ball_pos - car_pos).z
+                height_clamp = abs(ball_pos.z - car_pos.z) / self.config.camera_lean_min_height_clamp.val
+                if lean_scale > 0:
+                    height *= 1 - min(lean_scale * self.config.camera_lean_height_scale.val, height_clamp)
+
+                    # As we tilt up, move the camera closer
+                    dist *= 1 - lean_scale * self.config.camera_lean_dist_scale.val
+
+                ball_cam_offset = -ball_cam_offset_dir * dist
+                ball_cam_offset.z += height
+
+                # Make sure we are actually of the correct distance
+                ball_cam_offset = safe_normalize(ball_cam_offset) * dist
+                ball_cam_pos = car_pos + ball_cam_offset
+                ball_cam_dir = safe_normalize(ball_pos - ball_cam_pos)
+
+            # Calculate car cam dir
+            if True:
+                if car_vel.length > 0:
+                    car_cam_dir = safe_normalize(car_vel * Vector3((1, 1, 0)))
+                else:
+                    car_cam_dir = (car_forward * Vector3((1, 1, 0)))
+                    if car_cam_dir.length > 0:
+                        car_cam_dir = safe_normalize(car_cam_dir)
+                    else:
+                        car_cam_dir = Vector3((1, 1, 0))
+                car_cam_offset = -car_cam_dir * self.config.camera_distance.val
+                car_cam_offset.z = self.config.camera_height.val
+                car_cam_pos = car_pos + car_cam_offset
+
+            # Determine if dribbling
+            car_ball_delta = ball_pos - car_pos
+            dribbling = False
+            if car_vel.length > 500:
+                if 90 < car_ball_delta.z < 200:
+                    if (car_ball_delta * Vector3((1, 1, 0))).length < 135:
+                        if ball_pos.z < 300:
+                            dribbling = True
+
+            car_cam_start_delay = 0.25
+            car_cam_max_time = 0.65
+            car_cam_inc_speed = 0.8
+            car_cam_dec_speed = 0.5
+            if car_ball_delta.length > 1000:
+                car_cam_dec_speed *= 2 # Speed up when ball moved away quickly
+
+            if dribbling:
+                self.car_cam_time += car_cam_inc_speed * delta_time
+            else:
+                self.car_cam_time = min(self.car_cam_time, car_cam_max_time)
+                self.car_cam_time = max(0, self.car_cam_time - car_cam_dec_speed * delta_time)
+
+            # TODO: Auto car-cam is annoying, activates at bad times
+            car_cam_ratio = np.clip((self.car_cam_time - car_cam_start_delay) / (car_cam_max_time - car_cam_start_delay), 0, 1)
+
+            pos = ball_cam_pos*(1-car_cam_ratio) + car_cam_pos*car_cam_ratio
+            cam_dir = safe_normalize(ball_cam_dir*(1-car_cam_ratio) + car_cam_dir*car_cam_ratio)
+        else:
+            self.car_cam_time = 0
+
+        return pos, pos + cam_dir, (self.config.camera_fov.val if is_spectating_car else self.config.camera_bird_fov.val)
+
+    def render_pads(self):
+        # One draw per pad mesh, covering every pad that uses it
+        self.t_boostpad.use()
+        self.framebuffer.use()
+        for pad_type, pad_vao in self.pad_vaos.items():
+            self.prp_pad_type.value = pad_type
+            pad_vao.render(instances=self.pad_instance_count)
+
+    def get_ball_model(self, state: GameState):
+        """(model name, texture) of the state's ball"""
+        # Use puck model for snowday mode, ball for everything else
+        if state.gamemode == "snowday":
+            return 'Puck.obj', self.t_puck
+        else:
+            return 'Ball.obj', self.t_ball
+
+    def render_ball(self, state: GameState, frame: PhysFrame):
+        ball_model, ball_texture = self.get_ball_model(state)
+
+        self.render_model(
+            Vector3(frame.pos[0]),
+            Vector3(frame.forward[0]), Vector3(frame.up[0]), ball_model, ball_texture,
+
+            #outline_color = Vector4((1, 1, 1, 1))
+        )
+
+    def render_arena(self, state: GameState, frame: PhysFrame):
+        arena_model_name, arena_vert_count = self.get_arena_mesh_for_state(state)
+        for pra_ball_pos in self.pra_ball_poses:
+            pra_ball_pos.write(frame.pos[0].astype('f4'))
+        # self.ctx.disable(moderngl.CULL_FACE)
+        self.render_model(
+            None, None, None,
+            model_name=arena_model_name, texture=self.t_none, scale=1, global_color=Vector4((1,1,1,1)),
+            vert_amount=arena_vert_count
+        )
+        # self.ctx.enable(moderngl.CULL_FACE)
+
+    def render_ghosts(self, ghosts: list):
+        """
+        Draw the cars and balls of other envs' states translucent, as a list of (state, interp_ratio, (r, g, b, a) tint).
+        All ghost cars are one instanced draw and all ghost balls another, no matter how many envs there are.
+        They're drawn after the arena and don't write depth, so the arena and other ghosts show through them.
+        """
+        car_frames = []
+        car_teams = []
+        car_tints = []
+        ball_frames = {model_name: [] for model_name in self.ghost_ball_renderers} # Model name -> [(pos, forward, up, tint)]
+        for state, interp_ratio, tint in ghosts:
+            frame = state.phys_arrays.interpolate(interp_ratio)
+
+            car_visible = np.array([not car_state.is_demoed for car_state in state.car_states], dtype=bool)
+            car_frames.append((frame.pos[1:][car_visible], frame.forward[1:][car_visible], frame.up[1:][car_visible]))
+            car_teams.append(np.array([car_state.team_num for car_state in state.car_states], dtype=np.float32)[car_visible])
+            car_tints.append(np.tile(np.array(tint, dtype=np.float32), (np.count_nonzero(car_visible), 1)))
+
+            ball_model, _ = self.get_ball_model(state)
+            ball_frames[ball_model].append((frame.pos[0], frame.forward[0], frame.up[0], tint))
+
+        if len(ghosts) == 0:
+            return
+
+        self.framebuffer.depth_mask = False
+        self.framebuffer.use()
+
+        self.ghost_car_renderer.update(
+            np.concatenate([pos for pos, _, _ in car_frames]),
+            np.concatenate([forward for _, forward, _ in car_frames]),
+            np.concatenate([up for _, _, up in car_frames]),
+            np.concatenate(car_teams),
+            tints=np.concatenate(car_tints)
+        )
+        self.ghost_car_renderer.render()
+
+        for model_name, renderer in self.ghost_ball_renderers.items():
+            balls = ball_frames[model_name]
+            if len(balls) == 0:
+                continue
+            pos, forward, up, tints = (np.array(column, dtype=np.float32) for column in zip(*balls))
+            renderer.update(pos, forward, up, 0, tints=tints)
+            renderer.render()
+
+        self.framebuffer.depth_mask = True
+
+    def begin_frame(self, width: int, height: int):
+        self.framebuffer.viewport = (0, 0, width, height)
+        self.framebuffer.use()
+        self.ctx.enable(moderngl.DEPTH_TEST)
+        self.ctx.enable(moderngl.BLEND)
+
+        self.ctx.cull_face = "back"
+        self.ctx.front_face = "cw"
+        self.ctx.enable(moderngl.CULL_FACE)
+
+        self.ctx.blend_func = moderngl.SRC_ALPHA, moderngl.ONE_MINUS_SRC_ALPHA # Normal blending
+
+    @staticmethod
+    def spin_ball(frame: PhysFrame, state: GameState, spin_rot: np.ndarray, delta_time: float) -> np.ndarray:
+        """
+        If the ball has no rotation, spin it by its angular velocity in the frame, returns the (1, 4) spin rotation to keep.
+        The spin is kept by the renderer, states are only read (they can be shared, see StateManager.acquire()).
+        """
+        if state.ball_state.has_rot:
+            return frame.rot[:1].copy()
+
+        spin_rot = quat_math.integrate_ang_vel(spin_rot, state.phys_arrays.ang_vel[:1], delta_time)
+        frame.set_rot(slice(0, 1), spin_rot)
+        return spin_rot
+
+    def render(self, state: GameState, delta_time: float, interp_ratio: float, width: int, height: int,
+               ghosts: list = None):
+        """
+        Draw a state to self.framebuffer, interp_ratio is from the state's previous physics (0) to its newest (1).
+        ghosts is an optional list of (state, interp_ratio, tint) of other envs, see render_ghosts().
+        """
+        while len(self.car_ribbons) != len(state.car_states):
+            if len(self.car_ribbons) < len(state.car_states):
+                self.car_ribbons.append(RibbonEmitter())
+            else:
+                self.car_ribbons.pop()
+
+        # Interpolate the ball and every car at once
+        frame = state.phys_arrays.interpolate(interp_ratio)
+        self.ball_spin_rot = self.spin_ball(frame, state, self.ball_spin_rot, delta_time)
+
+        if not (self.outline_renderer is None):
+            self.outline_renderer.clear()
+
+        self.begin_frame(width, height)
+        self.ctx.clear(0, 0, 0)
+
+        self.profiler.phase("camera")
+        camera_pos, camera_target_pos, camera_fov = self.calc_camera_state(state, frame, delta_time)
+        proj = Matrix44.perspective_projection(camera_fov, -width/height, 0.1, 50 * 1000.0)
+        lookat = Matrix44.look_at(
+            camera_pos,
+            camera_target_pos,
+            (0.0, 0.0, 1.0),
+        )
+
+        m_vp = (proj * lookat).astype('f4')
+        self.write_camera(m_vp, camera_pos)
+        self.tile_m_vps[0] = m_vp
+        self.tile_rects[0] = (1, 1, 0, 0)
+        self.write_tile_cameras(camera_pos)
+
+        self.profiler.phase("pads")
+        if not (state.boost_pad_states is None) and state.gamemode != "heatseeker": # Render boost pads
+            self.update_pad_instances(state)
+            self.render_pads()
+
+        self.profiler.phase("ball")
+        if True: # Render ball/puck
+            ball_pos = Vector3(frame.pos[0])
+            self.render_ball(state, frame)
+
+            if state.gamemode == "heatseeker": # Update and render ball ribbon
+                ball_speed = Vector3(frame.vel[0]).length
+                speed_frac = (max(0, min(1, ball_speed / 2800)) ** 2)
+                ribbon_alpha = 0.75
+                ribbon_lifetime = 0.8
+
+                self.ball_ribbon.update(
+                    ball_speed > 600,
+                    0,
+                    ball_pos,
+                    Vector3((100,0,0)),
+                    ribbon_lifetime,
+                    delta_time
+                )
+
+                if frame.teleporting[0]:
+                    self.ball_ribbon.clear()
+
+                self.render_ribbon(
+                    self.ball_ribbon,
+                    camera_pos,
+                    ribbon_lifetime,
+                    width=50,
+                    start_taper_time=ribbon_lifetime / 10,
+                    color=Vector4((1, 1, 1, ribbon_alpha))
+                )
+
+        self.profiler.phase("cars")
+        if True: # Render cars
+            # All visible cars in one instanced draw
+            car_visible = np.array([not car_state.is_demoed for car_state in state.car_states], dtype=bool)
+            car_teams = np.array([car_state.team_num for car_state in state.car_states], dtype=np.float32)
+            self.car_renderer.update(
+                frame.pos[1:][car_visible],
+                frame.forward[1:][car_visible],
+                frame.up[1:][car_visible],
+                car_teams[car_visible]
+            )
+            self.framebuffer.use()
+            self.car_renderer.render()
+
+            self.profiler.phase("ribbons")
+            for i in range(len(state.car_states)):
+                car_state = state.car_states[i]
+                if car_state.is_demoed:
+                    continue
+
+                car_ribbon = self.car_ribbons[i]
+
+                car_pos = Vector3(frame.pos[i + 1])
+                car_forward = Vector3(frame.forward[i + 1])
+                car_up = Vector3(frame.up[i + 1])
+
+                if True: # Update and render car ribbon
+                    RIBBON_LIFETIME = 0.3
+                    ribbon_emit_pos = car_pos - (car_forward * 40) + (car_up * 10)
+                    ribbon_vel = car_forward * -100
+                    car_ribbon.update(
+                        car_state.is_boosting,
+                        0,
+                        ribbon_emit_pos,
+                        ribbon_vel,
+                        RIBBON_LIFETIME,
+                        delta_time
+                    )
+
+                    if frame.teleporting[i + 1]:
+                        car_ribbon.clear()
+
+                    self.render_ribbon(
+                        car_ribbon,
+                        camera_pos,
+                        RIBBON_LIFETIME,
+                        20,
+                        RIBBON_LIFETIME / 10,
+                        Vector4((1, 0.9, 0.4, 1))
+                    )
+
+        ###########################################
+
+        self.profiler.phase("arena")
+        self.render_arena(state, frame)
+
+        if not (self.outline_renderer is None):
+            self.outline_renderer.render_quad()
+
+        if not (ghosts is None):
+            self.profiler.phase("ghosts")
+            self.render_ghosts(ghosts)
+
+        ###########################################
+
+        self.profiler.phase("lines")
+        if len(state.render_state.lines) > 0:
+            if not (state.render_state is self.lines_render_state):
+                self.update_lines(state.render_state)
+
+            self.ctx.disable(moderngl.DEPTH_TEST)
+            self.framebuffer.use()
+            self.lines_vao.render(moderngl.LINES, vertices=self.lines_vert_count)
+            self.ctx.enable(moderngl.DEPTH_TEST)
+
+        ###########################################
+
+        ball_spinning = not state.ball_state.has_rot and np.any(state.phys_arrays.ang_vel[0] != 0)
+        ribbons_active = any((ribbon.count > 0) for ribbon in self.car_ribbons)
+        if state.gamemode == "heatseeker":
+            ribbons_active = ribbons_active or self.ball_ribbon.count > 0
+        self.is_animating = (interp_ratio < 1) or ball_spinning or ribbons_active or (self.car_cam_time > 0)
+
+    def render_grid(self, tiles: list, delta_time: float, width: int, height: int, cols: int, rows: int):
+        """
+        Draw several states at once into a grid of cols by rows tiles of self.framebuffer, row by row from the top left.
+        tiles is a list of (env id, state, interp_ratio), at most MAX_GRID_TILES.
+
+        Every tile has its own bird camera. The ball and arena are drawn tile by tile,
+        but the cars and boost pads of every tile go into one instance buffer upload and draw (per pad mesh),
+        with each instance clipped to its tile in the vertex shader.
+        Boost trails and debug lines aren't drawn in grid mode.
+        """
+        tiles = tiles[:min(cols * rows, MAX_GRID_TILES)]
+
+        # Ball spins follow their env as the grid pages or reorders, and are forgotten once it's not shown
+        tile_env_ids = [env_id for env_id, _, _ in tiles]
+        self.grid_ball_spin_rots = {
+            env_id: self.grid_ball_spin_rots.get(env_id, quat_math.identity_quats(1)) for env_id in tile_env_ids
+        }
+
+        self.begin_frame(width, height)
+        self.ctx.clear(0, 0, 0)
+
+        # Lines between the tiles
+        tile_width, tile_height = width / cols, height / rows
+        for col in range(1, cols):
+            self.ctx.clear(*GRID_BACKGROUND_COLOR, viewport=(round(col * tile_width) - GRID_TILE_GAP, 0, GRID_TILE_GAP * 2, height))
+        for row in range(1, rows):
+            self.ctx.clear(*GRID_BACKGROUND_COLOR, viewport=(0, round(row * tile_height) - GRID_TILE_GAP, width, GRID_TILE_GAP * 2))
+
+        self.profiler.phase("camera")
+        frames = []
+        viewports = []
+        cameras = []
+        for i, (env_id, state, interp_ratio) in enumerate(tiles):
+            frame = state.phys_arrays.interpolate(interp_ratio)
+            self.grid_ball_spin_rots[env_id] = self.spin_ball(frame, state, self.grid_ball_spin_rots[env_id], delta_time)
+            frames.append(frame)
+
+            col, row = i % cols, i // cols
+            x0, x1 = round(col * tile_width), round((col + 1) * tile_width)
+            y0, y1 = round(height - (row + 1) * tile_height), round(height - row * tile_height)
+            viewport = (
+                x0 + GRID_TILE_GAP, y0 + GRID_TILE_GAP,
+                max(x1 - x0 - GRID_TILE_GAP * 2, 1), max(y1 - y0 - GRID_TILE_GAP * 2, 1)
+            )
+            viewports.append(viewport)
+
+            camera_pos = Vector3(BIRD_CAMERA_POS)
+            proj = Matrix44.perspective_projection(self.config.camera_bird_fov.val, -viewport[2]/viewport[3], 0.1, 50 * 1000.0)
+            lookat = Matrix44.look_at(
+                camera_pos,
+                camera_pos + safe_normalize(Vector3(frame.pos[0]) - camera_pos),
+                (0.0, 0.0, 1.0),
+            )
+            m_vp = (proj * lookat).astype('f4')
+            cameras.append(m_vp)
+
+            # Maps the tile's normalized device coords into the tile's part of the framebuffer
+            self.tile_m_vps[i] = m_vp
+            self.tile_rects[i] = (
+                viewport[2] / width, viewport[3] / height,
+                (viewport[0] * 2 + viewport[2]) / width - 1, (viewport[1] * 2 + viewport[3]) / height - 1
+            )
+
+        # Every bird camera is at the same place
+        self.write_tile_cameras(Vector3(BIRD_CAMERA_POS))
+
+        # Keep the instanced cars and pads inside their tiles, see TILE_VERT_FUNCS
+        for i in range(4):
+            self.ctx.enable_direct(GL_CLIP_DISTANCE0 + i)
+
+        self.profiler.phase("pads")
+        pad_instances = []
+        for i, (_, state, _) in enumerate(tiles):
+            if state.boost_pad_states is None or state.gamemode == "heatseeker":
+                continue
+
+            # Same caching as update_pad_instances(), per tile
+            cached = self.grid_pad_instances[i]
+            if (cached is None or not (state.boost_pad_locations is cached[0])
+                    or state.boost_pad_states != cached[1] or state.gamemode != cached[2]):
+                cached = (state.boost_pad_locations, state.boost_pad_states, state.gamemode, self.make_pad_instances(state, i))
+                self.grid_pad_instances[i] = cached
+            pad_instances.append(cached[3])
+
+        if len(pad_instances) > 0:
+            self.write_pad_instances(np.concatenate(pad_instances))
+            self.pad_instance_locations = None # The buffer no longer holds what update_pad_instances() uploaded
+            self.render_pads()
+
+        self.profiler.phase("cars")
+        car_frames = []
+        car_teams = []
+        car_tiles = []
+        for i, ((_, state, _), frame) in enumerate(zip(tiles, frames)):
+            car_visible = np.array([not car_state.is_demoed for car_state in state.car_states], dtype=bool)
+            car_frames.append((frame.pos[1:][car_visible], frame.forward[1:][car_visible], frame.up[1:][car_visible]))
+            car_teams.append(np.array([car_state.team_num for car_state in state.car_states], dtype=np.float32)[car_visible])
+            car_tiles.append(np.full(np.count_nonzero(car_visible), i, dtype=np.float32))
+
+        if len(car_frames) > 0:
+            self.car_renderer.update(
+                np.concatenate([pos for pos, _, _ in car_frames]),
+                np.concatenate([forward for _, forward, _ in car_frames]),
+                np.concatenate([up for _, _, up in car_frames]),
+                np.concatenate(car_teams),
+                np.concatenate(car_tiles)
+            )
+            self.framebuffer.use()
+            self.car_renderer.render()
+
+        for i in range(4):
+            self.ctx.disable_direct(GL_CLIP_DISTANCE0 + i)
+
+        self.profiler.phase("ball")
+        for i, ((_, state, _), frame) in enumerate(zip(tiles, frames)):
+            self.framebuffer.viewport = viewports[i]
+            self.write_camera(cameras[i], Vector3(BIRD_CAMERA_POS))
+            self.render_ball(state, frame)
+
+        self.profiler.phase("arena")
+        for i, ((_, state, _), frame) in enumerate(zip(tiles, frames)):
+            self.framebuffer.viewport = viewports[i]
+            self.write_camera(cameras[i], Vector3(BIRD_CAMERA_POS))
+            self.render_arena(state, frame)
+
+        self.framebuffer.viewport = (0, 0, width, height)
+        self.framebuffer.use()
+
+        balls_spinning = any(
+            not state.ball_state.has_rot and np.any(state.phys_arrays.ang_vel[0] != 0) for _, state, _ in tiles
+        )
+        self.is_animating = any(interp_ratio < 1 for _, _, interp_ratio in tiles) or balls_spinning
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import state_manager
+import packet_reader
+from state_recording import RecordingReader
+
+class ReplayPlayer:
+    """
+    Plays a state recording into global_state_manager, in place of the socket listener.
+
+    Playback time advances at the playback speed, and each tick only the newest packet at or before it is applied,
+    so fast playback skips states instead of falling behind.
+    The packet before it is applied first, so the renderer interpolates between the two as it would live.
+    Seeking (forwards or backwards) is a binary search of the keyframe index, then of the chunk's packet times.
+
+    NOTE: Cumulative rewards are accumulated from the packets that are applied,
+    so they aren't accurate after skipping or seeking
+    """
+
+    SPEEDS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+    # How often playback time is advanced
+    TICK_INTERVAL = 1 / 250
+
+    # How often a recording that's still being written is checked for new chunks, once playback reaches its end
+    LIVE_REFRESH_INTERVAL = 0.5
+
+    def __init__(self, path: str):
+        self.reader = RecordingReader(path)
+        self.state = state_manager.GameState()
+
+        self.should_run = True
+        self.lock = threading.Lock()
+
+        self.play_time = 0
+        self.speed = 1
+        self.paused = False
+
+        # (chunk index, packet index) of the last packet applied
+        self.applied_packet = None
+        self.last_refresh_time = 0
+
+    def get_duration(self) -> float:
+        return self.reader.get_duration()
+
+    def toggle_pause(self):
+        with self.lock:
+            self.paused = not self.paused
+
+    def seek(self, play_time: float):
+        with self.lock:
+            self.play_time = min(max(play_time, 0), self.get_duration())
+
+    def skip(self, delta_time: float):
+        self.seek(self.play_time + delta_time)
+
+    def change_speed(self, steps: int):
+        """Move up or down the list of speeds"""
+        with self.lock:
+            speed_idx = min(range(len(self.SPEEDS)), key=lambda i: abs(self.SPEEDS[i] - self.speed))
+            speed_idx = min(max(speed_idx + steps, 0), len(self.SPEEDS) - 1)
+            self.speed = self.SPEEDS[speed_idx]
+
+    def get_status_text(self) -> str:
+        text = "Replay: {} / {} ({}x{})".format(
+            self.format_time(self.play_time), self.format_time(self.get_duration()), self.speed,
+            ", paused" if self.paused else ""
+        )
+        if not self.reader.is_complete:
+            text += " (still recording)"
+        return text
+
+    @staticmethod
+    def format_time(seconds: float) -> str:
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(int(minutes), 60)
+        if hours > 0:
+            return "{}:{:02d}:{:05.2f}".format(hours, minutes, seconds)
+        return "{}:{:05.2f}".format(minutes, seconds)
+
+    def run(self):
+        prev_time = time.perf_counter()
+        while self.should_run:
+            time.sleep(self.TICK_INTERVAL)
+
+            cur_time = time.perf_counter()
+            with self.lock:
+                if not self.paused:
+                    self.play_time += (cur_time - prev_time) * self.speed
+
+                duration = self.get_duration()
+                if self.play_time >= duration and not self.reader.is_complete:
+                    if cur_time - self.last_refresh_time > self.LIVE_REFRESH_INTERVAL:
+                        self.last_refresh_time = cur_time
+                        self.reader.refresh()
+                        duration = self.get_duration()
+
+                self.play_time = min(max(self.play_time, 0), duration)
+                if len(self.reader.index) > 0:
+                    self.update(self.reader.find_packet(self.play_time))
+            prev_time = cur_time
+
+    def update(self, target_packet):
+        if target_packet == self.applied_packet:
+            return
+
+        # Unless we're stepping forward by one packet, apply the one before first, so interpolation starts from it
+        prev_packet = self.reader.get_previous_packet(*target_packet)
+        prev_time = None
+        if not (prev_packet is None):
+            prev_time, prev_data = self.reader.get_packet(*prev_packet)
+            if prev_packet != self.applied_packet:
+                packet_reader.apply_packet(self.state, prev_data)
+
+        target_time, target_data = self.reader.get_packet(*target_packet)
+        if not packet_reader.apply_packet(self.state, target_data):
+            return
+        self.applied_packet = target_packet
+
+        self.state.recv_time = time.time()
+        if prev_time is None:
+            self.state.recv_interval = 0
+        else:
+            self.state.recv_interval = (target_time - prev_time) / self.speed
+
+        state_manager.global_state_manager.publish(self.state)
+
+    def stop_async(self):
+        self.should_run = False
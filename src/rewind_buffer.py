@@ -0,0 +1,182 @@
+import bisect
+import threading
+import time
+
+import packet_reader
+from states import GameState
+from config import Config
+
+class RewindBuffer:
+    """
+    Keeps the packets of the last few seconds of received states, for pausing and rewinding live games.
+
+    Packets are kept as received, back to back in one preallocated byte ring, so memory is fixed no matter the packet rate.
+    Once the ring is full (or a packet is older than the time limit), the oldest packets are dropped.
+    Both limits are read from the config, the ring is allocated with the first packet and changing the memory limit clears it.
+
+    Every packet has a sequence number that keeps counting up as old packets are dropped.
+    """
+    def __init__(self, config: Config):
+        self.config = config
+        self.lock = threading.Lock()
+
+        self.data = bytearray(0)
+        self.write_pos = 0
+
+        # Parallel lists of the packets, the live ones start at self.head
+        self.times = []
+        self.starts = []
+        self.sizes = []
+        self.head = 0
+        self.base_seq = 0 # Sequence number of list index 0
+
+    def get_max_bytes(self) -> int:
+        return int(self.config.rewind_memory_mb.val * 1024 * 1024)
+
+    def reallocate(self):
+        self.data = bytearray(self.get_max_bytes())
+        self.write_pos = 0
+        self.base_seq += len(self.times)
+        self.times, self.starts, self.sizes = [], [], []
+        self.head = 0
+
+    def add(self, data: bytes, recv_time: float):
+        with self.lock:
+            if len(self.data) != self.get_max_bytes():
+                self.reallocate()
+
+            size = len(data)
+            if size > len(self.data):
+                return
+
+            if self.write_pos + size > len(self.data):
+                # Not enough room before the end, so drop the packets there and wrap around
+                while self.head < len(self.times) and self.starts[self.head] >= self.write_pos:
+                    self.head += 1
+                self.write_pos = 0
+
+            # Drop the oldest packets where this one will go
+            write_end = self.write_pos + size
+            while self.head < len(self.times) and self.write_pos <= self.starts[self.head] < write_end:
+                self.head += 1
+
+            self.data[self.write_pos:write_end] = data
+            self.times.append(recv_time)
+            self.starts.append(self.write_pos)
+            self.sizes.append(size)
+            self.write_pos = write_end
+
+            # Drop packets past the time limit
+            min_time = recv_time - self.config.rewind_seconds.val
+            while self.head < len(self.times) - 1 and self.times[self.head] < min_time:
+                self.head += 1
+
+            # Every so often, actually remove the dropped packets from the lists
+            if self.head > 1024 and self.head * 2 > len(self.times):
+                del self.times[:self.head], self.starts[:self.head], self.sizes[:self.head]
+                self.base_seq += self.head
+                self.head = 0
+
+    def clear(self):
+        with self.lock:
+            self.base_seq += len(self.times)
+            self.times, self.starts, self.sizes = [], [], []
+            self.head = 0
+            self.write_pos = 0
+
+    def get_seq_range(self):
+        """(first, end) sequence numbers of the packets kept"""
+        with self.lock:
+            return self.base_seq + self.head, self.base_seq + len(self.times)
+
+    def find(self, packet_time: float) -> int:
+        """Sequence number of the last packet at or before the time, or the first packet if there is none"""
+        with self.lock:
+            idx = bisect.bisect_right(self.times, packet_time, lo=self.head) - 1
+            return self.base_seq + max(idx, self.head)
+
+    def get_time(self, seq: int):
+        """Receive time of a kept packet, or None if it's been dropped"""
+        with self.lock:
+            idx = seq - self.base_seq
+            if not (self.head <= idx < len(self.times)):
+                return None
+            return self.times[idx]
+
+    def get(self, seq: int):
+        """(time, packet) of a kept packet, or None if it's been dropped"""
+        with self.lock:
+            idx = seq - self.base_seq
+            if not (self.head <= idx < len(self.times)):
+                return None
+            start = self.starts[idx]
+            return self.times[idx], bytes(self.data[start:start + self.sizes[idx]])
+
+class RewindViewer:
+    """
+    Shows states from a RewindBuffer in place of the live ones while paused.
+    The buffer keeps taking in live states while paused, so resuming jumps straight back to live.
+    """
+    def __init__(self, buffer: RewindBuffer):
+        self.buffer = buffer
+        self.state = GameState()
+
+        self.is_paused = False
+        self.seq = -1
+        self.applied_seq = -1
+
+    def toggle_pause(self):
+        if self.is_paused:
+            self.is_paused = False
+            return
+
+        first_seq, end_seq = self.buffer.get_seq_range()
+        if end_seq == first_seq:
+            return
+        self.is_paused = True
+        self.show(end_seq - 1)
+
+    def step(self, count: int):
+        if not self.is_paused:
+            self.toggle_pause()
+        self.show(self.seq + count)
+
+    def skip(self, delta_time: float):
+        if not self.is_paused:
+            self.toggle_pause()
+        packet_time = self.buffer.get_time(self.seq)
+        if not (packet_time is None):
+            self.show(self.buffer.find(packet_time + delta_time))
+
+    def show(self, seq: int):
+        first_seq, end_seq = self.buffer.get_seq_range()
+        if end_seq == first_seq:
+            return
+        seq = min(max(seq, first_seq), end_seq - 1)
+
+        # Apply the packet before too, unless it's what we're showing, so the state's previous physics are right
+        if seq - 1 != self.applied_seq:
+            prev_packet = self.buffer.get(seq - 1)
+            if not (prev_packet is None):
+                packet_reader.apply_packet(self.state, prev_packet[1])
+
+        packet = self.buffer.get(seq)
+        if packet is None or not packet_reader.apply_packet(self.state, packet[1]):
+            return
+
+        self.seq = self.applied_seq = seq
+
+        # Show it right away, no interpolation
+        self.state.recv_time = time.time()
+        self.state.recv_interval = 0
+
+    def get_status_text(self) -> str:
+        first_seq, end_seq = self.buffer.get_seq_range()
+        packet_time = self.buffer.get_time(self.seq)
+        last_packet_time = self.buffer.get_time(end_seq - 1)
+        if packet_time is None or last_packet_time is None:
+            return "Rewind: paused (state dropped from buffer)"
+
+        return "Rewind: paused at {:.2f}s (state {}/{})".format(
+            packet_time - last_packet_time, self.seq - first_seq + 1, end_seq - first_seq
+        )
@@ -1,34 +1,48 @@
-from collections import deque
-
-from pyrr import Vector3
-
-class RibbonPoint:
-    def __init__(self, pos, vel):
-        self.pos = pos
-        self.vel = vel
-        self.time_active = 0
-        self.connected = True
+import numpy as np
 
 class RibbonEmitter:
-    def __init__(self):
-        self.points = deque()
+    """
+    Emits ribbon points into fixed-capacity ring buffers.
+    Once full, the oldest points are overwritten.
+    """
+    def __init__(self, capacity: int = 500):
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 3), dtype=np.float32)
+        self.vel = np.zeros((capacity, 3), dtype=np.float32)
+        self.time_active = np.zeros(capacity, dtype=np.float32)
+        self.connected = np.zeros(capacity, dtype=bool)
+
+        self.next_idx = 0 # Where the next point is written
+        self.count = 0 # Number of live points, ending at next_idx
         self.time_since_emit = 0
 
+    def clear(self):
+        self.count = 0
+
+    def get_order(self) -> np.ndarray:
+        """Buffer indices of the live points, newest first"""
+        return (self.next_idx - 1 - np.arange(self.count)) % self.capacity
+
     def update(self, can_emit, emit_delay, emit_pos, emit_vel, lifetime, delta_time):
         if self.time_since_emit < emit_delay:
             self.time_since_emit += delta_time
-            if len(self.points) > 0:
-                self.points[0].connected = False
+            if self.count > 0:
+                self.connected[(self.next_idx - 1) % self.capacity] = False
         elif can_emit:
             self.time_since_emit = 0
 
-            new_point = RibbonPoint(emit_pos, emit_vel)
-            self.points.insert(0, new_point)
+            idx = self.next_idx
+            self.pos[idx] = emit_pos
+            self.vel[idx] = emit_vel
+            self.time_active[idx] = 0
+            self.connected[idx] = True
+            self.next_idx = (idx + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
 
-        for point in self.points:
-            point.pos += point.vel * delta_time
-            point.time_active += delta_time
+        # Dead slots are moved too, it's cheaper than selecting the live ones
+        self.pos += self.vel * delta_time
+        self.time_active += delta_time
 
-        # Remove dead points
-        while len(self.points) > 0 and self.points[-1].time_active > lifetime:
-            self.points.pop()
\ No newline at end of file
+        # Points are emitted in order, so the dead ones are always the oldest
+        if self.count > 0:
+            self.count = int(np.count_nonzero(self.time_active[self.get_order()] <= lifetime))
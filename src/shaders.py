@@ -127,4 +127,135 @@ void main() {
     gl_Position = m_vp * m_model * vec4(in_position, 1.0);
     windowPosition = in_position.xy;
 }
-'''
\ No newline at end of file
+'''
+# Most tiles drawn at once in grid mode, see Renderer.render_grid()
+MAX_GRID_TILES = 16
+
+# For instanced shaders that can draw into several viewport tiles in one draw, each instance has a tile index
+# Every tile has its own camera and rect in normalized device coords (scale xy, offset xy), tile 0 is the whole viewport
+# The clip distances keep each instance inside its tile, when GL_CLIP_DISTANCE0 to 3 are enabled
+TILE_VERT_FUNCS = '''
+uniform mat4 m_vps[%d];
+uniform vec4 tileRects[%d];
+
+vec4 tile_position(int tile, vec3 world_pos) {
+    vec4 clip_pos = m_vps[tile] * vec4(world_pos, 1.0);
+    gl_ClipDistance[0] = clip_pos.w + clip_pos.x;
+    gl_ClipDistance[1] = clip_pos.w - clip_pos.x;
+    gl_ClipDistance[2] = clip_pos.w + clip_pos.y;
+    gl_ClipDistance[3] = clip_pos.w - clip_pos.y;
+
+    vec4 rect = tileRects[tile];
+    return vec4(clip_pos.xy * rect.xy + rect.zw * clip_pos.w, clip_pos.zw);
+}
+''' % (MAX_GRID_TILES, MAX_GRID_TILES)
+
+# Boost pads, drawn instanced with one draw per pad mesh
+# Instances that don't use the mesh being drawn are collapsed outside of the view
+PAD_VERT_SHADER = '''
+#version 330
+
+uniform float padScale;
+uniform vec2 padType; // (is_big, is_active) of the mesh being drawn
+
+in vec3 in_position;
+in vec4 in_normal;
+in vec2 in_texcoord_0;
+
+in vec3 in_pad_pos;
+in vec2 in_pad_flags; // (is_big, is_active)
+in float in_tile;
+
+out FD {
+	vec3 vert;
+	vec3 norm;
+	vec2 text;
+} outData;
+''' + TILE_VERT_FUNCS + '''
+void main() {
+    outData.vert = in_position;
+    outData.norm = in_normal.xyz;
+    outData.text = in_texcoord_0;
+
+    if (in_pad_flags != padType) {
+        gl_Position = vec4(0, 0, 2, 1);
+        return;
+    }
+
+    gl_Position = tile_position(int(in_tile), in_position * padScale + in_pad_pos);
+}
+'''
+
+# Cars, drawn instanced with a per-instance model matrix and team texture layer
+CAR_VERT_SHADER = '''
+#version 330
+
+in vec3 in_position;
+in vec4 in_normal;
+in vec2 in_texcoord_0;
+
+in mat4 in_model;
+in float in_team;
+in float in_tile;
+in vec4 in_tint;
+
+out FD {
+	vec3 vert;
+	vec3 norm;
+	vec2 text;
+} outData;
+
+flat out float texLayer;
+flat out vec4 tint;
+''' + TILE_VERT_FUNCS + '''
+void main() {
+    outData.vert = in_position;
+    outData.norm = mat3(in_model) * in_normal.xyz;
+    outData.text = in_texcoord_0;
+    texLayer = in_team;
+    tint = in_tint;
+    gl_Position = tile_position(int(in_tile), (in_model * vec4(in_position, 1.0)).xyz);
+}
+'''
+
+# Same shading as FRAG_SHADER, but each instance samples its own layer of a texture array
+# Instances with a tint (alpha above 0) are blended towards its color and drawn with its alpha, for ghosts
+CAR_FRAG_SHADER = FRAG_SHADER.replace(
+    "uniform sampler2D Texture;",
+    "uniform sampler2DArray Texture;\nflat in float texLayer;\nflat in vec4 tint;"
+).replace(
+    "texture(Texture, inData.text)",
+    "texture(Texture, vec3(inData.text, texLayer))"
+).replace(
+    "        f_color = globalColor;\n",
+    "        f_color = globalColor;\n\n    if (tint.a > 0)\n        f_color = vec4(mix(f_color.rgb, tint.rgb, 0.6), tint.a);\n"
+)
+
+# Debug lines, with a color per vertex
+LINE_VERT_SHADER = '''
+#version 330
+
+uniform mat4 m_vp;
+
+in vec3 in_position;
+in vec4 in_color;
+
+out vec4 color;
+
+void main() {
+    color = in_color;
+    gl_Position = m_vp * vec4(in_position, 1.0);
+}
+'''
+
+LINE_FRAG_SHADER = '''
+#version 330
+
+in vec4 color;
+
+out vec4 f_color;
+
+void main() {
+    f_color = color;
+}
+'''
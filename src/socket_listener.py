@@ -1,60 +1,175 @@
 import socket
 
 import state_manager
-import json
+import packet_reader
+from state_recording import StateRecorder
+from rewind_buffer import RewindBuffer
+from packet_fragments import FragmentAssembler, is_fragment
 
 import time
-import traceback
 
 class SocketListener:
-    def __init__(self):
+    # How long drain mode waits for the renderer to pick up the last state before applying another anyway
+    DRAIN_FRAME_WAIT = 0.1
+
+    # Kernel receive buffer to ask for, so the fragments of large packets aren't dropped while we're busy
+    # NOTE: The OS can cap this (net.core.rmem_max on Linux)
+    RECV_BUFFER_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, drain: bool = False, recorder: StateRecorder = None, rewind_buffer: RewindBuffer = None):
         self.has_received: bool = False
-        self.buffer_size: int = 1024 * 1024
+        self.buffer_size: int = 64 * 1024 # Largest UDP datagram, bigger packets are sent as fragments
         self.should_run = True
 
+        # State we read packets into, published to global_state_manager after every packet
+        # Each env gets its own, so switching back to an env keeps its cumulative rewards and pad locations
+        self.env_states = {}
+        self.env_shown = {} # Env id -> if its last packet was shown
+        self.prev_recv_times = {}
+        self.env_id = None # Env published to global_state_manager
+        self.state = state_manager.GameState()
+
+        # Packets too big for one datagram are put back together here before anything else
+        self.fragments = FragmentAssembler()
+
+        # In drain mode, only the newest datagram queued on the socket is decoded and applied,
+        # and at most one state is applied per rendered frame
+        # NOTE: Rewards from dropped packets are not accumulated
+        self.drain = drain
+        self.packets_applied = 0
+        self.packets_dropped = 0
+
+        # Every accepted packet is also written here, if set
+        # Only the selected env's packets are accepted, so these follow env switches
+        self.recorder = recorder
+        self.rewind_buffer = rewind_buffer
+
+    def receive_latest(self, sock: socket.socket):
+        # Block (with timeout) until something arrives, then take whatever else is already queued
+        # Returns the newest packet of each shown env, see check_envs()
+        data, addr = sock.recvfrom(self.buffer_size)
+        latest = {}
+        for packet in self.check_envs(data, addr):
+            self.keep_latest(latest, packet)
+
+        sock.setblocking(False)
+        try:
+            while True:
+                try:
+                    data, addr = sock.recvfrom(self.buffer_size)
+                except OSError: # Nothing left to read
+                    break
+                for packet in self.check_envs(data, addr):
+                    self.keep_latest(latest, packet)
+        finally:
+            sock.settimeout(0.5)
+
+        return list(latest.values())
+
+    def keep_latest(self, latest: dict, packet):
+        data, env_id, is_new = packet
+        prev_packet = latest.get(env_id)
+        if not (prev_packet is None):
+            self.packets_dropped += 1
+            is_new = is_new or prev_packet[2]
+        latest[env_id] = (data, env_id, is_new)
+
+    def check_env(self, data):
+        """
+        Count the packet for its env, returns (packet, env id, is new) if the env is shown or None otherwise.
+        An env is new if its last packet wasn't shown (it's just been switched to).
+        """
+        env_id = packet_reader.peek_env_id(data)
+        is_shown = state_manager.global_env_table.update(env_id, time.time())
+        was_shown = self.env_shown.get(env_id, False)
+        self.env_shown[env_id] = is_shown
+        if is_shown:
+            return data, env_id, not was_shown
+        return None
+
+    def check_envs(self, data, addr) -> list:
+        """
+        check_env() for each packet of a datagram (many if it's a batch packet), returns those of shown envs.
+        Fragments are held on to until their packet is complete.
+        """
+        if is_fragment(data):
+            data = self.fragments.add(data, addr, time.time())
+            if data is None:
+                return []
+
+        packets = []
+        for env_data in packet_reader.split_packets(data):
+            packet = self.check_env(env_data)
+            if not (packet is None):
+                packets.append(packet)
+        return packets
+
+    def get_env_state(self, env_id: int) -> state_manager.GameState:
+        if not (env_id in self.env_states):
+            self.env_states[env_id] = state_manager.GameState()
+        return self.env_states[env_id]
+
+    def apply(self, data, env_id: int, is_new: bool):
+        state = self.get_env_state(env_id)
+        if not packet_reader.apply_packet(state, data):
+            return
+        env_table = state_manager.global_env_table
+
+        recv_time = time.time()
+        state.recv_time = recv_time
+        # After switching envs, show the first state right away instead of interpolating from an old one
+        state.recv_interval = 0 if is_new else recv_time - self.prev_recv_times.get(env_id, recv_time)
+        self.prev_recv_times[env_id] = recv_time
+
+        if env_table.publishes_env_states():
+            env_table.get_state_manager(env_id).publish(state)
+
+        if env_id != env_table.selected_id:
+            return
+
+        if env_id != self.env_id:
+            self.env_id = env_id
+            # Rewinding shouldn't go back into another env's states
+            if not (self.rewind_buffer is None):
+                self.rewind_buffer.clear()
+
+        self.state = state
+        if not (self.recorder is None):
+            self.recorder.record(data, recv_time)
+        if not (self.rewind_buffer is None):
+            self.rewind_buffer.add(data, recv_time)
+
+        state_manager.global_state_manager.frame_consumed.clear()
+        state_manager.global_state_manager.publish(state)
+
+        self.packets_applied += 1
+
     def run(self, bind_addr: str, port_num: int):
         sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
         sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECV_BUFFER_SIZE)
         sock.bind((bind_addr, port_num))
         sock.settimeout(0.5)
         print("Created socket on {}:{}, listening...".format(bind_addr, port_num))
-        prev_recv_time = time.time()
         while self.should_run:
+            if self.drain:
+                # Let packets pile up on the socket until the renderer has used the last state
+                state_manager.global_state_manager.frame_consumed.wait(self.DRAIN_FRAME_WAIT)
+
             try:
-                data, addr = sock.recvfrom(self.buffer_size)
+                if self.drain:
+                    packets = self.receive_latest(sock)
+                else:
+                    data, addr = sock.recvfrom(self.buffer_size)
+                    packets = self.check_envs(data, addr)
             except:
                 continue
 
             has_received: True
 
-            try:
-                j = json.loads(data.decode("utf-8"))
-            except json.decoder.JSONDecodeError as err:
-                print("ERROR parsing received text to JSON:", err)
-
-                view_range = 10
-                start, stop = max(0, err.pos - view_range), min(err.pos + view_range, len(err.doc) - 1)
-                snippet = err.doc[start:stop].replace('\r', '').replace('\n', ' ')
-                snippet_prefix = "Received JSON: "
-                underline = (' ' * (len(snippet)//2 + len(snippet_prefix))) + '^ HERE'
-                print("\t" + snippet_prefix + snippet)
-                print("\t" + underline)
-                j = None
-
-            if not (j is None):
-                recv_time = time.time()
-
-                with state_manager.global_state_mutex:
-                    try:
-                        state_manager.global_state_manager.state.read_from_json(j)
-                    except:
-                        print("ERROR reading received JSON:")
-                        traceback.print_exc()
-
-                    state_manager.global_state_manager.state.recv_time = recv_time
-                    state_manager.global_state_manager.state.recv_interval = recv_time - prev_recv_time
-
-                prev_recv_time = time.time()
+            # Envs that aren't shown are only counted, never decoded
+            for data, env_id, is_new in packets:
+                self.apply(data, env_id, is_new)
 
     def stop_async(self):
-        self.should_run = False
\ No newline at end of file
+        self.should_run = False
@@ -1,8 +1,208 @@
 from states import *
-from threading import Lock
+from threading import Lock, Event
 
 class StateManager:
-    state: GameState = GameState()
+    """
+    Triple-buffered handoff of finished GameState snapshots from the socket thread to the renderer.
+
+    The writer copies its state into the back buffer and publishes it, the reader acquires the newest
+    published buffer and keeps it as its front buffer for as long as it likes.
+    Only the buffer indices are swapped under the lock, so neither side ever waits on the other's work.
+    """
+    def __init__(self):
+        self.buffers = [GameState(), GameState(), GameState()]
+        self.back_idx = 0
+        self.ready_idx = 1
+        self.front_idx = 2
+        self.has_new = False
+        self.swap_lock = Lock()
+
+        self.publish_count = 0
+
+        # Set by the renderer whenever it has acquired a newly published snapshot
+        self.frame_consumed = Event()
+
+    def publish(self, state: GameState):
+        """Snapshot the writer's state, must only be called from one thread"""
+        state.copy_to(self.buffers[self.back_idx])
+        with self.swap_lock:
+            self.back_idx, self.ready_idx = self.ready_idx, self.back_idx
+            self.has_new = True
+            self.publish_count += 1
+
+    def acquire(self) -> GameState:
+        """Get the newest snapshot, which stays valid until the next acquire() call"""
+        with self.swap_lock:
+            if self.has_new:
+                self.front_idx, self.ready_idx = self.ready_idx, self.front_idx
+                self.has_new = False
+                self.frame_consumed.set()
+        return self.buffers[self.front_idx]
+
+class EnvInfo:
+    def __init__(self, env_id: int):
+        self.env_id = env_id
+        self.packet_count = 0
+        self.last_recv_time = 0
+        self.rate = 0 # Packets per second, over the last RATE_WINDOW
+
+        self.window_start_time = 0
+        self.window_count = 0
+
+class EnvTable:
+    """
+    Every env we've received packets from, and which ones are being shown.
+
+    The socket thread calls update() with each packet's env id (peeked, not decoded),
+    so only the shown envs' packets need to be fully decoded.
+    The first env seen is selected, the renderer can switch with cycle().
+
+    In grid mode, the grid_size envs starting from the selected one (by id) are shown too,
+    each published to its own StateManager from get_state_manager().
+    In ghost mode, every env is shown (so every packet is decoded), also through their own StateManagers.
+    """
+
+    # How often rates (and the envs in the grid) are updated
+    RATE_WINDOW = 1.0
+
+    # Envs we haven't heard from in this long are left out of the list (and cycling)
+    ENV_TIMEOUT = 10.0
+
+    # Most envs listed in the status text, starting from the selected one
+    MAX_LISTED_ENVS = 8
+
+    def __init__(self):
+        self.lock = Lock()
+        self.envs = {} # Env id -> EnvInfo
+        self.selected_id = None
+
+        self.grid_size = 0 # Number of envs shown in grid mode, 0 if not in grid mode
+        self.grid_ids = []
+        self.grid_id_set = frozenset()
+        self.grid_update_time = 0
+
+        self.ghosts_enabled = False
+
+        self.state_managers = {} # Env id -> StateManager, for envs shown in the grid or as ghosts
+
+    def update(self, env_id: int, recv_time: float) -> bool:
+        """Count a packet from an env, returns True if it's shown (selected or in the grid)"""
+        with self.lock:
+            info = self.envs.get(env_id)
+            if info is None:
+                info = self.envs[env_id] = EnvInfo(env_id)
+                info.window_start_time = recv_time
+                self.update_grid(recv_time)
+
+            info.packet_count += 1
+            info.last_recv_time = recv_time
+            info.window_count += 1
+            window_time = recv_time - info.window_start_time
+            if window_time >= self.RATE_WINDOW:
+                info.rate = info.window_count / window_time
+                info.window_start_time = recv_time
+                info.window_count = 0
+
+            if self.selected_id is None:
+                self.selected_id = env_id
+                self.update_grid(recv_time)
+            elif recv_time - self.grid_update_time >= self.RATE_WINDOW:
+                self.update_grid(recv_time)
+
+            return self.ghosts_enabled or env_id == self.selected_id or env_id in self.grid_id_set
+
+    def get_live_ids(self, cur_time: float) -> list:
+        """Ids of envs heard from recently (and the selected env), sorted, must hold the lock"""
+        return sorted(
+            info.env_id for info in self.envs.values()
+            if info.env_id == self.selected_id or cur_time - info.last_recv_time < self.ENV_TIMEOUT
+        )
+
+    def update_grid(self, cur_time: float):
+        """Pick the envs in the grid, must hold the lock"""
+        self.grid_update_time = cur_time
+        if self.grid_size == 0 or self.selected_id is None:
+            grid_ids = []
+        else:
+            env_ids = self.get_live_ids(cur_time)
+            start_idx = env_ids.index(self.selected_id)
+            grid_ids = [env_ids[(start_idx + i) % len(env_ids)] for i in range(min(self.grid_size, len(env_ids)))]
+
+        if grid_ids != self.grid_ids:
+            self.grid_ids = grid_ids
+            self.grid_id_set = frozenset(grid_ids)
+
+    def get_envs(self, cur_time: float) -> list:
+        """Envs heard from recently (and the selected env), by id"""
+        with self.lock:
+            return [self.envs[env_id] for env_id in self.get_live_ids(cur_time)]
+
+    def get_grid_ids(self) -> list:
+        return self.grid_ids
+
+    def get_ghost_ids(self, cur_time: float) -> list:
+        """Envs to draw as ghosts, every recent env but the selected one"""
+        if not self.ghosts_enabled:
+            return []
+        with self.lock:
+            return [env_id for env_id in self.get_live_ids(cur_time) if env_id != self.selected_id]
+
+    def publishes_env_states(self) -> bool:
+        """If shown envs should be published to their own StateManager, not just the selected env to global_state_manager"""
+        return self.ghosts_enabled or self.grid_size > 0
+
+    def set_ghosts_enabled(self, enabled: bool):
+        self.ghosts_enabled = enabled
+
+    def get_state_manager(self, env_id: int) -> StateManager:
+        with self.lock:
+            manager = self.state_managers.get(env_id)
+            if manager is None:
+                manager = self.state_managers[env_id] = StateManager()
+            return manager
+
+    def set_grid_size(self, grid_size: int, cur_time: float):
+        with self.lock:
+            self.grid_size = grid_size
+            self.update_grid(cur_time)
+
+    def cycle(self, steps: int, cur_time: float):
+        """Select the env steps ahead (or behind) of the selected one in the list"""
+        with self.lock:
+            env_ids = self.get_live_ids(cur_time)
+            if len(env_ids) == 0:
+                return
+
+            if self.selected_id in env_ids:
+                idx = env_ids.index(self.selected_id) + steps
+            else:
+                idx = 0
+            self.selected_id = env_ids[idx % len(env_ids)]
+            self.update_grid(cur_time)
+
+    def get_status_text(self, cur_time: float) -> str:
+        envs = self.get_envs(cur_time)
+        selected = self.envs.get(self.selected_id)
+        if len(envs) <= 1 or selected is None:
+            return ""
+
+        selected_idx = envs.index(selected)
+        text = "Env: {} ({}/{}, {:.1f}/s total)".format(
+            selected.env_id, selected_idx + 1, len(envs), sum(info.rate for info in envs)
+        )
+
+        # Every env and its rate, paging along with the selected env once there are too many to list
+        listed_count = min(len(envs), self.MAX_LISTED_ENVS)
+        for i in range(listed_count):
+            info = envs[(selected_idx + i) % len(envs)]
+            text += "\n{} {}: {:.1f}/s".format(">" if info is selected else " ", info.env_id, info.rate)
+        if listed_count < len(envs):
+            text += "\n  ... {} more".format(len(envs) - listed_count)
+
+        grid_ids = self.grid_ids
+        if len(grid_ids) > 0:
+            text += "\nGrid: envs " + ", ".join(str(env_id) for env_id in grid_ids)
+        return text
 
 global_state_manager = StateManager()
-global_state_mutex = Lock()
\ No newline at end of file
+global_env_table = EnvTable()
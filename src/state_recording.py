@@ -0,0 +1,289 @@
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+# Append-only recordings of received packets, see StateRecorder for the layout
+
+FILE_MAGIC = b"RSVR"
+CHUNK_MAGIC = b"RSVC"
+INDEX_MAGIC = b"RSVI"
+VERSION = 1
+
+# magic, version, reserved, wall clock start time
+FILE_HEADER_STRUCT = struct.Struct("<4sHHd")
+# magic, packet count, compressed payload size, payload crc32, first packet time, last packet time
+CHUNK_HEADER_STRUCT = struct.Struct("<4sIIIdd")
+# magic, chunk count, offset of the index
+INDEX_TRAILER_STRUCT = struct.Struct("<4sIQ")
+
+INDEX_ENTRY_DTYPE = np.dtype([
+    ("first_time", "<f8"),
+    ("last_time", "<f8"),
+    ("offset", "<u8"),
+    ("packet_count", "<u4"),
+])
+
+class StateRecorder:
+    """
+    Writes received packets (JSON or binary, as received) to an append-only recording file.
+
+    The file is a header, followed by zlib-compressed chunks, followed by an index of the chunks once closed.
+    Every packet is a full state, so the first packet of each chunk is a keyframe: state at any time can
+    be rebuilt by applying packets from the start of its chunk.
+    A new chunk is started every chunk_interval seconds (or chunk_max_bytes of packets),
+    and each chunk is written and flushed as soon as it's done, so the file can be read while it's being recorded.
+
+    Chunk payloads are the packet times (f64 seconds since the start of the recording),
+    then the packet sizes (u32), then the packets back to back.
+    Compression and writing happen on a background thread, so recording never blocks the socket thread.
+    """
+    def __init__(self, path: str, chunk_interval: float = 1.0, chunk_max_bytes: int = 4 * 1024 * 1024,
+                 compress_level: int = 6):
+        self.path = path
+        self.chunk_interval = chunk_interval
+        self.chunk_max_bytes = chunk_max_bytes
+        self.compress_level = compress_level
+
+        dir_path = os.path.dirname(path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        self.file = open(path, "wb")
+
+        self.start_time = time.time()
+        self.file.write(FILE_HEADER_STRUCT.pack(FILE_MAGIC, VERSION, 0, self.start_time))
+        self.file.flush()
+
+        self.chunk_times = []
+        self.chunk_packets = []
+        self.chunk_bytes = 0
+
+        self.index = [] # Tuples of INDEX_ENTRY_DTYPE
+        self.packets_recorded = 0
+        self.bytes_written = self.file.tell()
+
+        self.write_queue = queue.Queue()
+        self.writer_thread = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer_thread.start()
+
+    def record(self, data: bytes, recv_time: float):
+        packet_time = recv_time - self.start_time
+        if len(self.chunk_packets) > 0:
+            if (packet_time - self.chunk_times[0] >= self.chunk_interval) or (self.chunk_bytes >= self.chunk_max_bytes):
+                self.end_chunk()
+
+        self.chunk_times.append(packet_time)
+        self.chunk_packets.append(bytes(data))
+        self.chunk_bytes += len(data)
+        self.packets_recorded += 1
+
+    def end_chunk(self):
+        if len(self.chunk_packets) == 0:
+            return
+
+        self.write_queue.put((self.chunk_times, self.chunk_packets))
+        self.chunk_times = []
+        self.chunk_packets = []
+        self.chunk_bytes = 0
+
+    def close(self):
+        """Write the last chunk and the index"""
+        self.end_chunk()
+        self.write_queue.put(None)
+        self.writer_thread.join()
+
+        index = np.array(self.index, dtype=INDEX_ENTRY_DTYPE)
+        index_offset = self.file.tell()
+        self.file.write(index.tobytes())
+        self.file.write(INDEX_TRAILER_STRUCT.pack(INDEX_MAGIC, len(index), index_offset))
+        self.file.close()
+
+        print("Saved {} states in {} chunks to \"{}\" ({:.1f} MB)".format(
+            self.packets_recorded, len(index), self.path, os.path.getsize(self.path) / (1024 * 1024)
+        ))
+
+    def run_writer(self):
+        while True:
+            chunk = self.write_queue.get()
+            if chunk is None:
+                break
+
+            times, packets = chunk
+            payload = b"".join([
+                np.array(times, dtype="<f8").tobytes(),
+                np.array([len(packet) for packet in packets], dtype="<u4").tobytes(),
+                *packets
+            ])
+            compressed = zlib.compress(payload, self.compress_level)
+
+            offset = self.file.tell()
+            try:
+                self.file.write(CHUNK_HEADER_STRUCT.pack(
+                    CHUNK_MAGIC, len(packets), len(compressed), zlib.crc32(compressed), times[0], times[-1]
+                ))
+                self.file.write(compressed)
+                self.file.flush()
+            except OSError as err:
+                print("Failed to write state recording chunk:", err)
+                continue
+
+            self.index.append((times[0], times[-1], offset, len(packets)))
+            self.bytes_written = self.file.tell()
+
+class RecordingReader:
+    """
+    Reads a recording written by StateRecorder, memory-mapped so even very long recordings open instantly.
+    Uses the index if the recording was closed, otherwise scans the chunks written so far (see refresh()).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = None
+        self.map_size = 0
+        self.remap()
+
+        if self.map_size < FILE_HEADER_STRUCT.size:
+            raise ValueError("Recording is too small for its header")
+        magic, version, _, self.start_time = FILE_HEADER_STRUCT.unpack_from(self.map, 0)
+        if magic != FILE_MAGIC:
+            raise ValueError(f"Not a state recording (bad magic {magic})")
+        if version != VERSION:
+            raise ValueError(f"Unsupported state recording version {version}, expected {VERSION}")
+
+        self.index = np.zeros(0, dtype=INDEX_ENTRY_DTYPE)
+        self.is_complete = False
+        self.scan_offset = FILE_HEADER_STRUCT.size
+
+        # Most recently decompressed chunk, as (chunk index, times, packets)
+        self.cached_chunk = None
+
+        self.refresh()
+
+    def remap(self) -> bool:
+        """Map the file again if it has grown, returns True if it did"""
+        file_size = os.fstat(self.file.fileno()).st_size
+        if file_size == self.map_size:
+            return False
+
+        # The index may be a view of the old map, so the old map is left for the garbage collector to close
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.map_size = file_size
+        return True
+
+    def close(self):
+        self.index = None
+        self.cached_chunk = None
+        self.map = None
+        self.file.close()
+
+    def refresh(self):
+        """Pick up chunks written since the last refresh, returns True if any were found"""
+        if self.is_complete:
+            return False
+        self.remap()
+
+        # A closed recording ends with the index
+        if self.map_size >= self.scan_offset + INDEX_TRAILER_STRUCT.size:
+            magic, chunk_count, index_offset = INDEX_TRAILER_STRUCT.unpack_from(self.map, self.map_size - INDEX_TRAILER_STRUCT.size)
+            if magic == INDEX_MAGIC and index_offset + chunk_count * INDEX_ENTRY_DTYPE.itemsize + INDEX_TRAILER_STRUCT.size == self.map_size:
+                self.index = np.frombuffer(self.map, dtype=INDEX_ENTRY_DTYPE, count=chunk_count, offset=index_offset)
+                self.is_complete = True
+                return True
+
+        # Otherwise, find the chunks written so far by their headers
+        new_entries = []
+        while self.scan_offset + CHUNK_HEADER_STRUCT.size <= self.map_size:
+            magic, packet_count, compressed_size, _, first_time, last_time = CHUNK_HEADER_STRUCT.unpack_from(self.map, self.scan_offset)
+            chunk_end = self.scan_offset + CHUNK_HEADER_STRUCT.size + compressed_size
+            if magic != CHUNK_MAGIC or chunk_end > self.map_size:
+                break # Still being written
+
+            new_entries.append((first_time, last_time, self.scan_offset, packet_count))
+            self.scan_offset = chunk_end
+
+        if len(new_entries) == 0:
+            return False
+
+        self.index = np.concatenate((self.index, np.array(new_entries, dtype=INDEX_ENTRY_DTYPE)))
+        return True
+
+    def get_duration(self) -> float:
+        if len(self.index) == 0:
+            return 0
+        return float(self.index["last_time"][-1])
+
+    def find_chunk(self, packet_time: float) -> int:
+        """Index of the chunk with the last keyframe at or before the time"""
+        return max(int(np.searchsorted(self.index["first_time"], packet_time, side="right")) - 1, 0)
+
+    def find_packet(self, packet_time: float):
+        """(chunk index, packet index) of the last packet at or before the time, or the first packet if there is none"""
+        chunk_idx = self.find_chunk(packet_time)
+        times, _ = self.get_chunk(chunk_idx)
+        return chunk_idx, max(int(np.searchsorted(times, packet_time, side="right")) - 1, 0)
+
+    def get_previous_packet(self, chunk_idx: int, packet_idx: int):
+        """(chunk index, packet index) of the packet before this one, or None for the first packet"""
+        if packet_idx > 0:
+            return chunk_idx, packet_idx - 1
+        if chunk_idx > 0:
+            return chunk_idx - 1, int(self.index["packet_count"][chunk_idx - 1]) - 1
+        return None
+
+    def get_next_packet(self, chunk_idx: int, packet_idx: int):
+        """(chunk index, packet index) of the packet after this one, or None if it's the last packet so far"""
+        if packet_idx + 1 < int(self.index["packet_count"][chunk_idx]):
+            return chunk_idx, packet_idx + 1
+        if chunk_idx + 1 < len(self.index):
+            return chunk_idx + 1, 0
+        return None
+
+    def get_packet(self, chunk_idx: int, packet_idx: int):
+        """(time, packet) of a packet"""
+        times, packets = self.get_chunk(chunk_idx)
+        return float(times[packet_idx]), packets[packet_idx]
+
+    def get_chunk(self, chunk_idx: int):
+        """Like read_chunk(), but keeps the last chunk read around, as packets are mostly read in order"""
+        if self.cached_chunk is None or self.cached_chunk[0] != chunk_idx:
+            times, packets = self.read_chunk(chunk_idx)
+            self.cached_chunk = (chunk_idx, times, packets)
+        return self.cached_chunk[1], self.cached_chunk[2]
+
+    def read_chunk(self, chunk_idx: int):
+        """Get the (times, packets) of a chunk, times are seconds since the start of the recording"""
+        offset = int(self.index["offset"][chunk_idx])
+        magic, packet_count, compressed_size, crc, _, _ = CHUNK_HEADER_STRUCT.unpack_from(self.map, offset)
+        if magic != CHUNK_MAGIC:
+            raise ValueError(f"Bad chunk magic at offset {offset}")
+
+        data_offset = offset + CHUNK_HEADER_STRUCT.size
+        compressed = memoryview(self.map)[data_offset:data_offset + compressed_size]
+        try:
+            if zlib.crc32(compressed) != crc:
+                raise ValueError(f"Chunk at offset {offset} is corrupt (crc mismatch)")
+            payload = zlib.decompress(compressed)
+        finally:
+            compressed.release()
+
+        times = np.frombuffer(payload, dtype="<f8", count=packet_count)
+        sizes = np.frombuffer(payload, dtype="<u4", count=packet_count, offset=times.nbytes)
+        ends = np.cumsum(sizes) + (times.nbytes + sizes.nbytes)
+        starts = ends - sizes
+
+        packets = [payload[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+        return times, packets
+
+    def iter_packets(self, start_time: float = 0):
+        """Yield (time, packet) from the keyframe at or before start_time to the end of what's been written"""
+        chunk_idx = self.find_chunk(start_time)
+        while chunk_idx < len(self.index):
+            times, packets = self.read_chunk(chunk_idx)
+            for packet_time, packet in zip(times.tolist(), packets):
+                yield packet_time, packet
+            chunk_idx += 1
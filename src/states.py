@@ -8,6 +8,8 @@ import pyrr.vector3
 from const import *
 from shaders import *
 from ribbon import RibbonEmitter
+import binary_format
+import quat_math
 
 import numpy as np
 
@@ -15,73 +17,175 @@ from pyrr import Quaternion, Matrix33, Matrix44, Vector3
 
 import json
 
+TELEPORT_DIST_THRESH = 6000 * 0.15
+
+class PhysFrame:
+    """Interpolated physics of every object in a PhysArrays at one point in time"""
+    def __init__(self, pos: np.ndarray, vel: np.ndarray, rot: np.ndarray, teleporting: np.ndarray):
+        self.pos = pos # (N, 3)
+        self.vel = vel # (N, 3)
+        self.rot = rot # (N, 4) quaternions
+        self.forward, self.up = quat_math.quats_to_basis(rot) # (N, 3) each
+        self.teleporting = teleporting # (N,)
+
+    def set_rot(self, rows: slice, rot: np.ndarray):
+        """Replace the rotation of some rows, for rotations tracked outside the state (like the renderer's ball spin)"""
+        self.rot[rows] = rot
+        self.forward[rows], self.up[rows] = quat_math.quats_to_basis(self.rot[rows])
+
+class PhysArrays:
+    """
+    Columnar physics state of the ball (row 0) and all cars (rows 1 and up),
+    stored as contiguous float32 arrays so every object can be interpolated at once
+    """
+    VEC_FIELDS = (
+        "prev_pos", "next_pos",
+        "prev_vel", "next_vel",
+        "ang_vel"
+    )
+
+    # Rotations are (N, 4) quaternions, see quat_math
+    ROT_FIELDS = (
+        "prev_rot", "next_rot"
+    )
+
+    def __init__(self, count: int = 1):
+        self.count = 0
+        self.resize(count)
+
+    def resize(self, count: int):
+        """Resize to a new object count, keeping the rows that still exist"""
+        old_count = min(self.count, count)
+        for name in PhysArrays.VEC_FIELDS + PhysArrays.ROT_FIELDS:
+            if name in PhysArrays.ROT_FIELDS:
+                arr = quat_math.identity_quats(count)
+            else:
+                arr = np.zeros((count, 3), dtype=np.float32)
+            if old_count > 0:
+                arr[:old_count] = getattr(self, name)[:old_count]
+            setattr(self, name, arr)
+
+        has_rot = np.zeros(count, dtype=bool)
+        if old_count > 0:
+            has_rot[:old_count] = self.has_rot[:old_count]
+        self.has_rot = has_rot
+
+        self.count = count
+
+    def copy_to(self, other: 'PhysArrays'):
+        if other.count != self.count:
+            other.resize(self.count)
+        for name in PhysArrays.VEC_FIELDS + PhysArrays.ROT_FIELDS:
+            np.copyto(getattr(other, name), getattr(self, name))
+        np.copyto(other.has_rot, self.has_rot)
+
+    def read_rows(self, rows: slice, phys: np.ndarray, has_rot: np.ndarray):
+        """Read a block of rows from binary_format.PHYS_DTYPE records"""
+        self.prev_pos[rows] = self.next_pos[rows]
+        self.next_pos[rows] = phys["pos"]
+
+        # Only rows that have a rotation get it updated
+        prev_rot, next_rot = self.prev_rot[rows], self.next_rot[rows]
+        prev_rot[has_rot] = next_rot[has_rot]
+        next_rot[has_rot] = quat_math.quats_from_basis(phys["forward"][has_rot], phys["up"][has_rot])
+        self.has_rot[rows] = has_rot
+
+        self.prev_vel[rows] = self.next_vel[rows]
+        self.next_vel[rows] = phys["vel"]
+        self.ang_vel[rows] = phys["ang_vel"]
+
+    def get_teleporting(self) -> np.ndarray:
+        delta = self.next_pos - self.prev_pos
+        return np.einsum("ij,ij->i", delta, delta) >= TELEPORT_DIST_THRESH**2
+
+    def interpolate(self, interp_ratio: float) -> PhysFrame:
+        """Interpolate every object at once, teleporting objects stay at their previous state"""
+        teleporting = self.get_teleporting()
+        ratio = np.where(teleporting, 0, interp_ratio).astype(np.float32)[:, None]
+
+        pos = self.prev_pos + (self.next_pos - self.prev_pos) * ratio
+        vel = self.prev_vel + (self.next_vel - self.prev_vel) * ratio
+
+        # Objects without a rotation just use their latest one
+        rot_ratio = np.where(self.has_rot[:, None], ratio, np.float32(1))
+        rot = quat_math.quat_slerp(self.prev_rot, self.next_rot, rot_ratio)
+
+        return PhysFrame(pos, vel, rot, teleporting)
+
+    def rotate_with_ang_vel(self, rows, delta_time: float):
+        """Advance the latest rotation of some rows by their angular velocity"""
+        self.next_rot[rows] = quat_math.integrate_ang_vel(self.next_rot[rows], self.ang_vel[rows], delta_time)
+
+def _phys_row_property(name: str):
+    def getter(self) -> Vector3:
+        return Vector3(getattr(self.arrays, name)[self.idx].copy())
+
+    def setter(self, value):
+        getattr(self.arrays, name)[self.idx] = value
+
+    return property(getter, setter)
+
+def _phys_rot_property(name: str, axis_idx: int):
+    def getter(self) -> Vector3:
+        rot = getattr(self.arrays, name)[self.idx:self.idx + 1]
+        return Vector3(quat_math.quats_to_basis(rot)[axis_idx][0])
+
+    return property(getter)
+
 class PhysState:
-    def __init__(self):
-        self.prev_pos: Vector3 = Vector3((0, 0, 0))
-        self.next_pos: Vector3 = Vector3((0, 0, 0))
+    """A single object's row of a PhysArrays"""
+    def __init__(self, arrays: PhysArrays = None, idx: int = 0):
+        self.arrays = PhysArrays(1) if (arrays is None) else arrays
+        self.idx = idx
+
+    prev_pos = _phys_row_property("prev_pos")
+    next_pos = _phys_row_property("next_pos")
+
+    # Directions are derived from the rotation, use set_rot() to change them
+    prev_forward = _phys_rot_property("prev_rot", 0)
+    next_forward = _phys_rot_property("next_rot", 0)
+    prev_up = _phys_rot_property("prev_rot", 1)
+    next_up = _phys_rot_property("next_rot", 1)
 
-        self.prev_forward: Vector3 = Vector3((1, 0, 0))
-        self.next_forward: Vector3 = Vector3((1, 0, 0))
-        self.prev_up: Vector3 = Vector3((0, 0, 1))
-        self.next_up: Vector3 = Vector3((0, 0, 1))
+    prev_vel = _phys_row_property("prev_vel")
+    next_vel = _phys_row_property("next_vel")
+    ang_vel = _phys_row_property("ang_vel")
 
-        self.has_rot: bool = False
-        self.prev_vel: Vector3 = Vector3((0, 0, 0))
-        self.next_vel: Vector3 = Vector3((0, 0, 0))
-        self.ang_vel: Vector3 = Vector3((0, 0, 0))
+    @property
+    def has_rot(self) -> bool:
+        return bool(self.arrays.has_rot[self.idx])
+
+    @has_rot.setter
+    def has_rot(self, value: bool):
+        self.arrays.has_rot[self.idx] = value
+
+    def set_rot(self, forward, up):
+        self.arrays.prev_rot[self.idx] = self.arrays.next_rot[self.idx]
+        self.arrays.next_rot[self.idx] = quat_math.quats_from_basis([forward], [up])[0]
 
     def rotate_with_ang_vel(self, delta_time: float):
-        next_right = self.next_up.cross(self.next_forward)
-        rot = Matrix33((
-            self.next_forward[0], next_right[0], self.next_up[0],
-            self.next_forward[1], next_right[1], self.next_up[1],
-            self.next_forward[2], next_right[2], self.next_up[2],
-        ))
-
-        quat = Quaternion.from_matrix(rot) # type: Quaternion
-
-        # https://stackoverflow.com/questions/24197182/efficient-quaternion-angular-velocity/24201879#24201879
-        s_ang_vel = self.ang_vel * delta_time # type: Vector3
-        length = s_ang_vel.length
-        half = length / 2
-        sin = math.sin(half)
-        cos = math.cos(half)
-        if length > 1e-8:
-            rot_quat = Quaternion((s_ang_vel.x * sin, s_ang_vel.y * sin, s_ang_vel.z * sin, length * cos))
-
-            new_quat = rot_quat * quat
-            new_rot = Matrix33.from_quaternion(new_quat)
-
-            self.next_forward = Vector3((
-                new_rot[0][0],
-                new_rot[1][0],
-                new_rot[2][0]
-            ))
-            self.next_up = Vector3((
-                new_rot[0][2],
-                new_rot[1][2],
-                new_rot[2][2]
-            ))
+        self.arrays.rotate_with_ang_vel(slice(self.idx, self.idx + 1), delta_time)
 
     def read_from_json(self, j):
         self.prev_pos = self.next_pos
-        self.next_pos = Vector3(j["pos"])
+        self.next_pos = j["pos"]
 
         if not (j.get("forward") is None):
-            self.prev_forward = self.next_forward
-            self.prev_up = self.next_up
-            self.next_forward = Vector3(j["forward"])
-            self.next_up = Vector3(j["up"])
+            self.set_rot(j["forward"], j["up"])
             self.has_rot = True
         else:
             self.has_rot = False
 
         self.prev_vel = self.next_vel
-        self.next_vel = Vector3(j["vel"])
-        self.ang_vel = Vector3(j["ang_vel"])
+        self.next_vel = j["vel"]
+        self.ang_vel = j["ang_vel"]
+
+    def copy_to(self, other: 'PhysState'):
+        for name in PhysArrays.VEC_FIELDS + PhysArrays.ROT_FIELDS:
+            getattr(other.arrays, name)[other.idx] = getattr(self.arrays, name)[self.idx]
+        other.has_rot = self.has_rot
 
     def is_teleporting(self):
-        TELEPORT_DIST_THRESH = 6000 * 0.15
         return (self.prev_pos - self.next_pos).squared_length >= TELEPORT_DIST_THRESH**2
 
     def get_pos(self, interp_ratio):
@@ -96,23 +200,21 @@ class PhysState:
         else:
             return self.prev_vel
 
-    def get_forward(self, interp_ratio):
-        if self.has_rot:
-            if not self.is_teleporting():
-                return (self.prev_forward + (self.next_forward - self.prev_forward) * interp_ratio).normalized
-            else:
-                return self.prev_forward
+    def get_rot(self, interp_ratio):
+        if self.has_rot and not self.is_teleporting():
+            return quat_math.quat_slerp(
+                self.arrays.prev_rot[self.idx:self.idx + 1], self.arrays.next_rot[self.idx:self.idx + 1], [interp_ratio]
+            )
+        elif self.has_rot:
+            return self.arrays.prev_rot[self.idx:self.idx + 1].copy()
         else:
-            return self.next_forward
+            return self.arrays.next_rot[self.idx:self.idx + 1].copy()
+
+    def get_forward(self, interp_ratio):
+        return Vector3(quat_math.quats_to_basis(self.get_rot(interp_ratio))[0][0])
 
     def get_up(self, interp_ratio):
-        if self.has_rot:
-            if not self.is_teleporting():
-                return (self.prev_up + (self.next_up - self.prev_up) * interp_ratio).normalized
-            else:
-                return self.prev_up
-        else:
-            return self.next_up
+        return Vector3(quat_math.quats_to_basis(self.get_rot(interp_ratio))[1][0])
 
 class ControllerInputs:
     def __init__(self):
@@ -139,6 +241,10 @@ class ControllerInputs:
         self.jump = j["jump"]
         self.handbrake = j["handbrake"]
 
+    def copy_to(self, other: 'ControllerInputs'):
+        # All plain values
+        other.__dict__.update(self.__dict__)
+
 class RewardInfo:
     """Per-reward info for a single player"""
     def __init__(self, name: str = "", value: float = 0.0):
@@ -176,12 +282,20 @@ class PlayerRewards:
         self.cumulative_rewards.clear()
         self.cumulative_total = 0.0
 
+    def copy_to(self, other: 'PlayerRewards'):
+        other.rewards = self.rewards # Replaced on every read, never modified
+        other.total_reward = self.total_reward
+        other.cumulative_rewards.clear()
+        other.cumulative_rewards.update(self.cumulative_rewards)
+        other.cumulative_total = self.cumulative_total
+
 class CarState:
-    def __init__(self):
+    def __init__(self, phys: PhysState = None):
         self.car_id: int = -1
         self.team_num: int = 0  # Blue = 0, orange = 1
 
-        self.phys: PhysState = PhysState()
+        # Row of the owning GameState's PhysArrays
+        self.phys: PhysState = PhysState() if (phys is None) else phys
 
         self.controls: ControllerInputs = ControllerInputs()
 
@@ -223,6 +337,35 @@ class CarState:
         # Parse reward info if available
         self.player_rewards.read_from_json(j)
 
+    def read_from_binary(self, rec):
+        """Read everything but physics, which GameState reads for all cars at once"""
+        flags = int(rec["flags"])
+        self.car_id = int(rec["car_id"])
+        self.team_num = int(rec["team_num"])
+
+        boost_amount = float(rec["boost_amount"])
+        self.controls.boost = bool(flags & binary_format.CAR_FLAG_BOOSTING)
+        self.is_boosting = (boost_amount < self.boost_amount) or self.controls.boost
+        self.boost_amount = boost_amount
+        self.on_ground = bool(flags & binary_format.CAR_FLAG_ON_GROUND)
+        self.has_flipped_or_double_jumped = bool(flags & binary_format.CAR_FLAG_HAS_FLIPPED_OR_DOUBLE_JUMPED)
+        self.is_demoed = bool(flags & binary_format.CAR_FLAG_IS_DEMOED)
+
+        # Binary packets carry no rewards
+        self.player_rewards.read_from_json({})
+
+    def copy_to(self, other: 'CarState'):
+        """Copy everything but physics, which GameState copies for all cars at once"""
+        other.car_id = self.car_id
+        other.team_num = self.team_num
+        self.controls.copy_to(other.controls)
+        other.boost_amount = self.boost_amount
+        other.is_boosting = self.is_boosting
+        other.on_ground = self.on_ground
+        other.has_flipped_or_double_jumped = self.has_flipped_or_double_jumped
+        other.is_demoed = self.is_demoed
+        self.player_rewards.copy_to(other.player_rewards)
+
 # From RLGym
 default_boost_pad_locations = (
     (0, -4240, 70), (-1792, -4184, 70), (1792, -4184, 70), (-3072, -4096, 73), (3072, -4096, 73),
@@ -237,27 +380,71 @@ default_boost_pad_locations = (
 class RenderState:
     MAX_LINES = 0x2000
     def __init__(self):
-        self.lines = []
+        self.lines = np.zeros((0, 6), dtype=np.float32) # Rows of (start, end)
+        self.line_colors = None # Optional rows of RGBA, white if not set
+
+    def check_line_count(self, line_count: int):
+        if line_count > RenderState.MAX_LINES:
+            raise Exception(f"Cannot render {line_count} lines, maximum is {RenderState.MAX_LINES}")
 
     def read_from_json(self, j):
         if not (j.get("lines") is None):
             lines = j["lines"]
-            if len(lines) > RenderState.MAX_LINES:
-                raise Exception(f"Cannot render {len(lines)} lines, maximum is {RenderState.MAX_LINES}")
 
-            for line in lines:
+            if len(lines) > 0 and not isinstance(lines[0], dict):
+                # Flat form, 6 floats per line and optionally 4 floats of color per line
+                if len(lines) % 6 != 0:
+                    raise Exception(f"Invalid flat lines length {len(lines)}, should be 6 floats (start, end) per line")
+                self.check_line_count(len(lines) // 6)
+                self.lines = np.array(lines, dtype=np.float32).reshape(-1, 6)
+
+                if not (j.get("line_colors") is None):
+                    colors = j["line_colors"]
+                    if len(colors) != len(self.lines) * 4:
+                        raise Exception(f"Invalid flat line colors length {len(colors)}, should be 4 floats (RGBA) per line")
+                    self.line_colors = np.array(colors, dtype=np.float32).reshape(-1, 4)
+                return
+
+            self.check_line_count(len(lines))
+
+            self.lines = np.empty((len(lines), 6), dtype=np.float32)
+            has_colors = any(("color" in line) for line in lines)
+            if has_colors:
+                self.line_colors = np.ones((len(lines), 4), dtype=np.float32)
+
+            for i, line in enumerate(lines):
                 try:
-                    start = Vector3(line["start"])
-                    end = Vector3(line["end"])
+                    self.lines[i, :3] = line["start"]
+                    self.lines[i, 3:] = line["end"]
                 except:
                     raise Exception(f"Invalid line format: \"{line}\", format should be [start:[x,y,z], end:[x,y,z]] with two elements")
 
-                self.lines.append([start, end])
+                if has_colors and ("color" in line):
+                    try:
+                        self.line_colors[i] = line["color"]
+                    except:
+                        raise Exception(f"Invalid line color: \"{line['color']}\", format should be [r,g,b,a] from 0 to 1")
+
+    def read_from_binary(self, lines: np.ndarray):
+        self.check_line_count(len(lines))
+
+        # Already flat (start, end) float rows, no need to build vectors
+        self.lines = lines
+
+    def is_same(self, other: 'RenderState') -> bool:
+        if not np.array_equal(self.lines, other.lines):
+            return False
+        if (self.line_colors is None) or (other.line_colors is None):
+            return (self.line_colors is None) and (other.line_colors is None)
+        return np.array_equal(self.line_colors, other.line_colors)
 
 
 class GameState:
     def __init__(self):
-        self.ball_state: PhysState = PhysState()
+        # Physics of the ball (row 0) and all cars (rows 1 and up)
+        self.phys_arrays: PhysArrays = PhysArrays(1)
+
+        self.ball_state: PhysState = PhysState(self.phys_arrays, 0)
         self.car_states = []
 
         self.boost_pad_locations = []
@@ -285,6 +472,16 @@ class GameState:
             return z >= 70
         return z >= 73
 
+    def set_render_state(self, render_state: RenderState):
+        # Keep the current render state if nothing changed, so the renderer knows it doesn't need to upload it again
+        if not render_state.is_same(self.render_state):
+            self.render_state = render_state
+
+    def set_car_count(self, car_count: int):
+        """Remake the cars array, keeping the ball"""
+        self.phys_arrays.resize(car_count + 1)
+        self.car_states = [CarState(PhysState(self.phys_arrays, i + 1)) for i in range(car_count)]
+
     def read_from_json(self, j):
 
         self.ball_state.read_from_json(j["ball_phys"])
@@ -292,11 +489,9 @@ class GameState:
         j_cars = j["cars"]
         if len(self.car_states) != len(j_cars):
             # Car amount changed, remake cars array
-            self.car_states = []
-            for j_car in j_cars:
-                car_state = CarState()
+            self.set_car_count(len(j_cars))
+            for car_state, j_car in zip(self.car_states, j_cars):
                 car_state.read_from_json(j_car)
-                self.car_states.append(car_state)
         else:
             # Update the cars we already have
             for i in range(len(self.car_states)):
@@ -362,13 +557,81 @@ class GameState:
                 self.boost_pad_meta = None
 
 
-        self.render_state = RenderState()
+        render_state = RenderState()
         if not (j.get("render") is None):
-            self.render_state.read_from_json(j["render"])
+            render_state.read_from_json(j["render"])
+        self.set_render_state(render_state)
         # Parse custom info lines for UI display
         self.custom_info = []
         if not (j.get("custom_info") is None):
             for entry in j["custom_info"]:
                 key = entry.get("key", "")
                 value = entry.get("value", "")
-                self.custom_info.append((key, value))
\ No newline at end of file
+                self.custom_info.append((key, value))
+
+    def copy_to(self, other: 'GameState'):
+        """
+        Copy this state into another, reusing the other state's objects where possible.
+        Members that are only ever replaced on read (never modified in place) are shared instead of copied.
+        """
+        if len(other.car_states) != len(self.car_states):
+            other.set_car_count(len(self.car_states))
+        self.phys_arrays.copy_to(other.phys_arrays)
+        for car_state, other_car_state in zip(self.car_states, other.car_states):
+            car_state.copy_to(other_car_state)
+
+        other.boost_pad_locations = self.boost_pad_locations
+        other.boost_pad_states = self.boost_pad_states
+        other._seen_boost_pads_list = self._seen_boost_pads_list
+        other.boost_pad_meta = self.boost_pad_meta
+
+        other.recv_time = self.recv_time
+        other.recv_interval = self.recv_interval
+
+        other.gamemode = self.gamemode
+        other.render_state = self.render_state
+        other.custom_info = self.custom_info
+
+    def read_from_binary(self, packet: np.void):
+        """Read a packet decoded by binary_format.decode_packet()"""
+        ball = packet["ball"]
+        cars = packet["cars"]
+        if len(self.car_states) != len(cars):
+            self.set_car_count(len(cars))
+
+        arrays = self.phys_arrays
+        ball_has_rot = np.array([ball["flags"] & binary_format.PHYS_FLAG_HAS_ROT], dtype=bool)
+        arrays.read_rows(slice(0, 1), np.atleast_1d(ball["phys"]), ball_has_rot)
+
+        old_car_pos = arrays.next_pos[1:].copy()
+        arrays.read_rows(slice(1, None), cars["phys"], (cars["flags"] & binary_format.CAR_FLAG_HAS_ROT) != 0)
+
+        # Detect episode reset: large position change indicates reset
+        reset_mask = np.linalg.norm(arrays.next_pos[1:] - old_car_pos, axis=1) > 3000
+        for i in np.flatnonzero(reset_mask):
+            self.car_states[i].player_rewards.reset_cumulative()
+
+        for car_state, rec in zip(self.car_states, cars):
+            car_state.read_from_binary(rec)
+
+        self.gamemode = binary_format.get_gamemode(packet)
+
+        if not self._seen_boost_pads_list:
+            if self.gamemode == "soccar":
+                if len(self.boost_pad_locations) != len(default_boost_pad_locations):
+                    self.boost_pad_locations = [Vector3(t) for t in default_boost_pad_locations]
+            else:
+                self.boost_pad_locations = []
+
+        pad_states = binary_format.get_pad_states(packet)
+        if pad_states is not None and len(pad_states) == len(self.boost_pad_locations):
+            self.boost_pad_states = pad_states.tolist()
+        else:
+            self.boost_pad_states = None
+
+        render_state = RenderState()
+        if len(packet["lines"]) > 0:
+            render_state.read_from_binary(packet["lines"])
+        self.set_render_state(render_state)
+
+        self.custom_info = []
@@ -122,6 +122,16 @@ class QEditConfigWidget(QWidget):
         self.camera_group.setLayout(self.camera_group_layout)
         self.layout().addWidget(self.camera_group)
 
+        self.rewind_group = QtWidgets.QGroupBox("Rewind")
+        self.rewind_group_layout = QtWidgets.QVBoxLayout(self)
+        self.rewind_group.setLayout(self.rewind_group_layout)
+        self.layout().addWidget(self.rewind_group)
+
+        self.ghost_group = QtWidgets.QGroupBox("Ghosts")
+        self.ghost_group_layout = QtWidgets.QVBoxLayout(self)
+        self.ghost_group.setLayout(self.ghost_group_layout)
+        self.layout().addWidget(self.ghost_group)
+
         for name, obj in self.config.__dict__.items():
             if isinstance(obj, ConfigVal):
                 config_val = obj # type: ConfigVal
@@ -130,6 +140,10 @@ class QEditConfigWidget(QWidget):
 
                 if name.startswith("camera_"):
                     self.camera_group_layout.addWidget(widget)
+                elif name.startswith("rewind_"):
+                    self.rewind_group_layout.addWidget(widget)
+                elif name.startswith("ghost_"):
+                    self.ghost_group_layout.addWidget(widget)
 
         self.footer_label = QtWidgets.QLabel("\n(Click outside this area to close settings)")
         # TODO: Kinda hacky, ideally use setDisabled(True) and add disabled color to stylesheet?